@@ -0,0 +1,120 @@
+"""
+Aggregation planner for one dashboard rerun
+Every section registers the measures it needs up front, and execute()
+computes them together: cube views share at most two passes over the
+filtered cube, and row-level measures share one count of the values of the
+selected rows, spread over a worker pool for large selections.
+"""
+import numpy as np
+import pandas as pd
+
+from parallel_scan import count_values, parallel_counts
+from sales_cube import axes_of
+
+
+def _row_values(column):
+    """Integer values to gather for a column: codes of a categorical, else the values
+
+    Missing values become -1, which count_values skips; a numeric column with
+    a missing value is float, so it is converted to int64 here.
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy()
+    values = column.to_numpy(dtype=np.float64, na_value=np.nan) if column.hasnans else column.to_numpy()
+    if values.dtype.kind == 'f':
+        present = ~np.isnan(values)
+        codes = np.full(len(values), -1, dtype=np.int64)
+        codes[present] = values[present]
+        return codes
+    return values
+
+
+def _count_distinct(counts):
+    """Distinct non-missing codes, from their per-code counts instead of hashing"""
+    return int(np.count_nonzero(counts))
+
+
+def histogram_bins(counts, bins, col):
+    """At most bins equal, whole-number-wide bins over the populated part of a per-value count vector
+
+    Returns one row per bin: its first value, the first value after it, and
+    the transactions it holds.
+    """
+    present = np.flatnonzero(counts)
+    if not len(present):
+        return pd.DataFrame({col: [], f'{col}_end': [], 'transactions': []})
+    low, span = present[0], present[-1] + 1 - present[0]
+    width = -(-span // bins)
+    per_bin = np.bincount((present - low) // width, weights=counts[present]).astype(np.int64)
+    starts = low + width * np.arange(len(per_bin))
+    return pd.DataFrame({col: starts, f'{col}_end': starts + width, 'transactions': per_bin})
+
+
+class AggregationPlan:
+    """Named measures for one rerun, resolved by a single execute() call"""
+
+    def __init__(self):
+        self.cube_requests = {}
+        self.row_requests = {}
+        self.stats = {}
+
+    def totals(self, name='totals'):
+        self.cube_requests[name] = ((), lambda view: view.totals())
+        return self
+
+    def by(self, col, name=None):
+        self.cube_requests[name or col] = (axes_of(col), lambda view: view.by(col))
+        return self
+
+    def by_month(self, name='month_year'):
+        self.cube_requests[name] = (axes_of('invoice_date'), lambda view: view.by_month())
+        return self
+
+    def by_weekday(self, name='day_of_week'):
+        self.cube_requests[name] = (axes_of('invoice_date'), lambda view: view.by_weekday())
+        return self
+
+    def pivot(self, index, columns, name=None):
+        name = name or f'{index}_by_{columns}'
+        self.cube_requests[name] = (axes_of(index, columns), lambda view: view.pivot(index, columns))
+        return self
+
+    def unique_customers(self, name='unique_customers'):
+        self.row_requests[name] = ('customer_id', _count_distinct)
+        return self
+
+    def histogram(self, col, bins=30, name=None):
+        """Transactions per bin of a small non-negative integer column such as age
+
+        The selected rows become a per-value count vector, binned here, so a
+        chart receives bins heights rather than one value per row.
+        """
+        def reduce(counts):
+            return histogram_bins(counts, bins, col)
+        self.row_requests[name or col] = (col, reduce)
+        return self
+
+    def execute(self, view, df=None, rows=None, selection=None):
+        """Compute every registered measure; returns {name: result}
+
+        rows is the FilterIndex.select() result of the filters; selection, their
+        select_bits() result, lets a large selection be counted by the worker pool.
+        """
+        view.prepare([keep for keep, _ in self.cube_requests.values()])
+        results = {name: build(view) for name, (_, build) in self.cube_requests.items()}
+
+        row_passes, parallel = 0, False
+        if self.row_requests:
+            # Every row-level measure reduces per-value counts of one column, so
+            # each needed column is counted once, by the worker pool if it is large
+            needed = {col: _row_values(df[col]) for col, _ in self.row_requests.values()}
+            counts = None if selection is None else parallel_counts(df, needed, rows, selection)
+            parallel = counts is not None
+            if not parallel:
+                counts = {col: count_values(values[rows]) for col, values in needed.items()}
+            for name, (col, reduce) in self.row_requests.items():
+                results[name] = reduce(counts[col])
+            row_passes = 1
+
+        self.stats = {'cube_passes': view.full_passes, 'row_passes': row_passes, 'parallel': parallel}
+        return results
@@ -0,0 +1,114 @@
+"""
+Transaction-value quantile sketches
+Each date x category x mall x gender cell keeps a DDSketch of its transaction
+amounts: counts per logarithmic bucket, so that every value in a bucket lies
+within RELATIVE_ACCURACY of the bucket's representative value. Sketches merge
+by adding bucket counts, so the median or p90/p99 of any filter combination
+comes from the cells it selects, and appended rows only add counts.
+
+Cells are also merged per month x category x mall x gender. A date range
+reads the month cells of the whole months it covers and the day cells of the
+partial months at its ends, so a query costs in proportion to the month cells
+and the edge days it touches rather than to every day in the range.
+
+Every quantile returned is within RELATIVE_ACCURACY (default 1%) of an
+actual transaction amount of that rank.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from customer_sketch import append_entries, cell_entries, collapse_entries, select_entries
+
+RELATIVE_ACCURACY = float(os.environ.get('RETAIL_QUANTILE_ACCURACY', 0.01))
+# Quantiles shown on the dashboards: median, p90 and p99 transaction value
+PERCENTILES = (0.5, 0.9, 0.99)
+# Non-positive amounts share one bucket, below every logarithmic one
+ZERO_BUCKET = np.iinfo(np.int16).min
+
+
+def _month_starts(dates):
+    return dates.astype('datetime64[M]').astype('datetime64[D]')
+
+
+def _by_month(entries):
+    """Entries re-dated to the first day of their month"""
+    return dict(entries, date=_month_starts(entries['date']))
+
+
+class AmountSketch:
+    """Sparse DDSketch bucket counts of total_amount per (date, category, mall, gender) cell
+
+    entries holds the day cells and months the same counts merged per month,
+    dated by the month's first day.
+    """
+
+    def __init__(self, records, base=None, accuracy=RELATIVE_ACCURACY):
+        """Sketch the amounts of transaction rows; with base, base plus records"""
+        self.accuracy = accuracy if base is None else base.accuracy
+        self.gamma = (1 + self.accuracy) / (1 - self.accuracy)
+        self.labels, entries, dated = cell_entries(records, None if base is None else base.labels)
+        amounts = dated['total_amount'].to_numpy(dtype=np.float64)
+        present = ~np.isnan(amounts)
+        entries = {name: values[present] for name, values in entries.items()}
+        entries['bucket'] = self.buckets(amounts[present])
+        entries['count'] = np.ones(len(entries['bucket']), dtype=np.int64)
+        if base is None:
+            self.entries = self._add_counts(entries)
+            self.months = self._add_counts(_by_month(self.entries))
+        else:
+            self.entries = append_entries(base.entries, entries, self._add_counts)
+            self.months = append_entries(base.months, _by_month(entries), self._add_counts)
+        # Percentiles of the whole dataset, the baseline of filtered ones
+        self.overall = self.quantiles(PERCENTILES)
+
+    @staticmethod
+    def _add_counts(entries):
+        return collapse_entries(entries, 'bucket', 'count', np.add)
+
+    def buckets(self, amounts):
+        """Bucket of each amount: ceil(log_gamma(amount))"""
+        buckets = np.full(len(amounts), ZERO_BUCKET, dtype=np.int16)
+        positive = amounts > 0
+        buckets[positive] = np.ceil(np.log(amounts[positive]) / np.log(self.gamma))
+        return buckets
+
+    def values(self, buckets):
+        """Representative amount of each bucket, within the relative accuracy of its members"""
+        values = 2 * np.power(self.gamma, buckets.astype(np.float64)) / (self.gamma + 1)
+        return np.where(buckets == ZERO_BUCKET, 0.0, values)
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for entries in (self.entries, self.months) for values in entries.values())
+
+    def _selected(self, date_range, filters):
+        """(entries, slice, mask) pieces covering the cells matching the filters"""
+        if date_range is None:
+            return [(self.months,) + select_entries(self.months, self.labels, None, *filters)]
+        start, end = (np.datetime64(pd.Timestamp(value).date(), 'D') for value in date_range)
+        # Whole months run from the first month start on or after start to the last month ending by end
+        first_full = (start.astype('datetime64[M]') + int(_month_starts(start) != start)).astype('datetime64[D]')
+        after_full = _month_starts(end + 1)
+        if first_full >= after_full:
+            return [(self.entries,) + select_entries(self.entries, self.labels, (start, end), *filters)]
+        day = np.timedelta64(1, 'D')
+        return [(self.months,) + select_entries(self.months, self.labels, (first_full, after_full - day), *filters),
+                (self.entries,) + select_entries(self.entries, self.labels, (start, first_full - day), *filters),
+                (self.entries,) + select_entries(self.entries, self.labels, (after_full, end), *filters)]
+
+    def quantiles(self, qs, date_range=None, categories=None, malls=None, genders=None):
+        """{q: amount} for the cells matching the filters; NaN when no transaction matches"""
+        pieces = self._selected(date_range, (categories, malls, genders))
+        buckets = np.concatenate([entries['bucket'][cells][keep] for entries, cells, keep in pieces])
+        weights = np.concatenate([entries['count'][cells][keep] for entries, cells, keep in pieces])
+        # Counts per bucket, indexed from ZERO_BUCKET, the lowest one
+        counts = np.bincount(buckets.astype(np.int64) - ZERO_BUCKET, weights=weights)
+        if not counts.sum():
+            return {q: float('nan') for q in qs}
+        # Rank q * (n - 1), as in DDSketch: the first bucket whose cumulative count passes it
+        cumulative = np.cumsum(counts)
+        ranks = np.asarray(qs, dtype=np.float64) * (cumulative[-1] - 1)
+        found = np.searchsorted(cumulative, ranks, side='right') + ZERO_BUCKET
+        return dict(zip(qs, self.values(found).tolist()))
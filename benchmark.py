@@ -0,0 +1,148 @@
+"""
+Benchmark the analytics behind one dashboard rerun
+Compares the original per-section pandas code (a filter mask chain plus one
+scan of the filtered rows per KPI, chart and footer insight) with the bitmap
+index, sales cube and fused aggregation plan the dashboards now use, then
+times the row-level counts in the script thread against the worker pool.
+
+Usage: python benchmark.py [customer_shopping_data.csv] [runs]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import parallel_scan
+from aggregation_plan import AggregationPlan, _row_values
+from filter_index import FilterIndex, selected_rows
+from parallel_scan import count_values, parallel_counts
+from sales_cube import SalesCube
+from sales_data import DATA_FILE, dimensions, load_sales_data
+
+
+def random_filters(dims, dates, rng):
+    """A sidebar state: date range plus category/mall/gender selections"""
+    start, end = sorted(rng.choice(dates, 2))
+    pick = lambda values: list(rng.choice(values, rng.integers(1, len(values) + 1), replace=False))
+    return (start, end), pick(dims['category']), pick(dims['shopping_mall']), pick(dims['gender'])
+
+
+def legacy_rerun(df, date_range, categories, malls, genders):
+    """The original per-section code; returns the number of scans over row data"""
+    filtered_df = df[
+        (df['invoice_date'] >= pd.to_datetime(date_range[0])) &
+        (df['invoice_date'] <= pd.to_datetime(date_range[1])) &
+        (df['category'].isin(categories)) &
+        (df['shopping_mall'].isin(malls)) &
+        (df['gender'].isin(genders))
+    ]
+    passes = [
+        lambda: filtered_df['total_amount'].sum(),
+        lambda: filtered_df['total_amount'].mean(),
+        lambda: filtered_df['customer_id'].nunique(),
+        lambda: filtered_df['quantity'].mean(),
+        lambda: filtered_df.groupby('month_year', observed=True)['total_amount'].sum(),
+        lambda: filtered_df.groupby('category', observed=True)['total_amount'].sum(),
+        lambda: filtered_df.groupby('shopping_mall', observed=True)['total_amount'].sum(),
+        lambda: filtered_df.groupby('payment_method', observed=True)['total_amount'].sum(),
+        lambda: filtered_df.groupby('gender', observed=True).agg({'total_amount': 'sum', 'customer_id': 'count'}),
+        lambda: filtered_df.pivot_table(values='total_amount', index='category', columns='shopping_mall',
+                                        aggfunc='sum', fill_value=0, observed=True),
+        lambda: filtered_df.groupby('day_of_week', observed=True)['total_amount'].agg(['sum', 'count']),
+        lambda: filtered_df.groupby('category', observed=True)['total_amount'].sum().idxmax(),
+        lambda: filtered_df.groupby('shopping_mall', observed=True)['total_amount'].sum().idxmax(),
+        lambda: filtered_df.groupby('payment_method', observed=True)['customer_id'].count().idxmax(),
+    ]
+    for run in passes:
+        run()
+    # Five full-table masks plus one pass per section
+    return 5 + len(passes)
+
+
+def planned_rerun(df, index, cube, date_range, categories, malls, genders):
+    """The dashboards' current path; returns the number of passes it made"""
+    selection = index.select_bits(date_range=date_range, categories=categories, malls=malls, genders=genders)
+    rows = selected_rows(*selection)
+    view = cube.slice(date_range=date_range, categories=categories, malls=malls, genders=genders)
+    plan = AggregationPlan()
+    plan.totals()
+    plan.unique_customers()
+    plan.histogram('age', bins=30)
+    plan.by_month()
+    for col in ['category', 'shopping_mall', 'payment_method', 'gender']:
+        plan.by(col)
+    plan.pivot('category', 'shopping_mall')
+    plan.by_weekday()
+    plan.execute(view, df, rows, selection)
+    return plan.stats['cube_passes'] + plan.stats['row_passes']
+
+
+def row_scan_timings(df, index, runs):
+    """Serial and worker-pool times of the row-level counts, for a slice and for a row array"""
+    needed = {col: _row_values(df[col]) for col in ['customer_id', 'age']}
+    malls = list(df['shopping_mall'].cat.categories)
+    for label, filters in [('all rows', {}), ('half the malls', {'malls': malls[::2]})]:
+        selection = index.select_bits(**filters)
+        rows = selected_rows(*selection)
+        start = time.perf_counter()
+        for _ in range(runs):
+            serial = {col: count_values(values[rows]) for col, values in needed.items()}
+        serial_s = (time.perf_counter() - start) / runs
+        if parallel_scan.WORKERS < 2:
+            print(f"{label:>15}: serial {serial_s * 1000:7.1f} ms; worker pool off (RETAIL_WORKERS < 2)")
+            continue
+        # Counted by the pool whatever the selection size; the first call starts the
+        # workers and copies the columns into shared memory
+        threshold, parallel_scan.PARALLEL_MIN_ROWS = parallel_scan.PARALLEL_MIN_ROWS, 0
+        try:
+            start = time.perf_counter()
+            counts = parallel_counts(df, needed, rows, selection)
+            first_s = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(runs):
+                counts = parallel_counts(df, needed, rows, selection)
+            parallel_s = (time.perf_counter() - start) / runs
+        finally:
+            parallel_scan.PARALLEL_MIN_ROWS = threshold
+        assert all(np.array_equal(np.trim_zeros(counts[col], 'b'), np.trim_zeros(serial[col], 'b'))
+                   for col in needed)
+        print(f"{label:>15}: serial {serial_s * 1000:7.1f} ms; {parallel_scan.WORKERS} workers "
+              f"{parallel_s * 1000:7.1f} ms (first call {first_s * 1000:.0f} ms)")
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else DATA_FILE
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    start = time.perf_counter()
+    df = load_sales_data(path)
+    print(f"Loaded {len(df):,} rows in {time.perf_counter() - start:.2f}s")
+    # One month of one mall: only its month's file and the row groups holding that mall are read
+    first = df['invoice_date'].min()
+    month = (first.replace(day=1), first + pd.offsets.MonthEnd(0))
+    start = time.perf_counter()
+    narrow = load_sales_data(path, date_range=month, malls=[df['shopping_mall'].iloc[0]])
+    print(f"Loaded one month of one mall ({len(narrow):,} rows) in {time.perf_counter() - start:.2f}s")
+    start = time.perf_counter()
+    index, cube = FilterIndex(df), SalesCube(df)
+    print(f"Built index and cube in {time.perf_counter() - start:.2f}s")
+
+    rng = np.random.default_rng(0)
+    dims = dimensions(df)
+    dates = df['invoice_date'].dropna().dt.date.unique()
+    scenarios = [random_filters(dims, dates, rng) for _ in range(runs)]
+
+    for label, rerun in [('legacy', lambda args: legacy_rerun(df, *args)),
+                         ('planned', lambda args: planned_rerun(df, index, cube, *args))]:
+        start = time.perf_counter()
+        passes = [rerun(args) for args in scenarios]
+        elapsed = (time.perf_counter() - start) / runs
+        print(f"{label:>8}: {elapsed * 1000:8.1f} ms/rerun, {np.mean(passes):4.1f} passes over the data")
+
+    print(f"Row-level counts of {len(df):,} rows:")
+    row_scan_timings(df, index, runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+GPT answer cache
+Analysts on the same default filters keep asking the same questions. Answers
+are cached process-wide per data version and filter state, chat mode, model
+options and normalized question, for RETAIL_ANSWER_TTL_S seconds (default
+one hour) within a RETAIL_ANSWER_CACHE_MB memory budget (default 8). A
+question asked while an identical one is still being answered follows that
+answer's stream instead of paying for a second API call. If the session
+that started the call stops reading it (a rerun, say), a follower takes the
+open stream over and keeps reading it for everyone else. A call nobody is
+left to read is closed.
+"""
+import os
+import re
+import threading
+import time
+
+from chat_client import DEADLINE_S, GPTBusyError
+from result_cache import TTLCache
+
+
+def normalize_question(question):
+    """Case, spacing and trailing punctuation do not make a different question"""
+    return re.sub(r'\s+', ' ', question).strip().rstrip('?!. ').lower()
+
+
+def answer_key(summary_key, mode, options, question):
+    """Cache key of an answer; summary_key is (store key, filter state), as for carry_over()"""
+    store_key, filter_state = summary_key
+    return (store_key, filter_state, mode, tuple(sorted(options.items())), normalize_question(question))
+
+
+class _Flight:
+    """An answer being streamed, which identical requests can follow"""
+
+    def __init__(self):
+        self.parts = []
+        self.done = False
+        self.error = None
+        # Set when the session reading the call stopped and nobody could take it over
+        self.abandoned = False
+        # The call's iterator, left by a session that stopped reading it, for a follower to take over
+        self.source = None
+        self.followers = 0
+        self.started = time.perf_counter()
+        self.condition = threading.Condition()
+
+    def join(self):
+        """Register a follower; False when the call was abandoned and must be made again"""
+        with self.condition:
+            if self.abandoned:
+                return False
+            self.followers += 1
+            return True
+
+    def add(self, part):
+        with self.condition:
+            self.parts.append(part)
+            self.condition.notify_all()
+
+    def finish(self, error=None):
+        with self.condition:
+            self.done, self.error = True, error
+            self.condition.notify_all()
+
+    def hand_over(self, source):
+        """Leave source to a follower; False (and abandoned) when there is none"""
+        with self.condition:
+            if self.followers:
+                self.source = source
+                self.condition.notify_all()
+                return True
+            self.abandoned = True
+            return False
+
+
+class AnswerCache(TTLCache):
+    """Cached answers with in-flight sharing; values are (text, seconds it took)"""
+
+    def __init__(self, name, max_bytes, ttl):
+        super().__init__(name, max_bytes, ttl)
+        self.flights = {}
+        self.shared = 0
+        self.saved_seconds = 0.0
+
+    def stream(self, key, answer):
+        """Yield the answer for key: cached, shared from an identical call in flight, or from answer()
+
+        answer() returns an iterator of text parts. Only answers that complete
+        are cached; an error raised by answer() reaches every follower.
+        """
+        missing = object()
+        while True:
+            with self.lock:
+                flight = self.flights.get(key)
+            if flight is None:
+                cached = self.get(key, missing)
+                if cached is not missing:
+                    text, seconds = cached
+                    with self.lock:
+                        self.saved_seconds += seconds
+                    yield text
+                    return
+                with self.lock:
+                    # Another session may have started the same call meanwhile
+                    flight = self.flights.get(key)
+                    if flight is None:
+                        flight = self.flights[key] = _Flight()
+                        leader = True
+                    else:
+                        leader = False
+            else:
+                leader = False
+
+            if leader:
+                yield from self._drive(key, flight, iter(answer()))
+                return
+            if flight.join():
+                with self.lock:
+                    self.shared += 1
+                    self.saved_seconds += time.perf_counter() - flight.started
+                yield from self._follow(key, flight)
+                return
+            # Abandoned before anyone followed it: make the call again
+
+    def _drive(self, key, flight, source):
+        """Read the call's parts into the flight, handing it over if this reader stops early"""
+        try:
+            for part in source:
+                flight.add(part)
+                yield part
+        except GeneratorExit:
+            # This session stopped reading, e.g. it reran; a follower continues the call
+            if not flight.hand_over(source):
+                if hasattr(source, 'close'):
+                    source.close()
+                self._land(key)
+            raise
+        except BaseException as error:
+            flight.finish(error)
+            self._land(key)
+            raise
+        self.put(key, (''.join(flight.parts), time.perf_counter() - flight.started))
+        flight.finish()
+        self._land(key)
+
+    def _follow(self, key, flight):
+        """Yield the flight's parts so far, then each new one; take the call over if its reader stops
+
+        Waits are bounded by the request deadline: GPTBusyError when no part
+        arrives for DEADLINE_S seconds.
+        """
+        seen, following = 0, True
+        try:
+            while True:
+                source = None
+                with flight.condition:
+                    if not flight.condition.wait_for(
+                            lambda: len(flight.parts) > seen or flight.done or flight.source is not None,
+                            timeout=DEADLINE_S):
+                        raise GPTBusyError("The AI assistant did not get an answer in time; please try again shortly.")
+                    parts, done, error = flight.parts[seen:], flight.done, flight.error
+                    if not parts and not done and flight.source is not None:
+                        source, flight.source = flight.source, None
+                        flight.followers -= 1
+                        following = False
+                seen += len(parts)
+                yield from parts
+                if source is not None:
+                    yield from self._drive(key, flight, source)
+                    return
+                if done and seen == len(flight.parts):
+                    if error is not None:
+                        raise RuntimeError(f"The identical request this answer was shared from failed: {error}")
+                    return
+        finally:
+            if following:
+                with flight.condition:
+                    flight.followers -= 1
+                    # The last follower left before claiming a handed-over call: nobody will read it
+                    orphan = flight.source if not flight.followers else None
+                    if orphan is not None:
+                        flight.source, flight.abandoned = None, True
+                if orphan is not None:
+                    if hasattr(orphan, 'close'):
+                        orphan.close()
+                    self._land(key)
+
+    def _land(self, key):
+        with self.lock:
+            self.flights.pop(key, None)
+
+    def savings(self):
+        """Calls shared with an identical one in flight, and seconds of answer time saved by hits and sharing"""
+        with self.lock:
+            return {'shared': self.shared, 'saved_s': round(self.saved_seconds, 2)}
+
+
+# GPT answers, shared by all sessions
+answer_cache = AnswerCache('gpt answers', int(os.environ.get('RETAIL_ANSWER_CACHE_MB', 8)) * 2 ** 20,
+                           float(os.environ.get('RETAIL_ANSWER_TTL_S', 3600)))
@@ -0,0 +1,164 @@
+"""
+Shared GPT client
+One long-lived OpenAI client per API key serves every session, so questions
+reuse its pooled keep-alive connections instead of paying for a new
+connection and TLS handshake each time. Calls go through a scheduler:
+
+- at most RETAIL_GPT_CONCURRENCY requests in flight (default 8);
+- token buckets for RETAIL_GPT_RPM requests (default 500) and RETAIL_GPT_TPM
+  tokens (default 200,000) per minute, charged the prompt's estimated tokens
+  plus max_tokens, so a burst queues instead of running into 429s;
+- retries with exponential backoff and jitter on 429s, timeouts, connection
+  errors and 5xx responses, honouring Retry-After;
+- a deadline of RETAIL_GPT_DEADLINE_S seconds per question (default 90)
+  covering the queueing, every attempt, the backoff in between and the
+  streamed answer. A question that takes several requests (tool rounds)
+  passes the same deadline to each of them.
+
+A request that cannot start or finish before its deadline raises
+GPTBusyError, which the chat shows as a busy notice rather than an error.
+"""
+import json
+import os
+import random
+import threading
+import time
+
+MAX_CONCURRENCY = int(os.environ.get('RETAIL_GPT_CONCURRENCY', 8))
+REQUESTS_PER_MINUTE = int(os.environ.get('RETAIL_GPT_RPM', 500))
+TOKENS_PER_MINUTE = int(os.environ.get('RETAIL_GPT_TPM', 200_000))
+DEADLINE_S = float(os.environ.get('RETAIL_GPT_DEADLINE_S', 90))
+# Timeout of one attempt, capped by what is left of the deadline
+ATTEMPT_TIMEOUT_S = float(os.environ.get('RETAIL_GPT_TIMEOUT_S', 30))
+MAX_ATTEMPTS = int(os.environ.get('RETAIL_GPT_ATTEMPTS', 5))
+BACKOFF_S = 0.5
+
+
+class GPTBusyError(Exception):
+    """The request could not be served before its deadline"""
+
+
+def question_deadline():
+    """Deadline of a question asked now, as a time.monotonic() value"""
+    return time.monotonic() + DEADLINE_S
+
+
+class TokenBucket:
+    """Rate limit of per_minute units, refilled continuously
+
+    Reservations may take the bucket below zero; later callers then wait for
+    the refill in the order they reserved, so a burst is spread out evenly.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount, deadline):
+        """Take amount units, sleeping until they are available; GPTBusyError if that is after deadline"""
+        amount = min(float(amount), self.capacity)
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = max(0.0, (amount - self.tokens) / self.rate)
+            if now + wait > deadline:
+                raise GPTBusyError("The AI assistant is at its request rate limit; please try again shortly.")
+            self.tokens -= amount
+        time.sleep(wait)
+
+
+def estimate_tokens(messages, options):
+    """Tokens a request may use: about 4 characters per prompt token, plus the completion budget"""
+    prompt = len(json.dumps(messages)) + len(json.dumps(options.get('tools', [])))
+    return prompt // 4 + int(options.get('max_tokens') or 0)
+
+
+def _retry_after(error):
+    """Seconds a 429 or 503 response asks the client to wait, if it says"""
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class GPTClient:
+    """A long-lived OpenAI client behind the shared scheduler"""
+
+    def __init__(self, client, slots, requests, tokens):
+        self.client = client
+        self.slots = slots
+        self.requests = requests
+        self.tokens = tokens
+
+    def _retryable(self, error):
+        import openai
+        if isinstance(error, openai.RateLimitError):
+            # An exhausted quota does not recover by waiting
+            return getattr(error, 'code', None) != 'insufficient_quota'
+        return isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError))
+
+    def stream_chat(self, messages, deadline=None, **options):
+        """Yield the chunks of a streamed chat completion, scheduled and retried
+
+        deadline is the question's, a time.monotonic() value (default: now
+        plus DEADLINE_S). Attempts are retried until the first chunk has been
+        yielded; after that an error is raised to the caller, who has shown
+        part of the answer.
+        """
+        if deadline is None:
+            deadline = question_deadline()
+        cost = estimate_tokens(messages, options)
+        for attempt in range(MAX_ATTEMPTS):
+            self.requests.reserve(1, deadline)
+            self.tokens.reserve(cost, deadline)
+            if not self.slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                raise GPTBusyError("The AI assistant is busy with other questions; please try again shortly.")
+            started = False
+            try:
+                timeout = max(0.001, min(ATTEMPT_TIMEOUT_S, deadline - time.monotonic()))
+                # Closing the stream hands its connection back to the pool, even if the caller stops early
+                with self.client.chat.completions.create(messages=messages, stream=True,
+                                                         timeout=timeout, **options) as stream:
+                    for chunk in stream:
+                        started = True
+                        yield chunk
+                        # The read timeout bounds each chunk, not the whole answer
+                        if time.monotonic() > deadline:
+                            raise GPTBusyError("The AI assistant did not finish its answer in time; "
+                                               "please try again shortly.")
+                return
+            except Exception as error:
+                if started or attempt == MAX_ATTEMPTS - 1 or not self._retryable(error):
+                    raise
+                delay = _retry_after(error) or BACKOFF_S * 2 ** attempt * (1 + random.random())
+                if time.monotonic() + delay >= deadline:
+                    raise GPTBusyError("The AI assistant did not get an answer in time; please try again shortly.") from error
+            finally:
+                self.slots.release()
+            time.sleep(delay)
+
+
+# One client per API key and endpoint, sharing the process-wide limits
+_clients = {}
+_clients_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+_requests = TokenBucket(REQUESTS_PER_MINUTE)
+_tokens = TokenBucket(TOKENS_PER_MINUTE)
+
+
+def gpt_client(api_key):
+    """The shared GPTClient for api_key (and OPENAI_BASE_URL, when set)"""
+    from openai import OpenAI
+
+    key = (api_key, os.environ.get('OPENAI_BASE_URL'))
+    with _clients_lock:
+        if key not in _clients:
+            # Retries are done by the scheduler, which knows the deadline
+            _clients[key] = GPTClient(OpenAI(api_key=api_key, max_retries=0, timeout=ATTEMPT_TIMEOUT_S),
+                                      _slots, _requests, _tokens)
+        return _clients[key]
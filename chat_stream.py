@@ -0,0 +1,72 @@
+"""
+Streamed GPT answers
+Answers are requested with stream=True and shown as their tokens arrive, so
+the first words appear after the time to first token rather than after the
+whole answer of up to max_tokens tokens. Tool calls arrive in pieces too and
+are assembled here for chat_tools.
+"""
+import time
+
+# Leads the chat's notices that the assistant is busy or out of time
+BUSY_NOTICE = '⏳'
+
+
+def stream_completion(client, messages, deadline=None, **options):
+    """Yield the text deltas of a streamed chat completion
+
+    client is a chat_client.GPTClient, deadline the question's (see
+    GPTClient.stream_chat) and options are passed on to
+    chat.completions.create. The generator's return value (for yield from)
+    is (full text, tool calls as message dicts).
+    """
+    parts = []
+    calls = {}
+    for chunk in client.stream_chat(messages, deadline=deadline, **options):
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            parts.append(delta.content)
+            yield delta.content
+        # Each tool call is spread over deltas sharing its index
+        for call in delta.tool_calls or []:
+            entry = calls.setdefault(call.index, {'id': None, 'type': 'function',
+                                                  'function': {'name': '', 'arguments': ''}})
+            if call.id:
+                entry['id'] = call.id
+            if call.function is not None:
+                entry['function']['name'] += call.function.name or ''
+                entry['function']['arguments'] += call.function.arguments or ''
+    return ''.join(parts), [calls[index] for index in sorted(calls)]
+
+
+class TimedStream:
+    """A text stream that records its time to first token and total time, in seconds
+
+    With a deadline (a time.monotonic() value), a stream still going past it
+    is closed and ends with a busy notice.
+    """
+
+    def __init__(self, pieces, deadline=None):
+        self.pieces = pieces
+        self.deadline = deadline
+        self.first_token = None
+        self.total = None
+
+    def __iter__(self):
+        start = time.perf_counter()
+        pieces = iter(self.pieces)
+        try:
+            for piece in pieces:
+                if self.first_token is None and piece:
+                    self.first_token = time.perf_counter() - start
+                yield piece
+                if self.deadline is not None and time.monotonic() > self.deadline:
+                    # A stream that gave up at the deadline has already said so
+                    if not piece.startswith(BUSY_NOTICE):
+                        yield f"\n\n{BUSY_NOTICE} The AI assistant did not finish its answer in time; please try again shortly."
+                    break
+        finally:
+            if hasattr(pieces, 'close'):
+                pieces.close()
+        self.total = time.perf_counter() - start
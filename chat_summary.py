@@ -0,0 +1,90 @@
+"""
+GPT chat context
+The assistant answers from a compact summary of the filtered data: daily,
+per-category, per-mall and per-payment figures plus a few overview numbers.
+Sums and counts come from the sales cube; distinct customers per day and the
+average age take one pass over the selected rows' codes. A summary and its
+JSON text are cached per filter state and shared by every session, so
+follow-up questions against the same filters skip straight to the API call.
+"""
+import json
+import os
+
+import numpy as np
+
+from parallel_scan import count_values
+from result_cache import LRUCache
+from sales_cube import axes_of
+
+
+def _daily_customers(df, rows, dates):
+    """Distinct customers per entry of dates (sorted datetime64[D]) among the selected rows"""
+    days = df['invoice_date'].to_numpy()[rows].astype('datetime64[D]')
+    customers = df['customer_id'].cat.codes.to_numpy()[rows].astype(np.int64)
+    known = ~np.isnat(days) & (customers >= 0)
+    # One key per (day, customer) pair; distinct keys per day are its distinct customers
+    width = len(df['customer_id'].cat.categories)
+    pairs = np.unique(np.searchsorted(dates, days[known]) * width + customers[known])
+    return np.bincount(pairs // max(width, 1), minlength=len(dates)).astype(np.int64)
+
+
+def _columns(table, labels, names, decimals=None):
+    """{label: [value, ...]} from columns of a per-value table; decimals rounds the float ones"""
+    values = [np.round(table[name].to_numpy(), decimals) if decimals is not None and table[name].dtype.kind == 'f'
+              else table[name].to_numpy() for name in names]
+    return dict(zip(labels, map(list, zip(*(column.tolist() for column in values)))))
+
+
+def data_summary(view, df, rows):
+    """Summary of the selected transactions for the GPT context
+
+    view is the cube sliced by the same filters that selected rows (a
+    FilterIndex.select() result) from df.
+    """
+    view.prepare([axes_of('invoice_date')] + [axes_of(col) for col in
+                                              ['category', 'shopping_mall', 'payment_method', 'gender']])
+    daily = view.by_date()
+    dates = daily['invoice_date'].to_numpy()
+    daily['customers'] = _daily_customers(df, rows, dates)
+    categories = view.by('category')
+    categories['avg_trans'] = categories['total_amount'] / categories['transactions']
+    malls = view.by('shopping_mall')
+    payments = view.by('payment_method')
+    genders = view.by('gender')
+
+    totals = view.totals()
+    ages = df['age'].to_numpy()[rows].astype(np.float64)
+    ages = ages[~np.isnan(ages)]
+    day_labels = np.datetime_as_string(dates, unit='D').tolist()
+    return {
+        "overview": {
+            "total_revenue": float(totals['total_amount']),
+            "total_transactions": int(totals['transactions']),
+            "unique_customers": int(np.count_nonzero(count_values(df['customer_id'].cat.codes.to_numpy()[rows]))),
+            "date_range": [day_labels[0], day_labels[-1]] if day_labels else []
+        },
+        "daily": _columns(daily, day_labels, ['total_amount', 'transactions', 'customers'], decimals=2),
+        "categories": _columns(categories, categories['category'],
+                               ['total_amount', 'avg_trans', 'transactions', 'quantity'], decimals=2),
+        "malls": _columns(malls, malls['shopping_mall'], ['total_amount', 'transactions'], decimals=2),
+        "payments": _columns(payments, payments['payment_method'], ['total_amount', 'transactions'], decimals=2),
+        "demographics": {
+            "avg_age": float(ages.mean()) if len(ages) else float('nan'),
+            "gender": dict(zip(genders['gender'], genders['transactions'].tolist()))
+        }
+    }
+
+
+def cached_summary(summary_key, build):
+    """(summary, its JSON text) for a (store key, filter state) pair, memoized across sessions
+
+    build() returns the data_summary() for that pair on a miss.
+    """
+    def compute():
+        summary = build()
+        return summary, json.dumps(summary, indent=2)
+    return summary_cache.get_or_compute(tuple(summary_key), compute)
+
+
+# Chat summaries and their JSON per filter state, shared by all sessions
+summary_cache = LRUCache('chat summaries', int(os.environ.get('RETAIL_SUMMARY_CACHE_MB', 16)) * 2 ** 20)
@@ -0,0 +1,202 @@
+"""
+GPT query tools
+In tool-calling mode the assistant's prompt holds only the schema, the
+dimension values and the dashboard's filters, so its size does not depend on
+the date range. The model asks for the figures it needs by calling query
+functions, which run against the in-memory sales cube (and customer sketches)
+and are confined to the dashboard's filters.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from chat_client import question_deadline
+from chat_stream import stream_completion
+
+# Model round trips per question before it must answer with what it has
+MAX_TOOL_ROUNDS = int(os.environ.get('RETAIL_CHAT_TOOL_ROUNDS', 5))
+# Rows returned by one breakdown call; longer ones are cut to the top rows
+MAX_TOOL_ROWS = 100
+
+# Breakdown dimension -> CubeView method and argument
+BREAKDOWNS = {
+    'date': ('by_date', None),
+    'month': ('by_month', None),
+    'weekday': ('by_weekday', None),
+    'category': ('by', 'category'),
+    'shopping_mall': ('by', 'shopping_mall'),
+    'gender': ('by', 'gender'),
+    'payment_method': ('by', 'payment_method'),
+}
+MEASURES = ['total_amount', 'transactions', 'quantity', 'avg_transaction']
+# Tool argument -> cube dimension it filters
+FILTER_ARGUMENTS = {'categories': 'category', 'malls': 'shopping_mall',
+                    'genders': 'gender', 'payment_methods': 'payment_method'}
+
+
+def _filter_properties(dims):
+    properties = {
+        'start_date': {'type': 'string', 'description': 'First invoice date, YYYY-MM-DD (inclusive)'},
+        'end_date': {'type': 'string', 'description': 'Last invoice date, YYYY-MM-DD (inclusive)'},
+    }
+    for argument, col in FILTER_ARGUMENTS.items():
+        properties[argument] = {'type': 'array', 'items': {'type': 'string', 'enum': list(dims[col])},
+                                'description': f'Only these {col} values (default: all)'}
+    return properties
+
+
+def tool_definitions(dims):
+    """OpenAI tool schemas of the query functions"""
+    filters = _filter_properties(dims)
+    return [
+        {'type': 'function', 'function': {
+            'name': 'sales_totals',
+            'description': 'Revenue, transactions, items sold, average transaction value and '
+                           'estimated unique customers for a date range and filters.',
+            'parameters': {'type': 'object', 'properties': filters},
+        }},
+        {'type': 'function', 'function': {
+            'name': 'sales_by',
+            'description': 'Measures per value of one dimension (per date, month, weekday, category, '
+                           'mall, gender or payment method), sorted by a measure; use limit for top-N.',
+            'parameters': {'type': 'object', 'required': ['dimension'], 'properties': {
+                'dimension': {'type': 'string', 'enum': list(BREAKDOWNS)},
+                'sort_by': {'type': 'string', 'enum': MEASURES,
+                            'description': 'Measure to sort by (default total_amount; dates and months '
+                                           'stay in calendar order when omitted)'},
+                'ascending': {'type': 'boolean', 'description': 'Smallest first (default false)'},
+                'limit': {'type': 'integer', 'description': f'Number of rows to return (at most {MAX_TOOL_ROWS})'},
+                **filters,
+            }},
+        }},
+    ]
+
+
+def _rounded(value):
+    if isinstance(value, (float, np.floating)):
+        return round(float(value), 2)
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+
+class SalesQueries:
+    """Query functions the assistant can call, confined to the dashboard's filters
+
+    date_range and the selections are the sidebar state; a tool call can
+    narrow them but never widen them. None leaves a filter unapplied.
+    """
+
+    def __init__(self, cube, customers, dims, date_range=None, categories=None, malls=None, genders=None):
+        self.cube = cube
+        self.customers = customers
+        self.dims = dims
+        self.date_range = None if date_range is None else tuple(pd.Timestamp(value).normalize() for value in date_range)
+        self.scope = {'category': categories, 'shopping_mall': malls, 'gender': genders, 'payment_method': None}
+        self.tools = tool_definitions(dims)
+
+    def describe(self):
+        """Prompt text stating the schema, dimension values and the dashboard's filters"""
+        lines = [f"- {col}: {', '.join(map(str, self.dims[col]))}" for col in FILTER_ARGUMENTS.values()]
+        if self.date_range is None:
+            dates = 'all dates'
+        else:
+            dates = ' to '.join(value.strftime('%Y-%m-%d') for value in self.date_range)
+        lines.append(f"- dashboard date range: {dates}")
+        for col, selected in self.scope.items():
+            if selected is not None and set(selected) != set(self.dims[col]):
+                lines.append(f"- dashboard {col} filter: {', '.join(map(str, selected)) or 'none'}")
+        return '\n'.join(lines)
+
+    def _filters(self, start_date=None, end_date=None, **selections):
+        """cube.slice() arguments for a call, intersected with the dashboard's filters"""
+        first, last = self.date_range or (pd.Timestamp(self.cube.dates[0]), pd.Timestamp(self.cube.dates[-1]))
+        start = max(first, pd.Timestamp(start_date)) if start_date else first
+        end = min(last, pd.Timestamp(end_date)) if end_date else last
+        filters = {'date_range': (start, end)}
+        for argument, col in FILTER_ARGUMENTS.items():
+            selected = selections.pop(argument, None)
+            unknown = set(selected or []) - set(self.dims[col])
+            if unknown:
+                raise ValueError(f"unknown {col} values: {', '.join(sorted(map(str, unknown)))}")
+            allowed = self.scope[col]
+            if selected is None:
+                selected = allowed
+            elif allowed is not None:
+                selected = [value for value in selected if value in allowed]
+            filters[argument] = selected
+        if selections:
+            raise TypeError(f"unexpected arguments: {', '.join(sorted(selections))}")
+        return filters
+
+    def sales_totals(self, **arguments):
+        filters = self._filters(**arguments)
+        totals = self.cube.slice(**filters).totals()
+        transactions = int(totals['transactions'])
+        result = {
+            'start_date': filters['date_range'][0].strftime('%Y-%m-%d'),
+            'end_date': filters['date_range'][1].strftime('%Y-%m-%d'),
+            'total_amount': totals['total_amount'],
+            'transactions': transactions,
+            'quantity': totals['quantity'],
+            'avg_transaction': totals['total_amount'] / transactions if transactions else None,
+        }
+        # Customer sketches have no payment method axis
+        if filters['payment_methods'] is None:
+            result['unique_customers_estimate'] = self.customers.count(
+                filters['date_range'], filters['categories'], filters['malls'], filters['genders'])
+        return {name: _rounded(value) for name, value in result.items()}
+
+    def sales_by(self, dimension, sort_by=None, ascending=False, limit=MAX_TOOL_ROWS, **arguments):
+        if dimension not in BREAKDOWNS:
+            raise ValueError(f"unknown dimension: {dimension}")
+        if sort_by is not None and sort_by not in MEASURES:
+            raise ValueError(f"unknown measure: {sort_by}")
+        method, col = BREAKDOWNS[dimension]
+        view = self.cube.slice(**self._filters(**arguments))
+        table = getattr(view, method)(*([] if col is None else [col]))
+        table['avg_transaction'] = table['total_amount'] / table['transactions']
+        label = table.columns[0]
+        if dimension == 'date':
+            table[label] = np.datetime_as_string(table[label].to_numpy(), unit='D')
+        if sort_by is not None or dimension not in ('date', 'month', 'weekday'):
+            table = table.sort_values(sort_by or 'total_amount', ascending=bool(ascending), kind='stable')
+        limit = max(1, min(int(limit), MAX_TOOL_ROWS))
+        rows = [{name: _rounded(value) for name, value in row.items()}
+                for row in table.head(limit).rename(columns={label: dimension}).to_dict('records')]
+        return {'dimension': dimension, 'rows': rows, 'total_rows': len(table), 'truncated': len(table) > limit}
+
+    def call(self, name, arguments):
+        """JSON result of a tool call, or of the error it raised, for the model to read"""
+        try:
+            if name not in ('sales_totals', 'sales_by'):
+                raise ValueError(f"unknown tool: {name}")
+            arguments = json.loads(arguments or '{}')
+            result = getattr(self, name)(**arguments)
+        except (TypeError, ValueError) as error:
+            result = {'error': str(error)}
+        return json.dumps(result)
+
+
+def stream_with_tools(client, queries, messages, deadline=None, **options):
+    """Yield the model's answer to messages as it streams in, letting it call queries' tools first
+
+    options are passed on to chat.completions.create (model, temperature...).
+    After MAX_TOOL_ROUNDS rounds of tool calls the model must answer. Every
+    round shares one deadline, the question's (default: now plus DEADLINE_S).
+    """
+    if deadline is None:
+        deadline = question_deadline()
+    messages = list(messages)
+    for round_number in range(MAX_TOOL_ROUNDS + 1):
+        final = round_number == MAX_TOOL_ROUNDS
+        text, calls = yield from stream_completion(client, messages, deadline=deadline, tools=queries.tools,
+                                                   tool_choice='none' if final else 'auto', **options)
+        if not calls:
+            return
+        messages.append({'role': 'assistant', 'content': text or None, 'tool_calls': calls})
+        for call in calls:
+            messages.append({'role': 'tool', 'tool_call_id': call['id'],
+                             'content': queries.call(call['function']['name'], call['function']['arguments'])})
@@ -0,0 +1,44 @@
+"""
+Shared pytest fixtures: a small synthetic export in the layout of
+customer_shopping_data.csv, written to a temporary directory so snapshots
+and stores built from it never touch the real data.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+MALLS = ['Cevahir AVM', 'Kanyon', 'Mall of Istanbul', 'Metropol AVM']
+CATEGORIES = ['Books', 'Clothing', 'Shoes', 'Toys']
+
+
+def make_rows(n, start='2021-01-01', end='2022-12-31', seed=0, first_invoice=0):
+    """n raw CSV rows with dates between start and end, in random order"""
+    rng = np.random.default_rng(seed)
+    days = pd.date_range(start, end, freq='D')
+    dates = days[rng.integers(0, len(days), n)]
+    quantity = rng.integers(1, 6, n)
+    return pd.DataFrame({
+        'invoice_no': [f'I{first_invoice + i:06d}' for i in range(n)],
+        'customer_id': [f'C{value:06d}' for value in rng.integers(0, n // 2 + 1, n)],
+        'gender': rng.choice(['Female', 'Male'], n),
+        'age': rng.integers(18, 70, n),
+        'category': rng.choice(CATEGORIES, n),
+        'quantity': quantity,
+        'price': np.round(rng.uniform(5, 500, n), 2),
+        'payment_method': rng.choice(['Cash', 'Credit Card', 'Debit Card'], n),
+        # The export writes day/month/year without zero padding
+        'invoice_date': [f'{date.day}/{date.month}/{date.year}' for date in dates],
+        'shopping_mall': rng.choice(MALLS, n),
+    })
+
+
+def write_rows(path, rows, append=False):
+    rows.to_csv(path, mode='a' if append else 'w', header=not append, index=False)
+
+
+@pytest.fixture
+def sales_csv(tmp_path):
+    """Path of a 2,000-row export in an empty directory"""
+    path = tmp_path / 'sales.csv'
+    write_rows(path, make_rows(2000))
+    return str(path)
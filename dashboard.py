@@ -4,6 +4,13 @@ import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime
 import numpy as np
+from sales_store import SalesStore
+from amount_sketch import PERCENTILES
+from aggregation_plan import AggregationPlan
+from filter_index import selected_rows
+from result_cache import cache_stats, cached_figure, carry_over, filter_key, results_cache
+from sales_export import EXPORT_FORMATS, cached_export, export_cache
+from transaction_pages import TABLE_COLUMNS, format_page, page_count, page_rows, row_count
 
 # Page configuration
 st.set_page_config(
@@ -36,22 +43,19 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-# Load data with caching
-@st.cache_data
-def load_data():
-    df = pd.read_csv('customer_shopping_data.csv')
-    # Convert invoice_date to datetime
-    df['invoice_date'] = pd.to_datetime(df['invoice_date'], format='%d/%m/%Y', errors='coerce')
-    # Create derived columns
-    df['total_amount'] = df['quantity'] * df['price']
-    df['year'] = df['invoice_date'].dt.year
-    df['month'] = df['invoice_date'].dt.month
-    df['month_year'] = df['invoice_date'].dt.to_period('M').astype(str)
-    df['day_of_week'] = df['invoice_date'].dt.day_name()
-    return df
-
-# Load the data
-df = load_data()
+# Load data once per process: every session shares the same read-only store
+@st.cache_resource(max_entries=1, show_spinner="Loading sales data...")
+def load_store(path):
+    return SalesStore.load(path)
+
+# Load the data. Invoices appended to the CSV since the last rerun extend the
+# store, and cached results the new rows do not touch stay valid.
+store = load_store('customer_shopping_data.csv')
+appended = store.refresh()
+if appended is not None:
+    previous_key, new_rows = appended
+    carry_over(previous_key, store.key, new_rows, [results_cache, export_cache])
+store_key, df, dims, index, cube, stats, customers, amounts = store.snapshot()
 
 # Sidebar filters
 st.sidebar.header("🔍 Filters")
@@ -59,47 +63,88 @@ st.sidebar.header("🔍 Filters")
 # Date range filter
 date_range = st.sidebar.date_input(
     "Select Date Range",
-    value=(df['invoice_date'].min(), df['invoice_date'].max()),
-    min_value=df['invoice_date'].min(),
-    max_value=df['invoice_date'].max()
+    value=(stats['first_date'], stats['last_date']),
+    min_value=stats['first_date'],
+    max_value=stats['last_date']
 )
 
 # Category filter
 categories = st.sidebar.multiselect(
     "Select Categories",
-    options=df['category'].unique(),
-    default=df['category'].unique()
+    options=dims['category'],
+    default=dims['category']
 )
 
 # Shopping mall filter
 malls = st.sidebar.multiselect(
     "Select Shopping Malls",
-    options=df['shopping_mall'].unique(),
-    default=df['shopping_mall'].unique()
+    options=dims['shopping_mall'],
+    default=dims['shopping_mall']
 )
 
 # Gender filter
 genders = st.sidebar.multiselect(
     "Select Gender",
-    options=df['gender'].unique(),
-    default=df['gender'].unique()
+    options=dims['gender'],
+    default=dims['gender']
+)
+
+# Apply filters: bitmap index lookups instead of a chain of full-length masks
+selected_dates = date_range if len(date_range) == 2 else None
+selection = index.select_bits(
+    date_range=selected_dates,
+    categories=categories,
+    malls=malls,
+    genders=genders
 )
+rows = selected_rows(*selection)
+
+# Unique customers are estimated from per-cell HyperLogLog sketches (about 1.6%
+# standard error) unless an exact count over the selected rows is asked for
+exact_customers = st.sidebar.toggle("Exact unique customers", value=False, key="exact_customers",
+                                    help="Count distinct customer IDs row by row instead of estimating them")
+
+def compute_results():
+    # Every measure the page shows, computed together instead of one scan per section
+    cube_view = cube.slice(
+        date_range=selected_dates,
+        categories=categories,
+        malls=malls,
+        genders=genders
+    )
+    plan = AggregationPlan()
+    plan.totals()
+    if exact_customers:
+        plan.unique_customers()
+    plan.histogram('age', bins=30)
+    plan.by_month()
+    plan.by('category')
+    plan.by('shopping_mall')
+    plan.by('payment_method')
+    plan.by('gender')
+    plan.pivot('category', 'shopping_mall')
+    plan.by_weekday()
+    results = plan.execute(cube_view, df, rows, selection)
+    if not exact_customers:
+        results['unique_customers'] = customers.count(
+            date_range=selected_dates,
+            categories=categories,
+            malls=malls,
+            genders=genders
+        )
+    # Median, p90 and p99 from the merged amount sketches of the selected cells
+    results['amount_percentiles'] = amounts.quantiles(
+        PERCENTILES,
+        date_range=selected_dates,
+        categories=categories,
+        malls=malls,
+        genders=genders
+    )
+    return results
 
-# Apply filters
-if len(date_range) == 2:
-    filtered_df = df[
-        (df['invoice_date'] >= pd.to_datetime(date_range[0])) &
-        (df['invoice_date'] <= pd.to_datetime(date_range[1])) &
-        (df['category'].isin(categories)) &
-        (df['shopping_mall'].isin(malls)) &
-        (df['gender'].isin(genders))
-    ]
-else:
-    filtered_df = df[
-        (df['category'].isin(categories)) &
-        (df['shopping_mall'].isin(malls)) &
-        (df['gender'].isin(genders))
-    ]
+# Repeated filter combinations come straight from the process-wide cache
+filter_state = filter_key(dims, selected_dates, categories, malls, genders)
+results = results_cache.get_or_compute((store_key, filter_state, exact_customers), compute_results)
 
 # Main title
 st.title("🛍️ Retail Sales Analytics Dashboard")
@@ -113,93 +158,108 @@ show_chatbot = st.sidebar.checkbox("💬 Ask Questions (AI Assistant)", value=Fa
 st.markdown("## 📊 Key Performance Indicators")
 col1, col2, col3, col4, col5 = st.columns(5)
 
-total_revenue = filtered_df['total_amount'].sum()
-total_transactions = len(filtered_df)
-avg_transaction = filtered_df['total_amount'].mean()
-total_customers = filtered_df['customer_id'].nunique()
-avg_items_per_transaction = filtered_df['quantity'].mean()
+totals = results['totals']
+total_revenue = totals['total_amount']
+total_transactions = int(totals['transactions'])
+avg_transaction = total_revenue / total_transactions if total_transactions else float('nan')
+total_customers = results['unique_customers']
+avg_items_per_transaction = totals['quantity'] / total_transactions if total_transactions else float('nan')
 
 with col1:
     st.metric(
         label="Total Revenue",
         value=f"${total_revenue:,.0f}",
-        delta=f"{(total_revenue / df['total_amount'].sum() * 100):.1f}% of total"
+        delta=f"{(total_revenue / stats['total_amount'] * 100):.1f}% of total"
     )
 
 with col2:
     st.metric(
         label="Total Transactions",
         value=f"{total_transactions:,}",
-        delta=f"{(total_transactions / len(df) * 100):.1f}% of total"
+        delta=f"{(total_transactions / stats['rows'] * 100):.1f}% of total"
     )
 
 with col3:
     st.metric(
         label="Avg Transaction Value",
         value=f"${avg_transaction:,.2f}",
-        delta=f"${avg_transaction - df['total_amount'].mean():,.2f}"
+        delta=f"${avg_transaction - stats['average_amount']:,.2f}"
     )
 
 with col4:
     st.metric(
         label="Unique Customers",
-        value=f"{total_customers:,}",
-        delta=f"{(total_customers / df['customer_id'].nunique() * 100):.1f}% of total"
+        value=f"{total_customers:,}" if exact_customers else f"≈{total_customers:,}",
+        delta=f"{(total_customers / (stats['customers'] if exact_customers else customers.total) * 100):.1f}% of total"
     )
 
 with col5:
     st.metric(
         label="Avg Items/Transaction",
         value=f"{avg_items_per_transaction:.2f}",
-        delta=f"{avg_items_per_transaction - df['quantity'].mean():.2f}"
+        delta=f"{avg_items_per_transaction - stats['average_quantity']:.2f}"
     )
 
-# Two column layout for charts
+# Transaction value percentiles, each within 1% of an actual transaction amount
+percentiles = results['amount_percentiles']
+for col, q, label in zip(st.columns(3), PERCENTILES, ["Median Transaction Value", "P90 Transaction Value", "P99 Transaction Value"]):
+    with col:
+        st.metric(
+            label=label,
+            value=f"${percentiles[q]:,.2f}",
+            delta=f"${percentiles[q] - amounts.overall[q]:,.2f}"
+        )
+
+# Two column layout for charts. Figures are cached by a fingerprint of their
+# aggregated input, so reruns that leave a chart's data unchanged reuse it.
 col_left, col_right = st.columns(2)
 
 with col_left:
     # Sales over time
     st.markdown("## 📈 Sales Trend Over Time")
-    sales_by_date = filtered_df.groupby('month_year')['total_amount'].sum().reset_index()
-    sales_by_date = sales_by_date.sort_values('month_year')
-    
-    fig_timeline = px.line(
-        sales_by_date,
-        x='month_year',
-        y='total_amount',
-        title='Monthly Revenue Trend',
-        labels={'month_year': 'Month', 'total_amount': 'Revenue ($)'},
-        markers=True
-    )
-    fig_timeline.update_traces(line_color='#1f77b4', line_width=3)
-    fig_timeline.update_layout(
-        hovermode='x unified',
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-    )
-    st.plotly_chart(fig_timeline, width='stretch')
+
+    def build_timeline(sales_by_date):
+        fig_timeline = px.line(
+            sales_by_date,
+            x='month_year',
+            y='total_amount',
+            title='Monthly Revenue Trend',
+            labels={'month_year': 'Month', 'total_amount': 'Revenue ($)'},
+            markers=True
+        )
+        fig_timeline.update_traces(line_color='#1f77b4', line_width=3)
+        fig_timeline.update_layout(
+            hovermode='x unified',
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+        )
+        return fig_timeline
+
+    st.plotly_chart(cached_figure(results['month_year'], build_timeline), width='stretch')
 
 with col_right:
     # Sales by category
     st.markdown("## 🏷️ Sales by Category")
-    sales_by_category = filtered_df.groupby('category')['total_amount'].sum().reset_index()
-    sales_by_category = sales_by_category.sort_values('total_amount', ascending=False)
-    
-    fig_category = px.bar(
-        sales_by_category,
-        x='category',
-        y='total_amount',
-        title='Revenue by Product Category',
-        labels={'category': 'Category', 'total_amount': 'Revenue ($)'},
-        color='total_amount',
-        color_continuous_scale='Blues'
-    )
-    fig_category.update_layout(
-        showlegend=False,
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-    )
-    st.plotly_chart(fig_category, width='stretch')
+
+    def build_category(sales_by_category):
+        sales_by_category = sales_by_category.sort_values('total_amount', ascending=False)
+        fig_category = px.bar(
+            sales_by_category,
+            x='category',
+            y='total_amount',
+            title='Revenue by Product Category',
+            labels={'category': 'Category', 'total_amount': 'Revenue ($)'},
+            color='total_amount',
+            color_continuous_scale='Blues'
+        )
+        fig_category.update_layout(
+            showlegend=False,
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+        )
+        return fig_category
+
+    st.plotly_chart(cached_figure(results['category'], build_category), width='stretch')
 
 # Second row of charts
 col_left2, col_right2 = st.columns(2)
@@ -207,44 +267,48 @@ col_left2, col_right2 = st.columns(2)
 with col_left2:
     # Sales by shopping mall
     st.markdown("## 🏬 Performance by Shopping Mall")
-    sales_by_mall = filtered_df.groupby('shopping_mall')['total_amount'].sum().reset_index()
-    sales_by_mall = sales_by_mall.sort_values('total_amount', ascending=True)
-    
-    fig_mall = px.bar(
-        sales_by_mall,
-        x='total_amount',
-        y='shopping_mall',
-        title='Revenue by Shopping Mall',
-        labels={'shopping_mall': 'Shopping Mall', 'total_amount': 'Revenue ($)'},
-        orientation='h',
-        color='total_amount',
-        color_continuous_scale='Viridis'
-    )
-    fig_mall.update_layout(
-        showlegend=False,
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-    )
-    st.plotly_chart(fig_mall, width='stretch')
+
+    def build_mall(sales_by_mall):
+        sales_by_mall = sales_by_mall.sort_values('total_amount', ascending=True)
+        fig_mall = px.bar(
+            sales_by_mall,
+            x='total_amount',
+            y='shopping_mall',
+            title='Revenue by Shopping Mall',
+            labels={'shopping_mall': 'Shopping Mall', 'total_amount': 'Revenue ($)'},
+            orientation='h',
+            color='total_amount',
+            color_continuous_scale='Viridis'
+        )
+        fig_mall.update_layout(
+            showlegend=False,
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+        )
+        return fig_mall
+
+    st.plotly_chart(cached_figure(results['shopping_mall'], build_mall), width='stretch')
 
 with col_right2:
     # Payment method distribution
     st.markdown("## 💳 Payment Method Distribution")
-    payment_dist = filtered_df.groupby('payment_method')['total_amount'].sum().reset_index()
-    
-    fig_payment = px.pie(
-        payment_dist,
-        values='total_amount',
-        names='payment_method',
-        title='Revenue by Payment Method',
-        color_discrete_sequence=px.colors.qualitative.Set3
-    )
-    fig_payment.update_traces(textposition='inside', textinfo='percent+label')
-    fig_payment.update_layout(
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-    )
-    st.plotly_chart(fig_payment, width='stretch')
+
+    def build_payment(payment_dist):
+        fig_payment = px.pie(
+            payment_dist,
+            values='total_amount',
+            names='payment_method',
+            title='Revenue by Payment Method',
+            color_discrete_sequence=px.colors.qualitative.Set3
+        )
+        fig_payment.update_traces(textposition='inside', textinfo='percent+label')
+        fig_payment.update_layout(
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+        )
+        return fig_payment
+
+    st.plotly_chart(cached_figure(results['payment_method'], build_payment), width='stretch')
 
 # Third row of charts
 col_left3, col_right3 = st.columns(2)
@@ -252,44 +316,54 @@ col_left3, col_right3 = st.columns(2)
 with col_left3:
     # Customer demographics - Age distribution
     st.markdown("## 👥 Customer Age Distribution")
-    fig_age = px.histogram(
-        filtered_df,
-        x='age',
-        nbins=30,
-        title='Customer Age Distribution',
-        labels={'age': 'Age', 'count': 'Number of Transactions'},
-        color_discrete_sequence=['#ff7f0e']
-    )
-    fig_age.update_layout(
-        showlegend=False,
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-    )
-    st.plotly_chart(fig_age, width='stretch')
+
+    def build_age(age_bins):
+        # Bins are counted server-side, so the chart carries 30 bars, not one age per row
+        fig_age = go.Figure(go.Bar(
+            x=(age_bins['age'] + age_bins['age_end']) / 2,
+            y=age_bins['transactions'],
+            width=age_bins['age_end'] - age_bins['age'],
+            customdata=np.stack([age_bins['age'], age_bins['age_end'] - 1], axis=-1),
+            hovertemplate='Age %{customdata[0]}-%{customdata[1]}<br>Number of Transactions: %{y:,}<extra></extra>',
+            marker_color='#ff7f0e'
+        ))
+        fig_age.update_layout(
+            title='Customer Age Distribution',
+            xaxis_title='Age',
+            yaxis_title='Number of Transactions',
+            bargap=0,
+            showlegend=False,
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+        )
+        return fig_age
+
+    st.plotly_chart(cached_figure(results['age'], build_age), width='stretch')
 
 with col_right3:
     # Gender distribution
     st.markdown("## 👤 Sales by Gender")
-    gender_sales = filtered_df.groupby('gender').agg({
-        'total_amount': 'sum',
-        'customer_id': 'count'
-    }).reset_index()
-    gender_sales.columns = ['gender', 'total_revenue', 'transactions']
-    
-    fig_gender = go.Figure(data=[
-        go.Bar(name='Revenue ($)', x=gender_sales['gender'], y=gender_sales['total_revenue'], yaxis='y', offsetgroup=1),
-        go.Bar(name='Transactions', x=gender_sales['gender'], y=gender_sales['transactions'], yaxis='y2', offsetgroup=2)
-    ])
-    fig_gender.update_layout(
-        title='Revenue and Transactions by Gender',
-        xaxis=dict(title='Gender'),
-        yaxis=dict(title='Revenue ($)', side='left'),
-        yaxis2=dict(title='Transactions', side='right', overlaying='y'),
-        barmode='group',
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-    )
-    st.plotly_chart(fig_gender, width='stretch')
+
+    def build_gender(gender_sales):
+        gender_sales = gender_sales[['gender', 'total_amount', 'transactions']]
+        gender_sales.columns = ['gender', 'total_revenue', 'transactions']
+
+        fig_gender = go.Figure(data=[
+            go.Bar(name='Revenue ($)', x=gender_sales['gender'], y=gender_sales['total_revenue'], yaxis='y', offsetgroup=1),
+            go.Bar(name='Transactions', x=gender_sales['gender'], y=gender_sales['transactions'], yaxis='y2', offsetgroup=2)
+        ])
+        fig_gender.update_layout(
+            title='Revenue and Transactions by Gender',
+            xaxis=dict(title='Gender'),
+            yaxis=dict(title='Revenue ($)', side='left'),
+            yaxis2=dict(title='Transactions', side='right', overlaying='y'),
+            barmode='group',
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+        )
+        return fig_gender
+
+    st.plotly_chart(cached_figure(results['gender'], build_gender), width='stretch')
 
 # Fourth row - Heatmaps and advanced analytics
 st.markdown("## 🔥 Advanced Analytics")
@@ -299,77 +373,94 @@ col_heat1, col_heat2 = st.columns(2)
 with col_heat1:
     # Category vs Shopping Mall heatmap
     st.markdown("### Category Performance by Mall")
-    category_mall_pivot = filtered_df.pivot_table(
-        values='total_amount',
-        index='category',
-        columns='shopping_mall',
-        aggfunc='sum',
-        fill_value=0
-    )
-    
-    fig_heatmap1 = px.imshow(
-        category_mall_pivot,
-        labels=dict(x="Shopping Mall", y="Category", color="Revenue ($)"),
-        aspect="auto",
-        color_continuous_scale='YlOrRd',
-        title='Revenue Heatmap: Category vs Shopping Mall'
-    )
-    fig_heatmap1.update_layout(
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-    )
-    st.plotly_chart(fig_heatmap1, width='stretch')
+
+    def build_heatmap(category_mall_pivot):
+        fig_heatmap1 = px.imshow(
+            category_mall_pivot,
+            labels=dict(x="Shopping Mall", y="Category", color="Revenue ($)"),
+            aspect="auto",
+            color_continuous_scale='YlOrRd',
+            title='Revenue Heatmap: Category vs Shopping Mall'
+        )
+        fig_heatmap1.update_layout(
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+        )
+        return fig_heatmap1
+
+    st.plotly_chart(cached_figure(results['category_by_shopping_mall'], build_heatmap), width='stretch')
 
 with col_heat2:
     # Day of week analysis
     st.markdown("### Sales by Day of Week")
-    dow_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    dow_sales = filtered_df.groupby('day_of_week')['total_amount'].agg(['sum', 'count']).reset_index()
-    dow_sales['avg_transaction'] = dow_sales['sum'] / dow_sales['count']
-    dow_sales['day_of_week'] = pd.Categorical(dow_sales['day_of_week'], categories=dow_order, ordered=True)
-    dow_sales = dow_sales.sort_values('day_of_week')
-    
-    fig_dow = go.Figure()
-    fig_dow.add_trace(go.Bar(
-        x=dow_sales['day_of_week'],
-        y=dow_sales['sum'],
-        name='Total Revenue',
-        marker_color='lightblue'
-    ))
-    fig_dow.update_layout(
-        title='Revenue by Day of Week',
-        xaxis_title='Day',
-        yaxis_title='Revenue ($)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-    )
-    st.plotly_chart(fig_dow, width='stretch')
-
-# Data table section
-st.markdown("## 📋 Detailed Transaction Data")
-st.markdown("### Recent Transactions")
 
-# Display recent transactions
-display_df = filtered_df[['invoice_date', 'shopping_mall', 'category', 'quantity', 'price', 'total_amount', 'payment_method', 'gender', 'age']].sort_values('invoice_date', ascending=False).head(100)
-display_df['invoice_date'] = display_df['invoice_date'].dt.strftime('%Y-%m-%d')
+    def build_weekday(dow_sales):
+        fig_dow = go.Figure()
+        fig_dow.add_trace(go.Bar(
+            x=dow_sales['day_of_week'],
+            y=dow_sales['total_amount'],
+            name='Total Revenue',
+            marker_color='lightblue'
+        ))
+        fig_dow.update_layout(
+            title='Revenue by Day of Week',
+            xaxis_title='Day',
+            yaxis_title='Revenue ($)',
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+        )
+        return fig_dow
+
+    st.plotly_chart(cached_figure(results['day_of_week'], build_weekday), width='stretch')
+
+# Data table section: a fragment of its own, so paging, sorting and export
+# rerun just this section with the selected rows and filter key of the last full run
+@st.fragment
+def transaction_table(df, rows, export_key):
+    st.markdown("## 📋 Detailed Transaction Data")
+    st.markdown("### Recent Transactions")
+
+    # Only the requested page is ranked, gathered and formatted, never the whole selection
+    col_sort, col_order, col_page = st.columns([2, 1, 1])
+    with col_sort:
+        sort_by = st.selectbox("Sort by", TABLE_COLUMNS, key="table_sort")
+    with col_order:
+        descending = st.toggle("Descending", value=True, key="table_descending")
+    with col_page:
+        pages = page_count(rows)
+        page = st.number_input(f"Page (of {pages:,})", min_value=1, max_value=pages, value=1, key="table_page")
+
+    positions = page_rows(df, rows, sort_by, descending, min(page, pages) - 1)
+    st.dataframe(
+        format_page(df, positions),
+        width='stretch',
+        height=400
+    )
+    st.caption(f"Showing {len(positions):,} of {row_count(rows):,} transactions")
+
+    # Download button for filtered data. The file is built only when the button
+    # is clicked, and cached per filter state and format
+    export_format = st.radio("Export format", list(EXPORT_FORMATS), horizontal=True, key="export_format")
+    extension, mime = EXPORT_FORMATS[export_format]
+    st.download_button(
+        label=f"📥 Download Filtered Data as {export_format}",
+        data=lambda: cached_export(export_key, df, rows, export_format),
+        file_name=f"filtered_sales_data_{datetime.now().strftime('%Y%m%d')}.{extension}",
+        mime=mime,
+        on_click="ignore",
+    )
 
-st.dataframe(
-    display_df,
-    width='stretch',
-    height=400
-)
+transaction_table(df, rows, (store_key, filter_state))
 
-# Download button for filtered data
-csv = filtered_df.to_csv(index=False).encode('utf-8')
-st.download_button(
-    label="📥 Download Filtered Data as CSV",
-    data=csv,
-    file_name=f"filtered_sales_data_{datetime.now().strftime('%Y%m%d')}.csv",
-    mime="text/csv",
-)
+def clear_chat():
+    st.session_state.messages = []
 
-# Chatbot Section
-if show_chatbot:
+# Chatbot Section: a fragment, so asking a question reruns only the chat and does
+# no dashboard work; rows selects the filtered rows of df it answers about, which
+# are only gathered once a question is asked, and percentiles are the sketched
+# transaction-value percentiles of the same filters
+@st.fragment
+def chatbot(df, rows, percentiles):
     st.markdown("---")
     st.markdown("## 💬 Ask Questions About Your Sales Data")
     st.markdown("Ask me anything about your sales, customers, products, or performance!")
@@ -395,7 +486,7 @@ if show_chatbot:
         try:
             # Top category questions
             if any(word in question_lower for word in ['top category', 'best category', 'highest category', 'most popular category']):
-                top_cat = df_data.groupby('category')['total_amount'].sum().sort_values(ascending=False)
+                top_cat = df_data.groupby('category', observed=True)['total_amount'].sum().sort_values(ascending=False)
                 response = f"📊 **Top Categories by Revenue:**\n\n"
                 for i, (cat, revenue) in enumerate(top_cat.head(3).items(), 1):
                     response += f"{i}. **{cat}**: ${revenue:,.2f} ({revenue/total_revenue*100:.1f}% of total)\n"
@@ -403,7 +494,7 @@ if show_chatbot:
             
             # Top mall questions
             elif any(word in question_lower for word in ['top mall', 'best mall', 'highest mall', 'best location', 'top location']):
-                top_mall = df_data.groupby('shopping_mall')['total_amount'].sum().sort_values(ascending=False)
+                top_mall = df_data.groupby('shopping_mall', observed=True)['total_amount'].sum().sort_values(ascending=False)
                 response = f"🏬 **Top Shopping Malls by Revenue:**\n\n"
                 for i, (mall, revenue) in enumerate(top_mall.head(3).items(), 1):
                     response += f"{i}. **{mall}**: ${revenue:,.2f} ({revenue/total_revenue*100:.1f}% of total)\n"
@@ -420,7 +511,7 @@ if show_chatbot:
             # Customer questions
             elif any(word in question_lower for word in ['customer', 'demographics', 'age', 'gender']):
                 avg_age = df_data['age'].mean()
-                gender_dist = df_data['gender'].value_counts()
+                gender_dist = df_data['gender'].value_counts()[lambda counts: counts > 0]
                 response = f"👥 **Customer Demographics:**\n\n"
                 response += f"- **Average Age:** {avg_age:.1f} years\n"
                 response += f"- **Gender Distribution:**\n"
@@ -431,7 +522,7 @@ if show_chatbot:
             
             # Payment method questions
             elif any(word in question_lower for word in ['payment', 'how do customers pay', 'payment method']):
-                payment_dist = df_data.groupby('payment_method')['total_amount'].sum().sort_values(ascending=False)
+                payment_dist = df_data.groupby('payment_method', observed=True)['total_amount'].sum().sort_values(ascending=False)
                 response = f"💳 **Payment Method Analysis:**\n\n"
                 for method, revenue in payment_dist.items():
                     count = len(df_data[df_data['payment_method'] == method])
@@ -440,7 +531,7 @@ if show_chatbot:
             
             # Trend questions
             elif any(word in question_lower for word in ['trend', 'over time', 'monthly', 'growth']):
-                monthly_sales = df_data.groupby('month_year')['total_amount'].sum().sort_index()
+                monthly_sales = df_data.groupby('month_year', observed=True)['total_amount'].sum().sort_index()
                 response = f"📈 **Sales Trend:**\n\n"
                 response += f"- **Peak Month:** {monthly_sales.idxmax()} with ${monthly_sales.max():,.2f}\n"
                 response += f"- **Lowest Month:** {monthly_sales.idxmin()} with ${monthly_sales.min():,.2f}\n"
@@ -452,7 +543,8 @@ if show_chatbot:
             elif any(word in question_lower for word in ['average transaction', 'average sale', 'typical purchase', 'average purchase']):
                 response = f"💵 **Transaction Analysis:**\n\n"
                 response += f"- **Average Transaction Value:** ${avg_transaction:,.2f}\n"
-                response += f"- **Median Transaction Value:** ${df_data['total_amount'].median():,.2f}\n"
+                response += f"- **Median Transaction Value:** ≈${percentiles[0.5]:,.2f}\n"
+                response += f"- **90th Percentile Transaction:** ≈${percentiles[0.9]:,.2f}\n"
                 response += f"- **Average Items per Transaction:** {df_data['quantity'].mean():.2f}\n"
                 response += f"- **Highest Transaction:** ${df_data['total_amount'].max():,.2f}\n"
                 response += f"- **Lowest Transaction:** ${df_data['total_amount'].min():,.2f}"
@@ -460,7 +552,7 @@ if show_chatbot:
             
             # Day of week questions
             elif any(word in question_lower for word in ['day of week', 'busiest day', 'best day', 'which day']):
-                dow_sales = df_data.groupby('day_of_week')['total_amount'].sum().sort_values(ascending=False)
+                dow_sales = df_data.groupby('day_of_week', observed=True)['total_amount'].sum().sort_values(ascending=False)
                 response = f"📅 **Sales by Day of Week:**\n\n"
                 for i, (day, revenue) in enumerate(dow_sales.head(3).items(), 1):
                     count = len(df_data[df_data['day_of_week'] == day])
@@ -471,7 +563,7 @@ if show_chatbot:
             elif any(word in question_lower for word in ['compare', 'comparison', 'vs', 'versus']):
                 categories = df_data['category'].unique()
                 response = f"🔍 **Category Comparison:**\n\n"
-                cat_analysis = df_data.groupby('category').agg({
+                cat_analysis = df_data.groupby('category', observed=True).agg({
                     'total_amount': 'sum',
                     'customer_id': 'count'
                 }).sort_values('total_amount', ascending=False)
@@ -524,7 +616,7 @@ Or use the filters on the left to explore specific segments!"""
         # Generate and display assistant response
         with st.chat_message("assistant"):
             with st.spinner("Analyzing your data..."):
-                response = answer_question(prompt, filtered_df)
+                response = answer_question(prompt, df.iloc[rows])
                 st.markdown(response)
         
         # Add assistant response to chat history
@@ -532,9 +624,10 @@ Or use the filters on the left to explore specific segments!"""
     
     # Clear chat button
     if st.session_state.messages:
-        if st.button("🗑️ Clear Chat History"):
-            st.session_state.messages = []
-            st.rerun()
+        st.button("🗑️ Clear Chat History", on_click=clear_chat)
+
+if show_chatbot:
+    chatbot(df, rows, results['amount_percentiles'])
 
 # Footer
 st.markdown("---")
@@ -542,14 +635,17 @@ st.markdown("### 💡 Insights & Recommendations")
 col1, col2, col3 = st.columns(3)
 
 with col1:
-    top_category = filtered_df.groupby('category')['total_amount'].sum().idxmax()
+    top_category = results['category'].set_index('category')['total_amount'].idxmax()
     st.info(f"**Top Category:** {top_category} generates the highest revenue")
 
 with col2:
-    top_mall = filtered_df.groupby('shopping_mall')['total_amount'].sum().idxmax()
+    top_mall = results['shopping_mall'].set_index('shopping_mall')['total_amount'].idxmax()
     st.success(f"**Best Performing Mall:** {top_mall}")
 
 with col3:
-    preferred_payment = filtered_df.groupby('payment_method')['customer_id'].count().idxmax()
+    preferred_payment = results['payment_method'].set_index('payment_method')['transactions'].idxmax()
     st.warning(f"**Most Used Payment:** {preferred_payment}")
 
+# Cache statistics
+with st.sidebar.expander("⚙️ Cache Statistics"):
+    st.dataframe(pd.DataFrame(cache_stats()).set_index('cache'), width='stretch')
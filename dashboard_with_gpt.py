@@ -4,8 +4,19 @@ import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime
 import numpy as np
+from sales_store import SalesStore
+from amount_sketch import PERCENTILES
+from aggregation_plan import AggregationPlan
+from filter_index import selected_rows
+from chat_answers import answer_cache, answer_key
+from chat_client import GPTBusyError, gpt_client, question_deadline
+from chat_summary import cached_summary, data_summary, summary_cache
+from chat_stream import BUSY_NOTICE, TimedStream, stream_completion
+from chat_tools import SalesQueries, stream_with_tools
+from result_cache import cache_stats, cached_figure, carry_over, filter_key, results_cache
+from sales_export import EXPORT_FORMATS, cached_export, export_cache
+from transaction_pages import TABLE_COLUMNS, format_page, page_count, page_rows, row_count
 import os
-import json
 
 # Page configuration
 st.set_page_config(
@@ -131,22 +142,19 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-# Load data with caching
-@st.cache_data
-def load_data():
-    df = pd.read_csv('customer_shopping_data.csv')
-    # Convert invoice_date to datetime
-    df['invoice_date'] = pd.to_datetime(df['invoice_date'], format='%d/%m/%Y', errors='coerce')
-    # Create derived columns
-    df['total_amount'] = df['quantity'] * df['price']
-    df['year'] = df['invoice_date'].dt.year
-    df['month'] = df['invoice_date'].dt.month
-    df['month_year'] = df['invoice_date'].dt.to_period('M').astype(str)
-    df['day_of_week'] = df['invoice_date'].dt.day_name()
-    return df
-
-# Load the data
-df = load_data()
+# Load data once per process: every session shares the same read-only store
+@st.cache_resource(max_entries=1, show_spinner="Loading sales data...")
+def load_store(path):
+    return SalesStore.load(path)
+
+# Load the data. Invoices appended to the CSV since the last rerun extend the
+# store, and cached results the new rows do not touch stay valid.
+store = load_store('customer_shopping_data.csv')
+appended = store.refresh()
+if appended is not None:
+    previous_key, new_rows = appended
+    carry_over(previous_key, store.key, new_rows, [results_cache, export_cache, summary_cache, answer_cache])
+store_key, df, dims, index, cube, stats, customers, amounts = store.snapshot()
 
 # Sidebar filters
 st.sidebar.header("🔍 Filters")
@@ -154,19 +162,19 @@ st.sidebar.header("🔍 Filters")
 # Date range filter
 date_range = st.sidebar.date_input(
     "Select Date Range",
-    value=(df['invoice_date'].min(), df['invoice_date'].max()),
-    min_value=df['invoice_date'].min(),
-    max_value=df['invoice_date'].max()
+    value=(stats['first_date'], stats['last_date']),
+    min_value=stats['first_date'],
+    max_value=stats['last_date']
 )
 
 # Category filter with checkboxes
 st.sidebar.markdown("### 🏷️ Categories")
 select_all_categories = st.sidebar.checkbox("Select All Categories", value=True, key="all_categories")
 if select_all_categories:
-    categories = list(df['category'].unique())
+    categories = list(dims['category'])
 else:
     categories = []
-    for category in sorted(df['category'].unique()):
+    for category in dims['category']:
         if st.sidebar.checkbox(category, value=False, key=f"cat_{category}"):
             categories.append(category)
 
@@ -174,10 +182,10 @@ else:
 st.sidebar.markdown("### 🏬 Shopping Malls")
 select_all_malls = st.sidebar.checkbox("Select All Malls", value=True, key="all_malls")
 if select_all_malls:
-    malls = list(df['shopping_mall'].unique())
+    malls = list(dims['shopping_mall'])
 else:
     malls = []
-    for mall in sorted(df['shopping_mall'].unique()):
+    for mall in dims['shopping_mall']:
         if st.sidebar.checkbox(mall, value=False, key=f"mall_{mall}"):
             malls.append(mall)
 
@@ -185,28 +193,69 @@ else:
 st.sidebar.markdown("### 👤 Gender")
 select_all_genders = st.sidebar.checkbox("Select All Genders", value=True, key="all_genders")
 if select_all_genders:
-    genders = list(df['gender'].unique())
+    genders = list(dims['gender'])
 else:
     genders = []
-    for gender in df['gender'].unique():
+    for gender in dims['gender']:
         if st.sidebar.checkbox(gender, value=False, key=f"gender_{gender}"):
             genders.append(gender)
 
-# Apply filters
-if len(date_range) == 2:
-    filtered_df = df[
-        (df['invoice_date'] >= pd.to_datetime(date_range[0])) &
-        (df['invoice_date'] <= pd.to_datetime(date_range[1])) &
-        (df['category'].isin(categories)) &
-        (df['shopping_mall'].isin(malls)) &
-        (df['gender'].isin(genders))
-    ]
-else:
-    filtered_df = df[
-        (df['category'].isin(categories)) &
-        (df['shopping_mall'].isin(malls)) &
-        (df['gender'].isin(genders))
-    ]
+# Apply filters: bitmap index lookups instead of a chain of full-length masks
+selected_dates = date_range if len(date_range) == 2 else None
+selection = index.select_bits(
+    date_range=selected_dates,
+    categories=categories,
+    malls=malls,
+    genders=genders
+)
+rows = selected_rows(*selection)
+
+# Unique customers are estimated from per-cell HyperLogLog sketches (about 1.6%
+# standard error) unless an exact count over the selected rows is asked for
+exact_customers = st.sidebar.toggle("Exact unique customers", value=False, key="exact_customers",
+                                    help="Count distinct customer IDs row by row instead of estimating them")
+
+def compute_results():
+    # Every measure the page shows, computed together instead of one scan per section
+    cube_view = cube.slice(
+        date_range=selected_dates,
+        categories=categories,
+        malls=malls,
+        genders=genders
+    )
+    plan = AggregationPlan()
+    plan.totals()
+    if exact_customers:
+        plan.unique_customers()
+    plan.histogram('age', bins=30)
+    plan.by_month()
+    plan.by('category')
+    plan.by('shopping_mall')
+    plan.by('payment_method')
+    plan.by('gender')
+    plan.pivot('category', 'shopping_mall')
+    plan.by_weekday()
+    results = plan.execute(cube_view, df, rows, selection)
+    if not exact_customers:
+        results['unique_customers'] = customers.count(
+            date_range=selected_dates,
+            categories=categories,
+            malls=malls,
+            genders=genders
+        )
+    # Median, p90 and p99 from the merged amount sketches of the selected cells
+    results['amount_percentiles'] = amounts.quantiles(
+        PERCENTILES,
+        date_range=selected_dates,
+        categories=categories,
+        malls=malls,
+        genders=genders
+    )
+    return results
+
+# Repeated filter combinations come straight from the process-wide cache
+filter_state = filter_key(dims, selected_dates, categories, malls, genders)
+results = results_cache.get_or_compute((store_key, filter_state, exact_customers), compute_results)
 
 # Company Branding Header
 st.markdown("""
@@ -288,41 +337,239 @@ button[key="toggle_chat"]:active {
 </style>
 """, unsafe_allow_html=True)
 
-# Create button in fixed position
-col_spacer, col_button = st.columns([20, 1])
-with col_button:
+# ============================================================================
+# POPUP CHATBOT SECTION
+# ============================================================================
+
+def clear_chat():
+    st.session_state.messages = []
+
+def answer_timing(message):
+    return f"⏱️ First token after {message['first_token']:.2f}s · full answer in {message['total']:.2f}s"
+
+# Use Streamlit's dialog decorator. A dialog reruns on its own, so chatting
+# does no dashboard work. summary_key identifies the filtered data it answers
+# about and build_summary() summarizes that data when it is not cached yet;
+# queries runs the tool calls of query tools mode against the same filters.
+@st.dialog("🤖 AI Powered Chatbot", width="large")
+def show_chatbot(summary_key, build_summary, queries):
+    st.markdown("""
+    <div style='background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
+                padding: 1rem 1.5rem; 
+                color: white;
+                margin: -1rem -1rem 1.5rem -1rem;
+                border-radius: 8px 8px 0 0;'>
+        <p style='margin: 0; font-size: 0.95rem; opacity: 0.95;'>Powered by GPT-4 • Ask me anything about your sales data</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    # Set up GPT with API key from environment or Streamlit secrets
+    try:
+        # Try to get from Streamlit secrets (for cloud deployment)
+        api_key = st.secrets.get("OPENAI_API_KEY", None)
+        if not api_key:
+            # Fall back to environment variable (for local development)
+            api_key = os.environ.get("OPENAI_API_KEY", None)
+        
+        if not api_key:
+            st.error("⚠️ OpenAI API key not found. Please configure it in Streamlit secrets or environment variables.")
+            st.info("For local development: Set OPENAI_API_KEY environment variable")
+            st.info("For Streamlit Cloud: Add OPENAI_API_KEY to your app secrets")
+            st.stop()
+        
+        os.environ["OPENAI_API_KEY"] = api_key
+    except Exception as e:
+        st.error(f"Error loading API key: {e}")
+        st.stop()
+
+    # Query tools mode keeps the prompt to the schema and dimension values,
+    # however long the date range; GPT asks for the figures it needs
+    use_tools = st.toggle("🔧 Query tools mode", value=True, key="chat_tools",
+                          help="Let GPT query only the data it needs instead of sending a full data summary with every question")
+
+    # Chat messages container
+    st.markdown("### 💬 Conversation")
+    
+    # Display chat messages
+    for message in st.session_state.messages:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+            if message.get("first_token") is not None:
+                st.caption(answer_timing(message))
+    
+    # Model options, which are part of the answer cache key
+    gpt_options = {
+        "model": "gpt-4o-mini",  # Using cost-effective model
+        "temperature": 0.3,  # Lower temperature for more factual responses
+        "max_tokens": 1000  # Increased for detailed answers
+    }
+    
+    # One GPT call for a question, yielding the answer as it streams in;
+    # every request it makes shares the question's deadline
+    def ask_gpt(client, question, deadline):
+        if use_tools:
+            system_prompt = f"""You are a retail sales data analyst with query tools over detailed sales data.
+
+**SCHEMA:** one row per transaction with invoice_date, category, shopping_mall, gender, payment_method, quantity, total_amount (revenue), customer_id and age
+
+**DIMENSION VALUES AND DASHBOARD FILTERS:**
+{queries.describe()}
+
+**INSTRUCTIONS:**
+- Call the tools for every figure you report; never estimate numbers yourself
+- Tool results are already limited to the dashboard filters
+- Always provide specific numbers
+- Format with markdown for clarity
+
+Answer concisely using the tool results."""
+            yield from stream_with_tools(
+                client,
+                queries,
+                [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": question}
+                ],
+                deadline=deadline,
+                **gpt_options
+            )
+            return
+        
+        # Data summary and its JSON, built once per filter combination
+        summary, summary_json = cached_summary(summary_key, build_summary)
+        
+        # Create system prompt
+        system_prompt = f"""You are a retail sales data analyst with access to detailed sales data.
+
+**DATA FORMAT (Compact arrays for efficiency):**
+- daily: {{date: [revenue, transactions, customers], ...}} for ALL dates
+- categories: {{category: [revenue, avg_transaction, num_transactions, items_sold], ...}}
+- malls: {{mall: [revenue, transactions], ...}}
+- payments: {{payment_method: [revenue, transactions], ...}}
+
+**Categories:** {', '.join(summary['categories'])}
+**Malls:** {', '.join(summary['malls'])}
+**Payments:** {', '.join(summary['payments'])}
+
+**DATA:**
+{summary_json}
+
+**INSTRUCTIONS:**
+- For date questions: Check daily[date] - e.g., daily["2023-03-08"] returns [revenue, transactions, customers]
+- For category questions: Use categories[name] - e.g., categories["Clothing"] returns [revenue, avg_trans, count, items]
+- Always provide specific numbers
+- Format with markdown for clarity
+
+Answer concisely using the data provided."""
+        
+        # Call GPT, streaming the answer
+        yield from stream_completion(
+            client,
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": question}
+            ],
+            deadline=deadline,
+            **gpt_options
+        )
+    
+    # GPT-powered answer function. Questions already answered for these filters
+    # come from the process-wide answer cache, and an identical question still
+    # being answered for another session shares that call.
+    def answer_with_gpt(question, api_key, deadline):
+        """Use OpenAI GPT to answer questions about the data"""
+        try:
+            # One long-lived client per API key: pooled connections, shared rate limits
+            client = gpt_client(api_key)
+            
+            key = answer_key(summary_key, "tools" if use_tools else "summary", gpt_options, question)
+            yield from answer_cache.stream(key, lambda: ask_gpt(client, question, deadline))
+            
+        except ImportError:
+            yield "❌ **Error**: OpenAI library not installed. Run: `pip install openai`"
+        except GPTBusyError as e:
+            yield f"{BUSY_NOTICE} {e}"
+        except Exception as e:
+            yield f"❌ **Error**: {str(e)}\n\nPlease check your API key."
+    
+    # Chat input
+    if prompt := st.chat_input("Ask me anything about your sales data..."):
+        # Add user message to chat history
+        st.session_state.messages.append({"role": "user", "content": prompt})
+        
+        # Display user message
+        with st.chat_message("user"):
+            st.markdown(prompt)
+        
+        # Generate and display GPT response token by token as it arrives
+        with st.chat_message("assistant"):
+            deadline = question_deadline()
+            stream = TimedStream(answer_with_gpt(prompt, api_key, deadline), deadline)
+            response = st.write_stream(iter(stream))
+            message = {"role": "assistant", "content": response,
+                       "first_token": stream.first_token, "total": stream.total}
+            if stream.first_token is not None:
+                st.caption(answer_timing(message))
+        
+        # Add assistant response to chat history
+        st.session_state.messages.append(message)
+    
+    # Clear chat button
+    if st.session_state.messages:
+        st.button("🗑️ Clear Chat History", key="clear_chat_popup", use_container_width=True, on_click=clear_chat)
+
+# Create button in fixed position. Opening or closing the assistant reruns this
+# fragment only, not the filters, KPIs and charts around it.
+def toggle_chat():
+    st.session_state.chat_popup_open = not st.session_state.chat_popup_open
+
+# Summary of the filtered data for the assistant, from the cube and the selected rows
+def build_chat_summary():
+    view = cube.slice(
+        date_range=selected_dates,
+        categories=categories,
+        malls=malls,
+        genders=genders
+    )
+    return data_summary(view, df, rows)
+
+@st.fragment
+def chat_toggle(summary_key, build_summary, queries):
+    col_spacer, col_button = st.columns([20, 1])
+    with col_button:
+        if st.session_state.chat_popup_open:
+            st.button("✕ Close", key="toggle_chat", help="Close AI Assistant", type="primary", on_click=toggle_chat)
+        else:
+            st.button("🤖 AI Chat", key="toggle_chat", help="Open AI-Powered Chatbot", type="primary", on_click=toggle_chat)
     if st.session_state.chat_popup_open:
-        if st.button("✕ Close", key="toggle_chat", help="Close AI Assistant", type="primary"):
-            st.session_state.chat_popup_open = False
-            st.rerun()
-    else:
-        if st.button("🤖 AI Chat", key="toggle_chat", help="Open AI-Powered Chatbot", type="primary"):
-            st.session_state.chat_popup_open = True
-            st.rerun()
+        show_chatbot(summary_key, build_summary, queries)
+
+chat_queries = SalesQueries(cube, customers, dims, selected_dates, categories, malls, genders)
+chat_toggle((store_key, filter_state), build_chat_summary, chat_queries)
 
 # Key Metrics Row
 st.markdown("## 📊 Key Performance Indicators")
 st.markdown("---")
 
 # Check if there's any data after filtering
-if len(filtered_df) == 0:
+if row_count(rows) == 0:
     st.error("⚠️ **No data available with current filter selections.**")
     st.info("💡 **Tip:** Try selecting more categories, malls, or genders from the sidebar, or adjust your date range.")
     st.stop()  # Stop execution if no data
 
 col1, col2, col3, col4, col5 = st.columns(5, gap="medium")
 
-total_revenue = filtered_df['total_amount'].sum()
-total_transactions = len(filtered_df)
-avg_transaction = filtered_df['total_amount'].mean()
-total_customers = filtered_df['customer_id'].nunique()
-avg_items_per_transaction = filtered_df['quantity'].mean()
+totals = results['totals']
+total_revenue = totals['total_amount']
+total_transactions = int(totals['transactions'])
+avg_transaction = total_revenue / total_transactions if total_transactions else float('nan')
+total_customers = results['unique_customers']
+avg_items_per_transaction = totals['quantity'] / total_transactions if total_transactions else float('nan')
 
 with col1:
     st.metric(
         label="💰 Total Revenue",
         value=f"${total_revenue:,.0f}",
-        delta=f"{(total_revenue / df['total_amount'].sum() * 100):.1f}% of total",
+        delta=f"{(total_revenue / stats['total_amount'] * 100):.1f}% of total",
         help="Total revenue from all transactions in the selected period"
     )
 
@@ -330,7 +577,7 @@ with col2:
     st.metric(
         label="🛒 Total Transactions",
         value=f"{total_transactions:,}",
-        delta=f"{(total_transactions / len(df) * 100):.1f}% of total",
+        delta=f"{(total_transactions / stats['rows'] * 100):.1f}% of total",
         help="Number of transactions completed"
     )
 
@@ -338,15 +585,15 @@ with col3:
     st.metric(
         label="💵 Avg Transaction",
         value=f"${avg_transaction:,.2f}",
-        delta=f"${avg_transaction - df['total_amount'].mean():,.2f}",
+        delta=f"${avg_transaction - stats['average_amount']:,.2f}",
         help="Average value per transaction"
     )
 
 with col4:
     st.metric(
         label="👥 Unique Customers",
-        value=f"{total_customers:,}",
-        delta=f"{(total_customers / df['customer_id'].nunique() * 100):.1f}% of total",
+        value=f"{total_customers:,}" if exact_customers else f"≈{total_customers:,}",
+        delta=f"{(total_customers / (stats['customers'] if exact_customers else customers.total) * 100):.1f}% of total",
         help="Number of unique customers"
     )
 
@@ -354,58 +601,73 @@ with col5:
     st.metric(
         label="📦 Items/Transaction",
         value=f"{avg_items_per_transaction:.2f}",
-        delta=f"{avg_items_per_transaction - df['quantity'].mean():.2f}",
+        delta=f"{avg_items_per_transaction - stats['average_quantity']:.2f}",
         help="Average number of items per transaction"
     )
 
+# Transaction value percentiles, each within 1% of an actual transaction amount
+percentiles = results['amount_percentiles']
+for col, q, label in zip(st.columns(3, gap="medium"), PERCENTILES, ["📍 Median Transaction", "📈 P90 Transaction", "🔝 P99 Transaction"]):
+    with col:
+        st.metric(
+            label=label,
+            value=f"${percentiles[q]:,.2f}",
+            delta=f"${percentiles[q] - amounts.overall[q]:,.2f}",
+            help=f"{q:.0%} of transactions are at or below this value (estimated, within 1%)"
+        )
+
 st.markdown("---")
 
-# Two column layout for charts
+# Two column layout for charts. Figures are cached by a fingerprint of their
+# aggregated input, so reruns that leave a chart's data unchanged reuse it.
 col_left, col_right = st.columns(2)
 
 with col_left:
     # Sales over time
     st.markdown("## 📈 Sales Trend Over Time")
-    sales_by_date = filtered_df.groupby('month_year')['total_amount'].sum().reset_index()
-    sales_by_date = sales_by_date.sort_values('month_year')
-    
-    fig_timeline = px.line(
-        sales_by_date,
-        x='month_year',
-        y='total_amount',
-        title='Monthly Revenue Trend',
-        labels={'month_year': 'Month', 'total_amount': 'Revenue ($)'},
-        markers=True
-    )
-    fig_timeline.update_traces(line_color='#1f77b4', line_width=3)
-    fig_timeline.update_layout(
-        hovermode='x unified',
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-    )
-    st.plotly_chart(fig_timeline, width='stretch')
+
+    def build_timeline(sales_by_date):
+        fig_timeline = px.line(
+            sales_by_date,
+            x='month_year',
+            y='total_amount',
+            title='Monthly Revenue Trend',
+            labels={'month_year': 'Month', 'total_amount': 'Revenue ($)'},
+            markers=True
+        )
+        fig_timeline.update_traces(line_color='#1f77b4', line_width=3)
+        fig_timeline.update_layout(
+            hovermode='x unified',
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+        )
+        return fig_timeline
+
+    st.plotly_chart(cached_figure(results['month_year'], build_timeline), width='stretch')
 
 with col_right:
     # Sales by category
     st.markdown("## 🏷️ Sales by Category")
-    sales_by_category = filtered_df.groupby('category')['total_amount'].sum().reset_index()
-    sales_by_category = sales_by_category.sort_values('total_amount', ascending=False)
-    
-    fig_category = px.bar(
-        sales_by_category,
-        x='category',
-        y='total_amount',
-        title='Revenue by Product Category',
-        labels={'category': 'Category', 'total_amount': 'Revenue ($)'},
-        color='total_amount',
-        color_continuous_scale='Blues'
-    )
-    fig_category.update_layout(
-        showlegend=False,
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-    )
-    st.plotly_chart(fig_category, width='stretch')
+
+    def build_category(sales_by_category):
+        sales_by_category = sales_by_category.sort_values('total_amount', ascending=False)
+        fig_category = px.bar(
+            sales_by_category,
+            x='category',
+            y='total_amount',
+            title='Revenue by Product Category',
+            labels={'category': 'Category', 'total_amount': 'Revenue ($)'},
+            color='total_amount',
+            color_continuous_scale='Blues'
+        )
+        fig_category.update_layout(
+            showlegend=False,
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+        )
+        return fig_category
+
+    st.plotly_chart(cached_figure(results['category'], build_category), width='stretch')
 
 # Second row of charts
 col_left2, col_right2 = st.columns(2)
@@ -413,44 +675,48 @@ col_left2, col_right2 = st.columns(2)
 with col_left2:
     # Sales by shopping mall
     st.markdown("## 🏬 Performance by Shopping Mall")
-    sales_by_mall = filtered_df.groupby('shopping_mall')['total_amount'].sum().reset_index()
-    sales_by_mall = sales_by_mall.sort_values('total_amount', ascending=True)
-    
-    fig_mall = px.bar(
-        sales_by_mall,
-        x='total_amount',
-        y='shopping_mall',
-        title='Revenue by Shopping Mall',
-        labels={'shopping_mall': 'Shopping Mall', 'total_amount': 'Revenue ($)'},
-        orientation='h',
-        color='total_amount',
-        color_continuous_scale='Viridis'
-    )
-    fig_mall.update_layout(
-        showlegend=False,
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-    )
-    st.plotly_chart(fig_mall, width='stretch')
+
+    def build_mall(sales_by_mall):
+        sales_by_mall = sales_by_mall.sort_values('total_amount', ascending=True)
+        fig_mall = px.bar(
+            sales_by_mall,
+            x='total_amount',
+            y='shopping_mall',
+            title='Revenue by Shopping Mall',
+            labels={'shopping_mall': 'Shopping Mall', 'total_amount': 'Revenue ($)'},
+            orientation='h',
+            color='total_amount',
+            color_continuous_scale='Viridis'
+        )
+        fig_mall.update_layout(
+            showlegend=False,
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+        )
+        return fig_mall
+
+    st.plotly_chart(cached_figure(results['shopping_mall'], build_mall), width='stretch')
 
 with col_right2:
     # Payment method distribution
     st.markdown("## 💳 Payment Method Distribution")
-    payment_dist = filtered_df.groupby('payment_method')['total_amount'].sum().reset_index()
-    
-    fig_payment = px.pie(
-        payment_dist,
-        values='total_amount',
-        names='payment_method',
-        title='Revenue by Payment Method',
-        color_discrete_sequence=px.colors.qualitative.Set3
-    )
-    fig_payment.update_traces(textposition='inside', textinfo='percent+label')
-    fig_payment.update_layout(
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-    )
-    st.plotly_chart(fig_payment, width='stretch')
+
+    def build_payment(payment_dist):
+        fig_payment = px.pie(
+            payment_dist,
+            values='total_amount',
+            names='payment_method',
+            title='Revenue by Payment Method',
+            color_discrete_sequence=px.colors.qualitative.Set3
+        )
+        fig_payment.update_traces(textposition='inside', textinfo='percent+label')
+        fig_payment.update_layout(
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+        )
+        return fig_payment
+
+    st.plotly_chart(cached_figure(results['payment_method'], build_payment), width='stretch')
 
 # Third row of charts
 col_left3, col_right3 = st.columns(2)
@@ -458,44 +724,54 @@ col_left3, col_right3 = st.columns(2)
 with col_left3:
     # Customer demographics - Age distribution
     st.markdown("## 👥 Customer Age Distribution")
-    fig_age = px.histogram(
-        filtered_df,
-        x='age',
-        nbins=30,
-        title='Customer Age Distribution',
-        labels={'age': 'Age', 'count': 'Number of Transactions'},
-        color_discrete_sequence=['#ff7f0e']
-    )
-    fig_age.update_layout(
-        showlegend=False,
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-    )
-    st.plotly_chart(fig_age, width='stretch')
+
+    def build_age(age_bins):
+        # Bins are counted server-side, so the chart carries 30 bars, not one age per row
+        fig_age = go.Figure(go.Bar(
+            x=(age_bins['age'] + age_bins['age_end']) / 2,
+            y=age_bins['transactions'],
+            width=age_bins['age_end'] - age_bins['age'],
+            customdata=np.stack([age_bins['age'], age_bins['age_end'] - 1], axis=-1),
+            hovertemplate='Age %{customdata[0]}-%{customdata[1]}<br>Number of Transactions: %{y:,}<extra></extra>',
+            marker_color='#ff7f0e'
+        ))
+        fig_age.update_layout(
+            title='Customer Age Distribution',
+            xaxis_title='Age',
+            yaxis_title='Number of Transactions',
+            bargap=0,
+            showlegend=False,
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+        )
+        return fig_age
+
+    st.plotly_chart(cached_figure(results['age'], build_age), width='stretch')
 
 with col_right3:
     # Gender distribution
     st.markdown("## 👤 Sales by Gender")
-    gender_sales = filtered_df.groupby('gender').agg({
-        'total_amount': 'sum',
-        'customer_id': 'count'
-    }).reset_index()
-    gender_sales.columns = ['gender', 'total_revenue', 'transactions']
-    
-    fig_gender = go.Figure(data=[
-        go.Bar(name='Revenue ($)', x=gender_sales['gender'], y=gender_sales['total_revenue'], yaxis='y', offsetgroup=1),
-        go.Bar(name='Transactions', x=gender_sales['gender'], y=gender_sales['transactions'], yaxis='y2', offsetgroup=2)
-    ])
-    fig_gender.update_layout(
-        title='Revenue and Transactions by Gender',
-        xaxis=dict(title='Gender'),
-        yaxis=dict(title='Revenue ($)', side='left'),
-        yaxis2=dict(title='Transactions', side='right', overlaying='y'),
-        barmode='group',
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-    )
-    st.plotly_chart(fig_gender, width='stretch')
+
+    def build_gender(gender_sales):
+        gender_sales = gender_sales[['gender', 'total_amount', 'transactions']]
+        gender_sales.columns = ['gender', 'total_revenue', 'transactions']
+
+        fig_gender = go.Figure(data=[
+            go.Bar(name='Revenue ($)', x=gender_sales['gender'], y=gender_sales['total_revenue'], yaxis='y', offsetgroup=1),
+            go.Bar(name='Transactions', x=gender_sales['gender'], y=gender_sales['transactions'], yaxis='y2', offsetgroup=2)
+        ])
+        fig_gender.update_layout(
+            title='Revenue and Transactions by Gender',
+            xaxis=dict(title='Gender'),
+            yaxis=dict(title='Revenue ($)', side='left'),
+            yaxis2=dict(title='Transactions', side='right', overlaying='y'),
+            barmode='group',
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+        )
+        return fig_gender
+
+    st.plotly_chart(cached_figure(results['gender'], build_gender), width='stretch')
 
 # Fourth row - Heatmaps and advanced analytics
 st.markdown("## 🔥 Advanced Analytics")
@@ -505,254 +781,84 @@ col_heat1, col_heat2 = st.columns(2)
 with col_heat1:
     # Category vs Shopping Mall heatmap
     st.markdown("### Category Performance by Mall")
-    category_mall_pivot = filtered_df.pivot_table(
-        values='total_amount',
-        index='category',
-        columns='shopping_mall',
-        aggfunc='sum',
-        fill_value=0
-    )
-    
-    fig_heatmap1 = px.imshow(
-        category_mall_pivot,
-        labels=dict(x="Shopping Mall", y="Category", color="Revenue ($)"),
-        aspect="auto",
-        color_continuous_scale='YlOrRd',
-        title='Revenue Heatmap: Category vs Shopping Mall'
-    )
-    fig_heatmap1.update_layout(
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-    )
-    st.plotly_chart(fig_heatmap1, width='stretch')
+
+    def build_heatmap(category_mall_pivot):
+        fig_heatmap1 = px.imshow(
+            category_mall_pivot,
+            labels=dict(x="Shopping Mall", y="Category", color="Revenue ($)"),
+            aspect="auto",
+            color_continuous_scale='YlOrRd',
+            title='Revenue Heatmap: Category vs Shopping Mall'
+        )
+        fig_heatmap1.update_layout(
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+        )
+        return fig_heatmap1
+
+    st.plotly_chart(cached_figure(results['category_by_shopping_mall'], build_heatmap), width='stretch')
 
 with col_heat2:
     # Day of week analysis
     st.markdown("### Sales by Day of Week")
-    dow_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    dow_sales = filtered_df.groupby('day_of_week')['total_amount'].agg(['sum', 'count']).reset_index()
-    dow_sales['avg_transaction'] = dow_sales['sum'] / dow_sales['count']
-    dow_sales['day_of_week'] = pd.Categorical(dow_sales['day_of_week'], categories=dow_order, ordered=True)
-    dow_sales = dow_sales.sort_values('day_of_week')
-    
-    fig_dow = go.Figure()
-    fig_dow.add_trace(go.Bar(
-        x=dow_sales['day_of_week'],
-        y=dow_sales['sum'],
-        name='Total Revenue',
-        marker_color='lightblue'
-    ))
-    fig_dow.update_layout(
-        title='Revenue by Day of Week',
-        xaxis_title='Day',
-        yaxis_title='Revenue ($)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-    )
-    st.plotly_chart(fig_dow, width='stretch')
-
-# Data table section
-st.markdown("## 📋 Detailed Transaction Data")
-st.markdown("### Recent Transactions")
-
-# Display recent transactions
-display_df = filtered_df[['invoice_date', 'shopping_mall', 'category', 'quantity', 'price', 'total_amount', 'payment_method', 'gender', 'age']].sort_values('invoice_date', ascending=False).head(100)
-display_df['invoice_date'] = display_df['invoice_date'].dt.strftime('%Y-%m-%d')
-
-st.dataframe(
-    display_df,
-    width='stretch',
-    height=400
-)
-
-# Download button for filtered data
-csv = filtered_df.to_csv(index=False).encode('utf-8')
-st.download_button(
-    label="📥 Download Filtered Data as CSV",
-    data=csv,
-    file_name=f"filtered_sales_data_{datetime.now().strftime('%Y%m%d')}.csv",
-    mime="text/csv",
-)
-
-# ============================================================================
-# POPUP CHATBOT SECTION
-# ============================================================================
-
-if st.session_state.chat_popup_open:
-    # Use Streamlit's dialog decorator
-    @st.dialog("🤖 AI Powered Chatbot", width="large")
-    def show_chatbot():
-        st.markdown("""
-        <div style='background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
-                    padding: 1rem 1.5rem; 
-                    color: white;
-                    margin: -1rem -1rem 1.5rem -1rem;
-                    border-radius: 8px 8px 0 0;'>
-            <p style='margin: 0; font-size: 0.95rem; opacity: 0.95;'>Powered by GPT-4 • Ask me anything about your sales data</p>
-        </div>
-        """, unsafe_allow_html=True)
-        
-        # Set up GPT with API key from environment or Streamlit secrets
-        try:
-            # Try to get from Streamlit secrets (for cloud deployment)
-            api_key = st.secrets.get("OPENAI_API_KEY", None)
-            if not api_key:
-                # Fall back to environment variable (for local development)
-                api_key = os.environ.get("OPENAI_API_KEY", None)
-            
-            if not api_key:
-                st.error("⚠️ OpenAI API key not found. Please configure it in Streamlit secrets or environment variables.")
-                st.info("For local development: Set OPENAI_API_KEY environment variable")
-                st.info("For Streamlit Cloud: Add OPENAI_API_KEY to your app secrets")
-                st.stop()
-            
-            os.environ["OPENAI_API_KEY"] = api_key
-        except Exception as e:
-            st.error(f"Error loading API key: {e}")
-            st.stop()
-    
-        # Chat messages container
-        st.markdown("### 💬 Conversation")
-        
-        # Display chat messages
-        for message in st.session_state.messages:
-            with st.chat_message(message["role"]):
-                st.markdown(message["content"])
-        
-        # Function to get data summary for GPT context (optimized to stay under token limits)
-        def get_data_summary(df_data):
-            """Generate an optimized data summary for GPT context"""
-            
-            # Get ALL daily data but keep it compact
-            daily_data = df_data.groupby(df_data['invoice_date'].dt.date).agg({
-                'total_amount': ['sum', 'count'],
-                'customer_id': 'nunique'
-            }).round(2)
-            daily_data.columns = ['revenue', 'transactions', 'customers']
-            # Convert to compact format
-            daily_dict = {str(date): [float(row['revenue']), int(row['transactions']), int(row['customers'])]
-                          for date, row in daily_data.iterrows()}
-            
-            # Category performance with detailed metrics
-            category_stats = df_data.groupby('category').agg({
-                'total_amount': ['sum', 'mean', 'count'],
-                'quantity': 'sum'
-            }).round(2)
-            category_stats.columns = ['revenue', 'avg_trans', 'transactions', 'items']
-            category_dict = {cat: [float(row['revenue']), float(row['avg_trans']), 
-                                   int(row['transactions']), int(row['items'])]
-                            for cat, row in category_stats.iterrows()}
-            
-            # Mall performance
-            mall_stats = df_data.groupby('shopping_mall').agg({
-                'total_amount': ['sum', 'count']
-            }).round(2)
-            mall_stats.columns = ['revenue', 'transactions']
-            mall_dict = {mall: [float(row['revenue']), int(row['transactions'])]
-                        for mall, row in mall_stats.iterrows()}
-            
-            # Payment methods
-            payment_stats = df_data.groupby('payment_method')['total_amount'].agg(['sum', 'count']).round(2)
-            payment_dict = {method: [float(row['sum']), int(row['count'])]
-                           for method, row in payment_stats.iterrows()}
-            
-            summary = {
-                "overview": {
-                    "total_revenue": float(df_data['total_amount'].sum()),
-                    "total_transactions": int(len(df_data)),
-                    "unique_customers": int(df_data['customer_id'].nunique()),
-                    "date_range": [df_data['invoice_date'].min().strftime('%Y-%m-%d'),
-                                  df_data['invoice_date'].max().strftime('%Y-%m-%d')]
-                },
-                "daily": daily_dict,
-                "categories": category_dict,
-                "malls": mall_dict,
-                "payments": payment_dict,
-                "demographics": {
-                    "avg_age": float(df_data['age'].mean()),
-                    "gender": {gender: int(count) for gender, count in df_data['gender'].value_counts().items()}
-                }
-            }
-            return summary
-        
-        # GPT-powered answer function
-        def answer_with_gpt(question, df_data, api_key):
-            """Use OpenAI GPT to answer questions about the data"""
-            try:
-                from openai import OpenAI
-                client = OpenAI(api_key=api_key)
-                
-                # Get data summary
-                data_summary = get_data_summary(df_data)
-                
-                # Create system prompt
-                system_prompt = f"""You are a retail sales data analyst with access to detailed sales data.
-
-**DATA FORMAT (Compact arrays for efficiency):**
-- daily: {{date: [revenue, transactions, customers], ...}} for ALL dates
-- categories: {{category: [revenue, avg_transaction, num_transactions, items_sold], ...}}
-- malls: {{mall: [revenue, transactions], ...}}
-- payments: {{payment_method: [revenue, transactions], ...}}
 
-**Categories:** {', '.join(df_data['category'].unique())}
-**Malls:** {', '.join(df_data['shopping_mall'].unique())}
-**Payments:** {', '.join(df_data['payment_method'].unique())}
-
-**DATA:**
-{json.dumps(data_summary, indent=2)}
-
-**INSTRUCTIONS:**
-- For date questions: Check daily[date] - e.g., daily["2023-03-08"] returns [revenue, transactions, customers]
-- For category questions: Use categories[name] - e.g., categories["Clothing"] returns [revenue, avg_trans, count, items]
-- Always provide specific numbers
-- Format with markdown for clarity
+    def build_weekday(dow_sales):
+        fig_dow = go.Figure()
+        fig_dow.add_trace(go.Bar(
+            x=dow_sales['day_of_week'],
+            y=dow_sales['total_amount'],
+            name='Total Revenue',
+            marker_color='lightblue'
+        ))
+        fig_dow.update_layout(
+            title='Revenue by Day of Week',
+            xaxis_title='Day',
+            yaxis_title='Revenue ($)',
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+        )
+        return fig_dow
+
+    st.plotly_chart(cached_figure(results['day_of_week'], build_weekday), width='stretch')
+
+# Data table section: a fragment of its own, so paging, sorting and export
+# rerun just this section with the selected rows and filter key of the last full run
+@st.fragment
+def transaction_table(df, rows, export_key):
+    st.markdown("## 📋 Detailed Transaction Data")
+    st.markdown("### Recent Transactions")
+
+    # Only the requested page is ranked, gathered and formatted, never the whole selection
+    col_sort, col_order, col_page = st.columns([2, 1, 1])
+    with col_sort:
+        sort_by = st.selectbox("Sort by", TABLE_COLUMNS, key="table_sort")
+    with col_order:
+        descending = st.toggle("Descending", value=True, key="table_descending")
+    with col_page:
+        pages = page_count(rows)
+        page = st.number_input(f"Page (of {pages:,})", min_value=1, max_value=pages, value=1, key="table_page")
+
+    positions = page_rows(df, rows, sort_by, descending, min(page, pages) - 1)
+    st.dataframe(
+        format_page(df, positions),
+        width='stretch',
+        height=400
+    )
+    st.caption(f"Showing {len(positions):,} of {row_count(rows):,} transactions")
+
+    # Download button for filtered data. The file is built only when the button
+    # is clicked, and cached per filter state and format
+    export_format = st.radio("Export format", list(EXPORT_FORMATS), horizontal=True, key="export_format")
+    extension, mime = EXPORT_FORMATS[export_format]
+    st.download_button(
+        label=f"📥 Download Filtered Data as {export_format}",
+        data=lambda: cached_export(export_key, df, rows, export_format),
+        file_name=f"filtered_sales_data_{datetime.now().strftime('%Y%m%d')}.{extension}",
+        mime=mime,
+        on_click="ignore",
+    )
 
-Answer concisely using the data provided."""
-                
-                # Call GPT
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",  # Using cost-effective model
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": question}
-                    ],
-                    temperature=0.3,  # Lower temperature for more factual responses
-                    max_tokens=1000  # Increased for detailed answers
-                )
-                
-                return response.choices[0].message.content
-                
-            except ImportError:
-                return "❌ **Error**: OpenAI library not installed. Run: `pip install openai`"
-            except Exception as e:
-                return f"❌ **Error**: {str(e)}\n\nPlease check your API key."
-        
-        # Chat input
-        if prompt := st.chat_input("Ask me anything about your sales data..."):
-            # Add user message to chat history
-            st.session_state.messages.append({"role": "user", "content": prompt})
-            
-            # Display user message
-            with st.chat_message("user"):
-                st.markdown(prompt)
-            
-            # Generate and display GPT response
-            with st.chat_message("assistant"):
-                with st.spinner("🤖 Analyzing your data with AI..."):
-                    response = answer_with_gpt(prompt, filtered_df, api_key)
-                    st.markdown(response)
-            
-            # Add assistant response to chat history
-            st.session_state.messages.append({"role": "assistant", "content": response})
-        
-        # Clear chat button
-        if st.session_state.messages:
-            if st.button("🗑️ Clear Chat History", key="clear_chat_popup", use_container_width=True):
-                st.session_state.messages = []
-                st.rerun()
-    
-    # Call the dialog function to show the chatbot
-    show_chatbot()
+transaction_table(df, rows, (store_key, filter_state))
 
 # Footer
 st.markdown("---")
@@ -760,14 +866,20 @@ st.markdown("### 💡 Insights & Recommendations")
 col1, col2, col3 = st.columns(3)
 
 with col1:
-    top_category = filtered_df.groupby('category')['total_amount'].sum().idxmax()
+    top_category = results['category'].set_index('category')['total_amount'].idxmax()
     st.info(f"**Top Category:** {top_category} generates the highest revenue")
 
 with col2:
-    top_mall = filtered_df.groupby('shopping_mall')['total_amount'].sum().idxmax()
+    top_mall = results['shopping_mall'].set_index('shopping_mall')['total_amount'].idxmax()
     st.success(f"**Best Performing Mall:** {top_mall}")
 
 with col3:
-    preferred_payment = filtered_df.groupby('payment_method')['customer_id'].count().idxmax()
+    preferred_payment = results['payment_method'].set_index('payment_method')['transactions'].idxmax()
     st.warning(f"**Most Used Payment:** {preferred_payment}")
 
+# Cache statistics
+with st.sidebar.expander("⚙️ Cache Statistics"):
+    st.dataframe(pd.DataFrame(cache_stats()).set_index('cache'), width='stretch')
+    savings = answer_cache.savings()
+    st.caption(f"GPT answers: {savings['shared']} shared with an identical request in flight, "
+               f"{savings['saved_s']:.1f}s of answer time saved")
@@ -0,0 +1,95 @@
+"""
+Bitmap index for the sidebar filters
+Rows are kept sorted by invoice_date, so a date range is a searchsorted slice,
+and every dimension value has a packed bitmap of the rows that carry it.
+A filter change is then a few ORs/ANDs over packed bits instead of a chain of
+full-length boolean Series.
+"""
+import numpy as np
+import pandas as pd
+
+INDEXED_COLUMNS = ['category', 'shopping_mall', 'gender', 'payment_method']
+
+
+class FilterIndex:
+    """Per-value packed bitmaps plus the sorted date column of the transaction table"""
+
+    def __init__(self, df, base=None):
+        """Index df; base, an index over the first rows of df, is extended rather than rebuilt"""
+        # The loader sorts by invoice_date (missing dates last), which makes date ranges contiguous
+        self.n_rows = len(df)
+        self.dates = df['invoice_date'].to_numpy()
+        # Whole bytes of the base bitmaps are reused; only the rows after them are packed
+        reused = 0 if base is None else base.n_rows // 8
+        self.bitmaps = {}
+        for col in INDEXED_COLUMNS:
+            codes = df[col].cat.codes.to_numpy()[reused * 8:]
+            previous = {} if base is None else base.bitmaps[col]
+            self.bitmaps[col] = {}
+            for code, value in enumerate(df[col].cat.categories):
+                head = previous[value][:reused] if value in previous else np.zeros(reused, dtype=np.uint8)
+                self.bitmaps[col][value] = np.concatenate([head, np.packbits(codes == code)])
+
+    def date_bounds(self, date_range):
+        """Row slice [lo, hi) covering an inclusive (start, end) date range"""
+        if date_range is None:
+            return 0, self.n_rows
+        start, end = (pd.Timestamp(value).to_datetime64().astype(self.dates.dtype) for value in date_range)
+        lo = int(np.searchsorted(self.dates, start, side='left'))
+        hi = int(np.searchsorted(self.dates, end, side='right'))
+        return lo, max(lo, hi)
+
+    def _dimension_bits(self, col, values, first_byte, last_byte):
+        """OR of the selected values' bitmaps, or None when the selection is everything"""
+        bitmaps = self.bitmaps[col]
+        selected = {value for value in values if value in bitmaps}
+        if len(selected) == len(bitmaps):
+            return None
+        bits = np.zeros(last_byte - first_byte, dtype=np.uint8)
+        for value in selected:
+            np.bitwise_or(bits, bitmaps[value][first_byte:last_byte], out=bits)
+        return bits
+
+    def select_bits(self, date_range=None, categories=None, malls=None, genders=None, payment_methods=None):
+        """Rows matching the filters as (lo, hi, bits), before they are expanded into positions
+
+        The matching rows lie in [lo, hi). bits is None when all of them match;
+        otherwise it packs the dimension filters for rows lo // 8 * 8 onwards,
+        and its bits outside [lo, hi) are not meaningful. A filter left as None
+        is not applied. date_range is an inclusive (start, end) pair.
+        """
+        lo, hi = self.date_bounds(date_range)
+        if lo == hi:
+            return lo, hi, np.zeros(0, dtype=np.uint8)
+
+        first_byte, last_byte = lo // 8, (hi + 7) // 8
+        mask = None
+        for col, values in zip(INDEXED_COLUMNS, [categories, malls, genders, payment_methods]):
+            if values is None:
+                continue
+            bits = self._dimension_bits(col, values, first_byte, last_byte)
+            if bits is None:
+                continue
+            if mask is None:
+                mask = bits
+            else:
+                np.bitwise_and(mask, bits, out=mask)
+        return lo, hi, mask
+
+    def select(self, date_range=None, categories=None, malls=None, genders=None, payment_methods=None):
+        """Rows matching the filters, as a slice when possible or else an array of row positions
+
+        A filter left as None is not applied. date_range is an inclusive (start, end) pair.
+        """
+        return selected_rows(*self.select_bits(date_range, categories, malls, genders, payment_methods))
+
+
+def selected_rows(lo, hi, bits):
+    """Slice or row positions of a FilterIndex.select_bits() result"""
+    if bits is None:
+        return slice(lo, hi)
+    if lo == hi:
+        return np.empty(0, dtype=np.int64)
+    offset = lo // 8 * 8
+    hits = np.unpackbits(bits)[lo - offset:hi - offset]
+    return np.flatnonzero(hits) + lo
@@ -0,0 +1,205 @@
+"""
+Parallel row scans
+The row-level measures of a rerun (exact unique customers, the age histogram)
+reduce the selected rows of a column to per-value counts, and counts of
+disjoint row ranges add up. Large selections are therefore split into row
+ranges that a pool of worker processes counts over shared-memory copies of
+the columns, and the partial counts are summed. The workers receive the
+FilterIndex's packed selection, so the script thread neither expands nor
+repacks it. They run this module as their entry point rather than being
+started by multiprocessing, whose spawned processes re-run __main__, which is
+the dashboard script while it runs.
+
+RETAIL_WORKERS sets the pool size (default: one per core; 1 disables it) and
+RETAIL_PARALLEL_MIN_ROWS the selection size below which the scan stays in the
+script thread, where it is faster than shipping work to the pool.
+"""
+import atexit
+import os
+import pickle
+import subprocess
+import sys
+import threading
+import weakref
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+WORKERS = int(os.environ.get('RETAIL_WORKERS', os.cpu_count() or 1))
+PARALLEL_MIN_ROWS = int(os.environ.get('RETAIL_PARALLEL_MIN_ROWS', 1_000_000))
+
+
+def count_values(values):
+    """Occurrences of each non-negative value; negative ones (missing categorical codes) are skipped"""
+    return np.bincount(values[values >= 0])
+
+
+def add_counts(partials):
+    """Sum per-value count vectors of different lengths"""
+    total = np.zeros(max((len(counts) for counts in partials), default=0), dtype=np.int64)
+    for counts in partials:
+        total[:len(counts)] += counts
+    return total
+
+
+# Worker side: shared columns attached once per process
+_attached = {}
+
+
+def _attach(spec):
+    name, dtype, length = spec
+    if name not in _attached:
+        _attached[name] = shared_memory.SharedMemory(name=name)
+        # The script process owns the block; the worker's tracker must not unlink it on exit
+        resource_tracker.unregister(_attached[name]._name, 'shared_memory')
+    return np.ndarray(length, dtype=dtype, buffer=_attached[name].buf)
+
+
+def _count_range(specs, start, stop, bits, first):
+    """Per-value counts of each shared column over rows start..stop
+
+    bits, when given, packs the selection of rows first onwards.
+    """
+    # Blocks of earlier table versions are unlinked by now; stop mapping them
+    for name in set(_attached) - {spec[0] for spec in specs.values()}:
+        _attached.pop(name).close()
+    selected = None if bits is None else np.unpackbits(bits)[start - first:stop - first].view(bool)
+    partial = {}
+    for col, spec in specs.items():
+        values = _attach(spec)[start:stop]
+        partial[col] = count_values(values if selected is None else values[selected])
+    return partial
+
+
+def _serve(tasks, results):
+    """Worker loop: count each pickled task read from tasks and write back its result"""
+    while True:
+        try:
+            task = pickle.load(tasks)
+        except EOFError:
+            return
+        try:
+            result = _count_range(*task)
+        except Exception as error:
+            result = error
+        pickle.dump(result, results, protocol=pickle.HIGHEST_PROTOCOL)
+        results.flush()
+
+
+# Script side: one shared copy of each scanned column per table version
+class SharedColumns:
+    """Shared-memory copies of a table's columns, released with the table"""
+
+    def __init__(self):
+        self.blocks = {}
+        self.specs = {}
+        self.lock = threading.Lock()
+
+    def add(self, col, values):
+        with self.lock:
+            if col not in self.specs:
+                block = shared_memory.SharedMemory(create=True, size=max(1, values.nbytes))
+                np.ndarray(len(values), dtype=values.dtype, buffer=block.buf)[:] = values
+                self.blocks[col] = block
+                self.specs[col] = (block.name, values.dtype.str, len(values))
+            return self.specs[col]
+
+    def release(self):
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks.clear()
+
+
+# SharedColumns per table, by id(); an entry is dropped when its table is collected
+_shared = {}
+_shared_lock = threading.Lock()
+# Worker processes, started on the first large scan; one scan uses them at a time
+_workers = None
+_workers_lock = threading.Lock()
+
+
+def _release(table_id):
+    with _shared_lock:
+        shared = _shared.pop(table_id, None)
+    if shared is not None:
+        shared.release()
+
+
+def _shared_columns(df):
+    with _shared_lock:
+        if id(df) not in _shared:
+            _shared[id(df)] = SharedColumns()
+            # The blocks are unlinked once no store version references the table
+            weakref.finalize(df, _release, id(df))
+        return _shared[id(df)]
+
+
+def _start_workers():
+    # Tasks and results travel as pickles over each worker's stdin and stdout
+    return [subprocess.Popen([sys.executable, os.path.abspath(__file__)],
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            for _ in range(WORKERS)]
+
+
+def _stop_workers():
+    global _workers
+    for worker in _workers or []:
+        worker.stdin.close()
+        worker.wait()
+    _workers = None
+
+
+atexit.register(_stop_workers)
+
+
+def _ranges(lo, hi, bits, n_ranges):
+    """(start, stop, packed selection or None, first row of the packed bits) ranges covering [lo, hi)
+
+    Ranges start on whole bytes of bits, so each one gets a view of its bytes.
+    """
+    offset = lo // 8 * 8
+    step = -(-(hi - offset) // (8 * n_ranges)) * 8
+    for first in range(offset, hi, step):
+        start, stop = max(lo, first), min(hi, first + step)
+        yield start, stop, None if bits is None else bits[(first - offset) // 8:(stop - offset + 7) // 8], first
+
+
+def parallel_counts(df, columns, rows, selection):
+    """{col: per-value counts over the selected rows} counted by the worker pool
+
+    columns maps names to full-length integer arrays of df to count; rows and
+    selection are the FilterIndex.select() and select_bits() results of one
+    filter state. Returns None when the selection is small enough, or the pool
+    small enough, that the caller should count in-process instead.
+    """
+    global _workers
+    n_rows = rows.stop - rows.start if isinstance(rows, slice) else len(rows)
+    if WORKERS < 2 or n_rows < max(1, PARALLEL_MIN_ROWS):
+        return None
+    table = _shared_columns(df)
+    specs = {col: table.add(col, values) for col, values in columns.items()}
+    with _workers_lock:
+        if _workers is None:
+            _workers = _start_workers()
+        try:
+            # One range per worker, each sent as soon as the previous worker has read its own
+            tasks = list(_ranges(*selection, WORKERS))
+            for worker, task in zip(_workers, tasks):
+                pickle.dump((specs,) + task, worker.stdin, protocol=pickle.HIGHEST_PROTOCOL)
+                worker.stdin.flush()
+            partials = [pickle.load(worker.stdout) for worker, _ in zip(_workers, tasks)]
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # A worker died; count in-process and start a new pool next time
+            for worker in _workers:
+                worker.kill()
+            _workers = None
+            return None
+    for partial in partials:
+        if isinstance(partial, Exception):
+            raise partial
+    return {col: add_counts([partial[col] for partial in partials]) for col in columns}
+
+
+if __name__ == "__main__":
+    _serve(sys.stdin.buffer, sys.stdout.buffer)
@@ -0,0 +1,241 @@
+"""
+Process-wide result caches
+Analysts keep switching between the same few filter combinations, so the
+aggregated results for a filter are memoized in an LRU cache shared by every
+session, bounded by a memory budget and keeping hit/miss/eviction stats.
+Plotly figures are cached the same way, keyed by a fingerprint of the
+aggregated data each chart is drawn from.
+"""
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Every cache registers itself here so the dashboards can show their stats
+CACHES = []
+
+
+def estimate_size(value):
+    """Approximate memory held by a cached value, in bytes"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if isinstance(value, pd.DataFrame) else usage)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by an approximate memory budget"""
+
+    def __init__(self, name, max_bytes):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        CACHES.append(self)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key][0]
+
+    def put(self, key, value, nbytes=None):
+        nbytes = estimate_size(value) if nbytes is None else nbytes
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                # Larger than the whole budget: serve it once, never cache it
+                return value
+            self.entries[key] = (value, nbytes)
+            self.bytes += nbytes
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+        return value
+
+    def get_or_compute(self, key, compute):
+        """Cached value for key, calling compute() on a miss"""
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = self.put(key, compute())
+        return value
+
+    def migrate(self, convert):
+        """Re-key entries: convert(key) gives the new key, the same key, or None to drop the entry"""
+        with self.lock:
+            entries, self.entries = self.entries, OrderedDict()
+            for key, (value, nbytes) in entries.items():
+                new_key = convert(key)
+                if new_key is None:
+                    self.bytes -= nbytes
+                else:
+                    self.entries[new_key] = (value, nbytes)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'cache': self.name,
+                'entries': len(self.entries),
+                'size_mb': round(self.bytes / 2 ** 20, 2),
+                'budget_mb': round(self.max_bytes / 2 ** 20, 2),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+class TTLCache(LRUCache):
+    """LRU cache whose entries also expire ttl seconds after they were stored"""
+
+    def __init__(self, name, max_bytes, ttl):
+        super().__init__(name, max_bytes)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[0][0] > self.ttl:
+                # Expired entries count as evictions
+                self.bytes -= self.entries.pop(key)[1]
+                self.evictions += 1
+        missing = object()
+        stamped = super().get(key, missing)
+        return default if stamped is missing else stamped[1]
+
+    def put(self, key, value, nbytes=None):
+        nbytes = estimate_size(value) if nbytes is None else nbytes
+        super().put(key, (time.monotonic(), value), nbytes)
+        return value
+
+
+def cache_stats():
+    """Stats of every registered cache, one dict per cache"""
+    return [cache.stats() for cache in CACHES]
+
+
+def _selection_key(values, all_values):
+    """None when every value is selected, else a sorted tuple"""
+    selected = set(values)
+    if selected >= set(all_values):
+        return None
+    return tuple(sorted(selected))
+
+
+def filter_key(dims, date_range=None, categories=None, malls=None, genders=None):
+    """Canonical, hashable form of the sidebar filters
+
+    Selection order does not matter and "everything selected" has a single
+    spelling, so equivalent sidebar states share one cache entry.
+    """
+    dates = None
+    if date_range is not None:
+        dates = tuple(pd.Timestamp(value).date().isoformat() for value in date_range)
+    return (
+        dates,
+        None if categories is None else _selection_key(categories, dims['category']),
+        None if malls is None else _selection_key(malls, dims['shopping_mall']),
+        None if genders is None else _selection_key(genders, dims['gender']),
+    )
+
+
+def filter_matches(state, rows):
+    """Whether any of rows passes the filters of a filter_key() state"""
+    dates, categories, malls, genders = state
+    mask = np.ones(len(rows), dtype=bool)
+    if dates is not None:
+        mask &= rows['invoice_date'].between(pd.Timestamp(dates[0]), pd.Timestamp(dates[1])).to_numpy()
+    for col, selected in zip(['category', 'shopping_mall', 'gender'], [categories, malls, genders]):
+        if selected is not None:
+            mask &= rows[col].isin(selected).to_numpy()
+    return bool(mask.any())
+
+
+def carry_over(previous_key, store_key, rows, caches=None):
+    """After rows were appended to a store, keep the cached results they leave unchanged
+
+    Entries keyed (previous_key, filter state, ...) move to the new store key
+    when no appended row passes their filters; the others are dropped. caches
+    defaults to the filter results cache.
+    """
+    def convert(key):
+        if key[0] != previous_key:
+            return key
+        if filter_matches(key[1], rows):
+            return None
+        return (store_key,) + key[1:]
+    for cache in caches or [results_cache]:
+        cache.migrate(convert)
+
+
+# Aggregated results for one filter combination, shared by all sessions
+results_cache = LRUCache('filter results', int(os.environ.get('RETAIL_RESULT_CACHE_MB', 64)) * 2 ** 20)
+
+
+def fingerprint(data):
+    """Digest of a chart's aggregated input: a frame, series, array or plain value"""
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        names = list(data.columns) if isinstance(data, pd.DataFrame) else [data.name]
+        digest.update(repr((names, data.index.names)).encode())
+        digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    elif isinstance(data, np.ndarray):
+        digest.update(data.dtype.str.encode())
+        digest.update(data.tobytes())
+    else:
+        digest.update(repr(data).encode())
+    return digest.hexdigest()
+
+
+def _builder_key(build):
+    """Identity of a figure builder that survives script reruns but not code edits"""
+    code = build.__code__
+    consts = tuple(const for const in code.co_consts if not hasattr(const, 'co_code'))
+    return code.co_filename, build.__qualname__, hashlib.blake2b(code.co_code + repr(consts).encode()).hexdigest()
+
+
+def cached_figure(data, build):
+    """build(data), reused while data is unchanged
+
+    Figures are shared by every session, so callers must not modify them.
+    The key covers the builder's code, so editing a chart rebuilds it.
+    """
+    key = (_builder_key(build), fingerprint(data))
+    missing = object()
+    figure = figure_cache.get(key, missing)
+    if figure is missing:
+        figure = build(data)
+        # Sized by its JSON, which is what the figure costs to keep and to send
+        figure_cache.put(key, figure, nbytes=len(figure.to_json()))
+    return figure
+
+
+# Built Plotly figures, shared by all sessions
+figure_cache = LRUCache('figures', int(os.environ.get('RETAIL_FIGURE_CACHE_MB', 32)) * 2 ** 20)
@@ -0,0 +1,190 @@
+"""
+Pre-aggregated sales cube
+Revenue, transaction and item counts are materialized once per
+date x category x mall x gender x payment method cell. Every KPI, chart and
+heatmap is then a slice and reduction of the cube, so dashboard latency
+depends on the number of dimension values rather than the number of rows.
+"""
+import numpy as np
+import pandas as pd
+
+from sales_data import DAY_ORDER
+
+CUBE_DIMENSIONS = ['category', 'shopping_mall', 'gender', 'payment_method']
+MEASURES = ['total_amount', 'transactions', 'quantity']
+
+
+def axes_of(*cols):
+    """Cube axis numbers of dimension columns; 'invoice_date' is axis 0"""
+    return tuple(0 if col == 'invoice_date' else 1 + CUBE_DIMENSIONS.index(col) for col in cols)
+
+
+def _embedding(positions):
+    """Index placing a sub-cube at the given per-axis positions; plain slices when contiguous"""
+    if all(len(axis) == 0 or np.array_equal(axis, np.arange(axis[0], axis[0] + len(axis))) for axis in positions):
+        return tuple(slice(axis[0], axis[0] + len(axis)) if len(axis) else slice(0, 0) for axis in positions)
+    return np.ix_(*positions)
+
+
+class SalesCube:
+    """Dense measure arrays with axes (date, category, mall, gender, payment method)"""
+
+    def __init__(self, records, labels=None, base=None):
+        """Build from transaction rows or from pre-aggregated cells
+
+        Cells (see sales_data.aggregate_cells) carry a 'transactions' count per
+        row. labels maps each dimension to its values; by default they are
+        the categories of the records' columns. With base, the cube is base
+        plus records, so appended rows do not rescan the ones already counted.
+        """
+        dated = records[records['invoice_date'].notna()]
+        days = dated['invoice_date'].to_numpy().astype('datetime64[D]')
+        self.dates = np.unique(days) if base is None else np.union1d(base.dates, days)
+        date_codes = np.searchsorted(self.dates, days)
+        if labels is None:
+            labels = {col: dated[col].astype('category').cat.categories for col in CUBE_DIMENSIONS}
+        self.labels = {col: list(labels[col]) for col in CUBE_DIMENSIONS}
+        self.shape = (len(self.dates),) + tuple(len(self.labels[col]) for col in CUBE_DIMENSIONS)
+
+        # Calendar lookups per date axis entry
+        months = self.dates.astype('datetime64[M]')
+        month_values, self.month_of_date = np.unique(months, return_inverse=True)
+        self.months = list(np.datetime_as_string(month_values, unit='M'))
+        # 1970-01-01 was a Thursday; shift so Monday is 0
+        self.weekday_of_date = (self.dates.view('int64') + 3) % 7
+
+        codes = [date_codes] + [pd.Categorical(dated[col], categories=self.labels[col]).codes
+                                for col in CUBE_DIMENSIONS]
+        cells = np.ravel_multi_index(codes, self.shape)
+        size = int(np.prod(self.shape))
+        counts = dated['transactions'].to_numpy() if 'transactions' in dated else None
+        self.measures = {
+            'total_amount': np.bincount(cells, weights=dated['total_amount'].to_numpy(), minlength=size).reshape(self.shape),
+            'transactions': np.bincount(cells, weights=counts, minlength=size).astype(np.int64).reshape(self.shape),
+            'quantity': np.bincount(cells, weights=dated['quantity'].to_numpy(), minlength=size).astype(np.int64).reshape(self.shape),
+        }
+        if base is not None:
+            # Base axes map into the (possibly wider) new ones
+            positions = [np.searchsorted(self.dates, base.dates)] + \
+                        [pd.Index(self.labels[col]).get_indexer(base.labels[col]) for col in CUBE_DIMENSIONS]
+            target = _embedding(positions)
+            for name, values in self.measures.items():
+                values[target] += base.measures[name]
+
+    def date_bounds(self, date_range):
+        """Date-axis slice for an inclusive (start, end) range"""
+        if date_range is None:
+            return slice(0, len(self.dates))
+        start, end = (np.datetime64(pd.Timestamp(value).date(), 'D') for value in date_range)
+        lo = int(np.searchsorted(self.dates, start, side='left'))
+        hi = int(np.searchsorted(self.dates, end, side='right'))
+        return slice(lo, max(lo, hi))
+
+    def slice(self, date_range=None, categories=None, malls=None, genders=None, payment_methods=None):
+        """Sub-cube for the sidebar filters; a filter left as None is not applied"""
+        dates = self.date_bounds(date_range)
+        measures = {name: values[dates] for name, values in self.measures.items()}
+        keep = {}
+        for axis, (col, selected) in enumerate(zip(CUBE_DIMENSIONS, [categories, malls, genders, payment_methods]), start=1):
+            labels = self.labels[col]
+            if selected is None:
+                keep[col] = np.ones(len(labels), dtype=bool)
+                continue
+            keep[col] = np.isin(labels, list(selected))
+            if keep[col].all():
+                continue
+            measures = {name: values.compress(keep[col], axis=axis) for name, values in measures.items()}
+        return CubeView(self, dates, keep, measures)
+
+
+class CubeView:
+    """Filtered sub-cube with the reductions behind each dashboard section
+
+    Reductions are memoized per set of kept axes, and each new one is derived
+    from the smallest marginal already computed, so asking for several views
+    does not rescan the full sub-cube for each of them.
+    """
+
+    def __init__(self, cube, dates, keep, measures):
+        self.cube = cube
+        self.dates = dates
+        self.labels = {col: [label for label, kept in zip(cube.labels[col], keep[col]) if kept]
+                       for col in CUBE_DIMENSIONS}
+        self.measures = measures
+        self.marginals = {}
+        self.full_passes = 0
+
+    def _reduce(self, keep_axes):
+        """Sum every measure over all axes except keep_axes"""
+        keep = tuple(sorted(keep_axes))
+        if keep in self.marginals:
+            return self.marginals[keep]
+        source_axes, source = tuple(range(1 + len(CUBE_DIMENSIONS))), self.measures
+        for axes, sums in self.marginals.items():
+            if set(keep) <= set(axes) and sums['transactions'].size < source['transactions'].size:
+                source_axes, source = axes, sums
+        if source is self.measures:
+            self.full_passes += 1
+        drop = tuple(position for position, axis in enumerate(source_axes) if axis not in keep)
+        self.marginals[keep] = {name: values.sum(axis=drop) for name, values in source.items()}
+        return self.marginals[keep]
+
+    def prepare(self, keep_sets):
+        """Pre-compute the marginals a set of views will need with at most two full passes
+
+        Views without the date axis are served from one date-collapsed marginal,
+        and views on the date axis from one marginal that keeps it.
+        """
+        keep_sets = [set(keep) for keep in keep_sets]
+        without_date = [keep for keep in keep_sets if 0 not in keep]
+        with_date = [keep for keep in keep_sets if 0 in keep]
+        if without_date:
+            self._reduce(set().union(*without_date))
+        if with_date:
+            self._reduce(set().union(*with_date))
+
+    def totals(self):
+        """Revenue, transaction and item totals for the KPI row"""
+        return {name: values.sum() for name, values in self._reduce(()).items()}
+
+    def by(self, col):
+        """Measures per value of one dimension, restricted to values with transactions"""
+        sums = self._reduce(axes_of(col))
+        present = sums['transactions'] > 0
+        return pd.DataFrame({col: np.asarray(self.labels[col], dtype=object)[present],
+                             **{name: values[present] for name, values in sums.items()}})
+
+    def _by_date_group(self, group_of_date, labels, col):
+        sums = self._reduce((0,))
+        groups = group_of_date[self.dates]
+        grouped = {name: np.bincount(groups, weights=values, minlength=len(labels)).astype(values.dtype)
+                   for name, values in sums.items()}
+        present = grouped['transactions'] > 0
+        return pd.DataFrame({col: np.asarray(labels, dtype=object)[present],
+                             **{name: values[present] for name, values in grouped.items()}})
+
+    def by_date(self):
+        """Measures per invoice date, restricted to dates with transactions"""
+        sums = self._reduce((0,))
+        present = sums['transactions'] > 0
+        return pd.DataFrame({'invoice_date': self.cube.dates[self.dates][present],
+                             **{name: values[present] for name, values in sums.items()}})
+
+    def by_month(self):
+        """Measures per month_year, in chronological order"""
+        return self._by_date_group(self.cube.month_of_date, self.cube.months, 'month_year')
+
+    def by_weekday(self):
+        """Measures per day_of_week, Monday first"""
+        return self._by_date_group(self.cube.weekday_of_date, DAY_ORDER, 'day_of_week')
+
+    def pivot(self, index, columns, measure='total_amount'):
+        """Two-dimension table of one measure, like DataFrame.pivot_table(aggfunc='sum')"""
+        index_axis, column_axis = axes_of(index, columns)
+        sums = self._reduce((index_axis, column_axis))
+        values = sums[measure] if index_axis < column_axis else sums[measure].T
+        counts = sums['transactions'] if index_axis < column_axis else sums['transactions'].T
+        rows, cols = counts.sum(axis=1) > 0, counts.sum(axis=0) > 0
+        table = pd.DataFrame(values, index=pd.Index(self.labels[index], name=index),
+                             columns=pd.Index(self.labels[columns], name=columns))
+        return table.loc[rows, cols]
@@ -0,0 +1,585 @@
+"""
+Data loading for the Retail Sales Dashboard
+Ingests customer_shopping_data.csv in bounded chunks into a date-sorted
+columnar snapshot (plus the pre-aggregated cube cells) on disk, so later cold
+starts only read the columns back and exports larger than RAM can be ingested.
+The snapshot is partitioned Hive-style by year and month, and each month's
+row groups hold whole malls in mall order, so loads filtered on dates or malls
+skip whole files and row groups.
+"""
+import glob
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+from urllib.parse import quote, unquote
+
+import numpy as np
+import pandas as pd
+
+DATA_FILE = 'customer_shopping_data.csv'
+SNAPSHOT_DIR = '.snapshot'
+# Bump whenever the enriched frame changes shape so old snapshots are rebuilt
+SNAPSHOT_VERSION = 9
+# Rows parsed per ingestion chunk; peak ingestion memory follows this, not the file size
+CHUNK_ROWS = int(os.environ.get('RETAIL_CHUNK_ROWS', 250_000))
+# Rows a snapshot row group is filled to with whole malls; every row group
+# read costs about a millisecond, so smaller months are not split per mall
+MIN_GROUP_ROWS = int(os.environ.get('RETAIL_MIN_GROUP_ROWS', 10_000))
+# Bytes before the end of the ingested CSV that must be unchanged for new bytes to count as an append
+TAIL_BYTES = 64 * 1024
+# Appended parts kept beside the snapshot before the next cold start re-ingests the CSV
+MAX_PARTS = 32
+
+# Low-cardinality columns held as categorical codes; their categories form the
+# dimension dictionary shared by the sidebar filters and the groupbys
+DIMENSION_COLUMNS = ['category', 'shopping_mall', 'gender', 'payment_method', 'month_year', 'day_of_week']
+DAY_ORDER = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+CATEGORICAL_COLUMNS = ['category', 'shopping_mall', 'gender', 'payment_method', 'customer_id', 'month_year', 'day_of_week']
+# Grain of the cube cells aggregated alongside the snapshot
+CELL_DIMENSIONS = ['category', 'shopping_mall', 'gender', 'payment_method']
+# Directory levels of the snapshot (year=2022/month=10); these columns live in
+# the paths rather than in the Parquet files
+PARTITION_COLUMNS = ['year', 'month']
+# Directory value of a missing partition key, as Hive and Arrow spell it
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+def source_signature(path=DATA_FILE):
+    """Cheap change-detection signature (size and mtime) of the source CSV"""
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def file_hash(path, block_size=1 << 20):
+    """SHA-256 of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_dates(raw):
+    """Parse date strings like '05/08/2022', each distinct string once
+
+    A multi-year export has a few hundred distinct dates among its rows, so the
+    strings are factorized and only the distinct values go through
+    to_datetime. Returns (codes, dates): row codes into the parsed distinct dates.
+    """
+    codes, distinct = pd.factorize(raw)
+    dates = pd.to_datetime(distinct, format='%d/%m/%Y', errors='coerce')
+    if (codes < 0).any():
+        # Missing strings point at a trailing NaT
+        codes[codes < 0] = len(dates)
+        dates = dates.append(pd.DatetimeIndex([pd.NaT], dtype=dates.dtype))
+    return codes, dates
+
+
+def enrich(df):
+    """Parse invoice_date and create the derived columns used by the dashboards"""
+    # Calendar columns come from per-date lookup tables broadcast by code, not row-wise .dt accessors
+    codes, dates = parse_dates(df['invoice_date'])
+    df['invoice_date'] = dates.to_numpy()[codes]
+    # Create derived columns
+    df['total_amount'] = df['quantity'] * df['price']
+    df['year'] = dates.year.to_numpy()[codes]
+    df['month'] = dates.month.to_numpy()[codes]
+    # pandas 2 spells the month of a missing date 'NaT'; keep it missing instead
+    df['month_year'] = pd.Categorical(pd.Index(dates.to_period('M').astype(str)).where(dates.notna()))[codes]
+    df['day_of_week'] = pd.Categorical(dates.day_name(), categories=DAY_ORDER)[codes]
+    return df
+
+
+def sort_by_date(df):
+    """Date-sorted rows turn every date range filter into a contiguous slice
+
+    Rows of the same date are ordered by mall, then kept in file order.
+    """
+    return df.sort_values(['invoice_date', 'shopping_mall'], kind='stable', na_position='last', ignore_index=True)
+
+
+def compact(df):
+    """Shrink the frame: categorical dimensions, narrow integers, float32 prices
+
+    total_amount stays float64 because revenue sums need cent precision;
+    price only feeds the transaction table, where float32 is exact to the cent.
+    """
+    # customer_id is dictionary-encoded too: its codes let distinct-customer counts skip string hashing
+    for col in ['category', 'shopping_mall', 'gender', 'payment_method', 'customer_id']:
+        df[col] = _sorted_categorical(df[col])
+    # 'YYYY-MM' strings sort chronologically, so an ordered categorical keeps the trend axis in order
+    df['month_year'] = _sorted_categorical(df['month_year'], ordered=True)
+    df['day_of_week'] = pd.Categorical(df['day_of_week'], categories=DAY_ORDER, ordered=True)
+    for col in ['age', 'quantity', 'year', 'month']:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    df['price'] = df['price'].astype(np.float32)
+    return df
+
+
+def _sorted_categorical(values, ordered=False):
+    """Categorical with sorted categories, from strings or from another categorical"""
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype('category')
+    return values.cat.set_categories(sorted(values.cat.categories), ordered=ordered)
+
+
+def aggregate_cells(df):
+    """Cube cells: revenue, transactions and items per day x category x mall x gender x payment"""
+    return (df.groupby(['invoice_date'] + CELL_DIMENSIONS, observed=True, sort=False)
+              .agg(total_amount=('total_amount', 'sum'),
+                   transactions=('total_amount', 'size'),
+                   quantity=('quantity', 'sum'))
+              .reset_index())
+
+
+def merge_cells(parts):
+    """Combine cube cells aggregated from separate chunks"""
+    cells = pd.concat(parts, ignore_index=True)
+    return cells.groupby(['invoice_date'] + CELL_DIMENSIONS, observed=True, sort=False).sum().reset_index()
+
+
+def append_rows(df, rows):
+    """df followed by enriched rows, categorical columns widened to the union of their categories"""
+    rows = compact(rows)
+    widened = {}
+    for col in CATEGORICAL_COLUMNS:
+        added = rows[col].cat.categories.difference(df[col].cat.categories)
+        if len(added) and col in DIMENSION_COLUMNS:
+            # Dimension values stay sorted for the sidebar and the cube axes
+            widened[col] = df[col].cat.set_categories(sorted(df[col].cat.categories.union(added)))
+        elif len(added):
+            # New customers go last, so existing codes are kept rather than recoded
+            dtype = pd.CategoricalDtype(df[col].cat.categories.append(added))
+            widened[col] = pd.Categorical.from_codes(df[col].cat.codes.to_numpy(), dtype=dtype)
+        else:
+            widened[col] = df[col]
+        rows[col] = pd.Categorical(rows[col], dtype=widened[col].dtype)
+    return pd.concat([df.assign(**widened), rows], ignore_index=True)
+
+
+def dimensions(df):
+    """Dimension dictionary: the distinct values of every categorical column"""
+    return {col: list(df[col].cat.categories) for col in DIMENSION_COLUMNS}
+
+
+def parse_sales_csv(path=DATA_FILE):
+    """Read and enrich the raw CSV export entirely in memory"""
+    return compact(sort_by_date(enrich(pd.read_csv(path))))
+
+
+def snapshot_paths(path=DATA_FILE):
+    """Location of the partitioned snapshot directory, its cube cells and metadata for a source CSV"""
+    folder = os.path.join(os.path.dirname(os.path.abspath(path)), SNAPSHOT_DIR)
+    name = os.path.splitext(os.path.basename(path))[0]
+    return (os.path.join(folder, name),
+            os.path.join(folder, name + '.cells.parquet'),
+            os.path.join(folder, name + '.json'))
+
+
+def part_paths(path, part):
+    """Location of one appended part of the snapshot and its cube cells"""
+    data_dir, _, _ = snapshot_paths(path)
+    return f'{data_dir}.part{part:03d}.parquet', f'{data_dir}.part{part:03d}.cells.parquet'
+
+
+def partition_path(data_dir, year, month):
+    """File holding the rows of one year/month partition"""
+    values = [NULL_PARTITION if value is None else quote(str(value), safe='') for value in (year, month)]
+    return os.path.join(data_dir, *(f'{col}={value}' for col, value in zip(PARTITION_COLUMNS, values)), 'part-0.parquet')
+
+
+def partition_files(data_dir):
+    """Partition files of a snapshot in chronological order, the undated rows last"""
+    def key(file_path):
+        year, month = (unquote(segment.split('=', 1)[1])
+                       for segment in os.path.relpath(file_path, data_dir).split(os.sep)[:2])
+        missing = [value == NULL_PARTITION for value in (year, month)]
+        return (missing[0], 0 if missing[0] else int(year), missing[1], 0 if missing[1] else int(month))
+    return sorted(glob.glob(os.path.join(glob.escape(data_dir), '*', '*', '*.parquet')), key=key)
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != SNAPSHOT_VERSION:
+        return None
+    return meta
+
+
+def _write_meta(meta_path, meta):
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, meta_path)
+
+
+def snapshot_meta(path=DATA_FILE):
+    """Metadata of a complete snapshot for path, or None"""
+    data_dir, cells_path, meta_path = snapshot_paths(path)
+    meta = _read_meta(meta_path)
+    if meta is None or not (os.path.isdir(data_dir) and os.path.exists(cells_path)):
+        return None
+    return meta
+
+
+def _snapshot_is_current(path, signature):
+    """Check the snapshot against the CSV, hashing only when size or mtime moved"""
+    _, _, meta_path = snapshot_paths(path)
+    meta = snapshot_meta(path)
+    if meta is None:
+        return False
+    if meta['size'] == signature['size'] and meta['mtime_ns'] == signature['mtime_ns']:
+        return True
+    # Appends leave no whole-file hash behind (see advance_meta)
+    if meta['size'] != signature['size'] or meta['sha256'] is None or file_hash(path) != meta['sha256']:
+        return False
+    # Same content, new mtime (e.g. re-copied export): keep the snapshot
+    meta.update(signature)
+    try:
+        _write_meta(meta_path, meta)
+    except OSError:
+        pass
+    return True
+
+
+def tail_fingerprint(path, size):
+    """SHA-256 of the TAIL_BYTES before byte offset size, or None when that offset is mid-line"""
+    start = max(0, size - TAIL_BYTES)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        block = f.read(size - start)
+    if not block.endswith(b'\n'):
+        return None
+    return hashlib.sha256(block).hexdigest()
+
+
+def _date_extent(rows):
+    """Latest invoice date (ISO string or None) and whether any date is missing"""
+    latest = rows['invoice_date'].max()
+    return (None if pd.isna(latest) else latest.isoformat()), bool(rows['invoice_date'].isna().any())
+
+
+def appended_since(path, meta, signature):
+    """Whether the CSV only grew since meta: larger, with the bytes before the old end unchanged"""
+    return (meta.get('tail_sha256') is not None and signature['size'] > meta['size']
+            and tail_fingerprint(path, meta['size']) == meta['tail_sha256'])
+
+
+def read_csv_tail(path, meta):
+    """Enriched rows of the complete lines appended after meta['size']; returns (rows, end offset)
+
+    rows is None when no complete line was appended yet.
+    """
+    with open(path, 'rb') as f:
+        f.seek(meta['size'])
+        data = f.read()
+    # The exporter may be mid-line: leave a partial last line for the next refresh
+    data = data[:data.rfind(b'\n') + 1]
+    if not data:
+        return None, meta['size']
+    rows = pd.read_csv(io.BytesIO(data), header=None, names=meta['columns'])
+    return sort_by_date(enrich(rows)), meta['size'] + len(data)
+
+
+def appends_in_order(meta, rows):
+    """Whether rows can follow the ingested ones without breaking the date order"""
+    if meta['nat']:
+        # Rows with a missing date already sit last
+        return False
+    first = rows['invoice_date'].min()
+    return meta['max_date'] is None or pd.isna(first) or first >= pd.Timestamp(meta['max_date'])
+
+
+def advance_meta(path, meta, rows, end, signature):
+    """Metadata after rows, ending at byte offset end, were appended to what meta describes"""
+    max_date, nat = _date_extent(rows)
+    latest = [date for date in (meta['max_date'], max_date) if date is not None]
+    return dict(
+        meta,
+        size=end,
+        # A partial last line left behind means the file is not fully ingested yet
+        mtime_ns=signature['mtime_ns'] if end == signature['size'] else 0,
+        # Re-hashing the whole file would cost time proportional to all rows, not the new ones
+        sha256=None,
+        rows=meta['rows'] + len(rows),
+        tail_sha256=tail_fingerprint(path, end),
+        max_date=max(latest) if latest else None,
+        nat=meta['nat'] or nat,
+    )
+
+
+def _snapshot_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ('invoice_no', pa.string()),
+        ('customer_id', pa.string()),
+        ('gender', pa.string()),
+        ('age', pa.int8()),
+        ('category', pa.string()),
+        ('quantity', pa.int16()),
+        ('price', pa.float32()),
+        ('payment_method', pa.string()),
+        ('invoice_date', pa.timestamp('us')),
+        ('shopping_mall', pa.string()),
+        ('total_amount', pa.float64()),
+        ('year', pa.int16()),
+        ('month', pa.int8()),
+        ('month_year', pa.string()),
+        ('day_of_week', pa.string()),
+    ])
+
+
+def ingest_csv(path=DATA_FILE, chunk_rows=CHUNK_ROWS, signature=None, group_rows=MIN_GROUP_ROWS):
+    """Stream the CSV into the date-sorted snapshot and its cube cells
+
+    Chunks of chunk_rows rows are parsed and enriched one at a time. Each chunk
+    adds to the running cube cells and is spilled into one Parquet file per
+    month; each month is then sorted by mall and date into its year=/month=
+    directory. Its row groups hold whole malls, at least group_rows rows
+    unless it is the last, so their shopping_mall statistics span few malls.
+    Peak memory is bounded by the chunk size and the largest month, not the
+    whole export. Returns the snapshot metadata.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    data_dir, cells_path, meta_path = snapshot_paths(path)
+    if signature is None:
+        signature = source_signature(path)
+    schema = _snapshot_schema()
+    folder = os.path.dirname(data_dir)
+    os.makedirs(folder, exist_ok=True)
+    spill_dir = tempfile.mkdtemp(prefix='ingest-', dir=folder)
+    for stale_part in glob.glob(glob.escape(data_dir) + '.part*.parquet'):
+        os.remove(stale_part)
+    # Snapshots before the partitioned layout were a single file
+    if os.path.isfile(data_dir + '.parquet'):
+        os.remove(data_dir + '.parquet')
+    try:
+        spills = {}
+        cells = []
+        rows = 0
+        max_date, nat = None, False
+        for chunk in pd.read_csv(path, chunksize=chunk_rows):
+            columns = list(chunk.columns)
+            chunk = enrich(chunk)
+            rows += len(chunk)
+            chunk_max, chunk_nat = _date_extent(chunk)
+            max_date = max(filter(None, [max_date, chunk_max]), default=None)
+            nat = nat or chunk_nat
+            cells.append(aggregate_cells(chunk))
+            if len(cells) >= 8:
+                cells = [merge_cells(cells)]
+            for month, part in chunk.groupby('month_year', sort=False, observed=True, dropna=False):
+                # Rows without a date (no month) get their own bucket
+                month = None if pd.isna(part['invoice_date'].iloc[0]) else month
+                if month not in spills:
+                    spills[month] = pq.ParquetWriter(os.path.join(spill_dir, f'{month or "undated"}.parquet'), schema)
+                spills[month].write_table(pa.Table.from_pandas(part, schema=schema, preserve_index=False))
+        for writer in spills.values():
+            writer.close()
+
+        tmp_dir = os.path.join(spill_dir, 'partitions')
+        for month in spills:
+            table = pq.read_table(os.path.join(spill_dir, f'{month or "undated"}.parquet'))
+            table = table.sort_by([('shopping_mall', 'ascending'), ('invoice_date', 'ascending')])
+            table = table.drop_columns(PARTITION_COLUMNS)
+            year, month_number = (None, None) if month is None else (int(month[:4]), int(month[5:]))
+            file_path = partition_path(tmp_dir, year, month_number)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with pq.ParquetWriter(file_path, table.schema) as writer:
+                # Each write starts a row group; malls come in order, so counts follow them
+                start = end = 0
+                for count in pc.value_counts(table['shopping_mall']).field('counts').to_pylist():
+                    end += count
+                    if end - start >= group_rows:
+                        writer.write_table(table.slice(start, end - start), row_group_size=chunk_rows)
+                        start = end
+                if end > start:
+                    writer.write_table(table.slice(start, end - start), row_group_size=chunk_rows)
+        _replace_dir(tmp_dir, data_dir)
+
+        merged = merge_cells(cells) if cells else aggregate_cells(enrich(pd.read_csv(path, nrows=0)))
+        merged.to_parquet(cells_path + '.tmp', index=False)
+        os.replace(cells_path + '.tmp', cells_path)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    if not rows:
+        columns = list(pd.read_csv(path, nrows=0).columns)
+    meta = dict(signature, version=SNAPSHOT_VERSION, sha256=file_hash(path), rows=rows, columns=columns,
+                tail_sha256=tail_fingerprint(path, signature['size']), max_date=max_date, nat=nat, parts=0)
+    _write_meta(meta_path, meta)
+    return meta
+
+
+def append_snapshot(path, meta, rows, cells, new_meta):
+    """Store appended rows and their cube cells as a new snapshot part
+
+    Only applies when the snapshot on disk is still the one meta describes
+    (another process may have caught up or re-ingested already); returns
+    whether the part was written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    current = snapshot_meta(path)
+    if current is None or (current['size'], current['rows']) != (meta['size'], meta['rows']):
+        return False
+    if current['parts'] >= MAX_PARTS:
+        return False
+    part = current['parts'] + 1
+    data_path, cells_path = part_paths(path, part)
+    pq.write_table(pa.Table.from_pandas(rows, schema=_snapshot_schema(), preserve_index=False), data_path)
+    cells.to_parquet(cells_path, index=False)
+    _, _, meta_path = snapshot_paths(path)
+    _write_meta(meta_path, dict(new_meta, parts=part))
+    return True
+
+
+def _append_to_snapshot(path, signature):
+    """Bring the snapshot up to date by ingesting only appended lines; returns whether it could"""
+    meta = snapshot_meta(path)
+    if meta is None or meta['parts'] >= MAX_PARTS or not appended_since(path, meta, signature):
+        return False
+    rows, end = read_csv_tail(path, meta)
+    if rows is None or not appends_in_order(meta, rows):
+        return False
+    return append_snapshot(path, meta, rows, aggregate_cells(rows), advance_meta(path, meta, rows, end, signature))
+
+
+def _replace_dir(new_dir, target_dir):
+    """Move new_dir to target_dir, replacing the directory there"""
+    old_dir = target_dir + '.old'
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.isdir(target_dir):
+        os.replace(target_dir, old_dir)
+    os.replace(new_dir, target_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def snapshot_filter(date_range=None, categories=None, malls=None, genders=None):
+    """Arrow filter for the sidebar filters, or None when nothing is filtered
+
+    The year and month terms match partition keys, so Arrow skips the months
+    they exclude without opening them, and the mall term skips the row groups
+    of other malls; the rest is applied to rows.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    terms = []
+    if date_range is not None:
+        start, end = (pd.Timestamp(value).normalize() for value in date_range)
+        months = ds.field('year').cast(pa.int32()) * 100 + ds.field('month').cast(pa.int32())
+        terms += [months >= start.year * 100 + start.month, months <= end.year * 100 + end.month,
+                  ds.field('invoice_date') >= pa.scalar(start.to_datetime64(), pa.timestamp('us')),
+                  ds.field('invoice_date') < pa.scalar((end + pd.Timedelta(days=1)).to_datetime64(), pa.timestamp('us'))]
+    for col, selected in zip(['shopping_mall', 'category', 'gender'], [malls, categories, genders]):
+        if selected is not None:
+            terms.append(ds.field(col).isin(list(selected)))
+    if not terms:
+        return None
+    combined = terms[0]
+    for term in terms[1:]:
+        combined = combined & term
+    return combined
+
+
+def _date_order(table):
+    """Stable date order of a table read month by month, each month sorted by mall
+
+    Invoice dates are whole days, so when the snapshot spans fewer than 2 ** 15
+    days the order is a stable argsort of 16-bit day offsets, which numpy does
+    as a radix sort in linear time. Undated rows go last.
+    """
+    import pyarrow.compute as pc
+
+    dates = table['invoice_date'].to_numpy(zero_copy_only=False)
+    missing = np.isnat(dates)
+    days = dates.astype('datetime64[D]').astype(np.int64)
+    present = days[~missing]
+    if not len(present):
+        return np.arange(len(days))
+    if present.max() - present.min() >= np.iinfo(np.int16).max:
+        return pc.sort_indices(table, [('invoice_date', 'ascending'), ('shopping_mall', 'ascending')])
+    offsets = (days - present.min()).astype(np.int16)
+    offsets[missing] = np.iinfo(np.int16).max
+    return np.argsort(offsets, kind='stable')
+
+
+def read_snapshot(path=DATA_FILE, date_range=None, categories=None, malls=None, genders=None):
+    """Read the snapshot back in date order, only the rows matching the filters when any are given
+
+    Dimension columns come straight from Parquet dictionaries. Months and
+    malls the filters exclude are never read, so a narrow filter costs I/O
+    and memory in proportion to its slice.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    data_dir, _, meta_path = snapshot_paths(path)
+    parts = (_read_meta(meta_path) or {}).get('parts', 0)
+    schema = _snapshot_schema()
+    row_filter = snapshot_filter(date_range, categories, malls, genders)
+    partitioning = ds.partitioning(pa.schema([schema.field(col) for col in PARTITION_COLUMNS]), flavor='hive')
+    file_format = ds.ParquetFileFormat(read_options={'dictionary_columns': CATEGORICAL_COLUMNS})
+    dataset = ds.dataset(partition_files(data_dir), schema=schema, format=file_format,
+                         partitioning=partitioning, partition_base_dir=data_dir)
+    # Months come back chronologically, each sorted by mall; a stable date order restores sort_by_date's
+    table = dataset.to_table(filter=row_filter)
+    table = table.take(_date_order(table))
+    tables = [table] + [pq.read_table(part_paths(path, part)[0], read_dictionary=CATEGORICAL_COLUMNS, filters=row_filter)
+                        for part in range(1, parts + 1)]
+    return compact(pa.concat_tables(tables).to_pandas())
+
+
+def load_cells(path=DATA_FILE):
+    """Cube cells aggregated during ingestion, or None when the snapshot is not current"""
+    _, cells_path, _ = snapshot_paths(path)
+    if not _snapshot_is_current(path, source_signature(path)):
+        return None
+    parts = snapshot_meta(path)['parts']
+    try:
+        # Cells of different parts may share a key; the cube sums them anyway
+        return pd.concat([pd.read_parquet(cells_path)] +
+                         [pd.read_parquet(part_paths(path, part)[1]) for part in range(1, parts + 1)],
+                         ignore_index=True)
+    except (ImportError, OSError, ValueError):
+        return None
+
+
+def filter_rows(df, date_range=None, categories=None, malls=None, genders=None):
+    """Rows of an in-memory frame matching the filters, like snapshot_filter() on disk"""
+    mask = np.ones(len(df), dtype=bool)
+    if date_range is not None:
+        start, end = (pd.Timestamp(value).normalize() for value in date_range)
+        mask &= ((df['invoice_date'] >= start) & (df['invoice_date'] < end + pd.Timedelta(days=1))).to_numpy()
+    for col, selected in zip(['shopping_mall', 'category', 'gender'], [malls, categories, genders]):
+        if selected is not None:
+            mask &= df[col].isin(list(selected)).to_numpy()
+    return df[mask].reset_index(drop=True) if not mask.all() else df
+
+
+def load_sales_data(path=DATA_FILE, date_range=None, categories=None, malls=None, genders=None):
+    """Load the enriched sales frame, ingesting the CSV first when the snapshot is stale
+
+    With filters (as in FilterIndex.select), only the matching rows are loaded,
+    reading just the snapshot months and mall row groups they fall in.
+    """
+    signature = source_signature(path)
+    try:
+        if not _snapshot_is_current(path, signature) and not _append_to_snapshot(path, signature):
+            ingest_csv(path, signature=signature)
+        return read_snapshot(path, date_range, categories, malls, genders)
+    except (ImportError, OSError, ValueError):
+        # No Parquet engine, a read-only checkout or a damaged snapshot: parse the CSV in memory
+        return filter_rows(parse_sales_csv(path), date_range, categories, malls, genders)
@@ -0,0 +1,78 @@
+"""
+Filtered-data export
+Export files are built only when a download is requested, written in
+bounded row chunks straight into the output buffer (no full-size CSV string
+in between), and cached per filter state so repeated downloads of the same
+selection are served from memory.
+"""
+import gzip
+import io
+import os
+
+from result_cache import LRUCache
+
+# Rows serialized per write; bounds the temporary text held alongside the output
+EXPORT_CHUNK_ROWS = 100_000
+# Label shown in the dashboards -> (file extension, MIME type)
+EXPORT_FORMATS = {
+    'CSV': ('csv', 'text/csv'),
+    'CSV (gzip)': ('csv.gz', 'application/gzip'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+
+
+def _chunks(df, chunk_rows):
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def write_csv(df, out, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Write df as UTF-8 CSV to the binary stream out, chunk by chunk"""
+    text = io.TextIOWrapper(out, encoding='utf-8', newline='')
+    if not len(df):
+        df.to_csv(text, index=False)
+    for number, chunk in enumerate(_chunks(df, chunk_rows)):
+        chunk.to_csv(text, header=number == 0, index=False)
+    text.flush()
+    text.detach()
+
+
+def write_parquet(df, out, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Write df as Parquet to the binary stream out, one row group per chunk"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(out, schema) as writer:
+        for chunk in _chunks(df, chunk_rows):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+def export_bytes(df, export_format):
+    """Contents of df as a file in one of EXPORT_FORMATS"""
+    out = io.BytesIO()
+    if export_format == 'CSV':
+        write_csv(df, out)
+    elif export_format == 'CSV (gzip)':
+        # mtime=0 keeps the archive identical across runs for the same data
+        with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=6, mtime=0) as compressed:
+            write_csv(df, compressed)
+    elif export_format == 'Parquet':
+        write_parquet(df, out)
+    else:
+        raise ValueError(f"Unknown export format: {export_format}")
+    return out.getvalue()
+
+
+def cached_export(export_key, df, rows, export_format):
+    """export_bytes() of df.iloc[rows] for a (store key, filter state) pair, memoized across sessions
+
+    The selected rows are only gathered on a miss.
+    """
+    store_key, filter_state = export_key
+    return export_cache.get_or_compute((store_key, filter_state, export_format),
+                                       lambda: export_bytes(df.iloc[rows], export_format))
+
+
+# Export files per filter state and format, shared by all sessions
+export_cache = LRUCache('exports', int(os.environ.get('RETAIL_EXPORT_CACHE_MB', 128)) * 2 ** 20)
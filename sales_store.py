@@ -0,0 +1,181 @@
+"""
+Shared, read-only sales dataset
+One SalesStore per process holds the transaction table and everything
+derived from it (dimension dictionary, filter index, cube, customer and
+amount sketches). Every Streamlit session references the same object instead
+of receiving its own deserialized copy, and all of its arrays are read-only so no session can modify them.
+Invoices appended to the CSV extend the store in time proportional to the
+new rows; any other change to the file reloads it.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from amount_sketch import AmountSketch
+from customer_sketch import CustomerSketch
+from filter_index import FilterIndex
+from sales_cube import SalesCube
+from sales_data import (DATA_FILE, advance_meta, aggregate_cells, append_rows, append_snapshot,
+                        appended_since, appends_in_order, dimensions, load_cells, load_sales_data,
+                        read_csv_tail, snapshot_meta, source_signature)
+
+
+def _read_only(array):
+    array.flags.writeable = False
+    return array
+
+
+def freeze_frame(df):
+    """Rebuild df on read-only arrays so sessions sharing it cannot modify it in place"""
+    columns = {}
+    for col in df.columns:
+        values = df[col].array
+        if isinstance(values, pd.Categorical):
+            columns[col] = pd.Categorical.from_codes(_read_only(values.codes.copy()), dtype=values.dtype)
+        elif isinstance(df[col].dtype, np.dtype):
+            columns[col] = _read_only(df[col].to_numpy(copy=True))
+        else:
+            # Arrow-backed strings are immutable already
+            columns[col] = values
+    return pd.DataFrame(columns, index=df.index, copy=False)
+
+
+def _snapshot_source(path, df):
+    """Snapshot metadata describing df, for append detection; None if the snapshot moved on"""
+    meta = snapshot_meta(path)
+    # A snapshot written by another process after df was loaded does not describe it
+    if meta is None or meta['rows'] != len(df):
+        return None
+    return meta
+
+
+def _date_extent(dates, base=None):
+    """Earliest and latest date, NaT when there are none"""
+    dates = dates.dropna()
+    if base is not None:
+        dates = pd.concat([dates, pd.Series(base, dtype=dates.dtype).dropna()])
+    return (dates.min(), dates.max()) if len(dates) else (pd.NaT, pd.NaT)
+
+
+def dataset_stats(rows, base=None, customers=None):
+    """Dataset-wide totals behind the KPI deltas and the date picker
+
+    With base, the stats of the rows loaded before, returns base plus rows;
+    customers, the customer_id categories before the append, then limits the
+    distinct-customer count to IDs not seen yet.
+    """
+    ids = np.asarray(rows['customer_id'].dropna().unique())
+    new_customers = len(ids) if customers is None else int((customers.get_indexer(ids) == -1).sum())
+    stats = {
+        'rows': len(rows),
+        'total_amount': float(rows['total_amount'].sum()),
+        'amount_rows': int(rows['total_amount'].count()),
+        'quantity': int(rows['quantity'].sum()),
+        'quantity_rows': int(rows['quantity'].count()),
+        'customers': new_customers,
+    }
+    if base is not None:
+        stats = {name: base[name] + value for name, value in stats.items()}
+    first, last = _date_extent(rows['invoice_date'], None if base is None else [base['first_date'], base['last_date']])
+    stats.update(first_date=first, last_date=last)
+    # Means over the whole dataset, skipping missing values like Series.mean()
+    stats['average_amount'] = stats['total_amount'] / stats['amount_rows'] if stats['amount_rows'] else float('nan')
+    stats['average_quantity'] = stats['quantity'] / stats['quantity_rows'] if stats['quantity_rows'] else float('nan')
+    return stats
+
+
+class SalesStore:
+    """Immutable dataset plus its derived structures, shared across sessions
+
+    key identifies the current contents and changes whenever the store is
+    extended or reloaded. Read it with df, dims, index, cube, stats, customers
+    and amounts through snapshot() so a concurrent refresh cannot mix two versions.
+    """
+
+    def __init__(self, df, path=DATA_FILE, cells=None, source=None):
+        self.path = path
+        self.version = 0
+        self.refresh_lock = threading.Lock()
+        self.swap_lock = threading.Lock()
+        df = freeze_frame(df)
+        dims = dimensions(df)
+        # Cells aggregated at ingestion spare a pass over every row
+        self._install(df, dims, FilterIndex(df), SalesCube(df if cells is None else cells, dims),
+                      dataset_stats(df), CustomerSketch(df), AmountSketch(df), source)
+
+    @property
+    def key(self):
+        return (self.path, self.version)
+
+    def _install(self, df, dims, index, cube, stats, customers, amounts, source):
+        for bitmaps in index.bitmaps.values():
+            for bitmap in bitmaps.values():
+                _read_only(bitmap)
+        for values in cube.measures.values():
+            _read_only(values)
+        for entries in (customers.entries, amounts.entries, amounts.months):
+            for values in entries.values():
+                _read_only(values)
+        with self.swap_lock:
+            self.df, self.dims, self.index, self.cube = df, dims, index, cube
+            self.stats, self.customers, self.amounts = stats, customers, amounts
+            # The part of the CSV the store holds: its size and mtime, plus the
+            # append bookkeeping of sales_data.ingest_csv when a snapshot backs it
+            self.source = source or dict(source_signature(self.path), tail_sha256=None)
+            self.version += 1
+
+    def snapshot(self):
+        """Consistent (key, df, dims, index, cube, stats, customers, amounts) of one version"""
+        with self.swap_lock:
+            return self.key, self.df, self.dims, self.index, self.cube, self.stats, self.customers, self.amounts
+
+    def refresh(self):
+        """Catch up with the CSV behind the store
+
+        Appended invoices extend the table, index and cube; a rewritten file, or
+        appends dated before rows already loaded, reload everything. Returns
+        (previous key, appended rows) after an append, else None.
+        """
+        with self.refresh_lock:
+            signature = source_signature(self.path)
+            source = self.source
+            if (signature['size'], signature['mtime_ns']) == (source['size'], source['mtime_ns']):
+                return None
+            if appended_since(self.path, source, signature):
+                rows, end = read_csv_tail(self.path, source)
+                if rows is None:
+                    # Only a partial line so far
+                    return None
+                if appends_in_order(source, rows):
+                    return self._extend(rows, advance_meta(self.path, source, rows, end, signature))
+            self._reload()
+            return None
+
+    def _extend(self, rows, source):
+        previous_key = self.key
+        cells = aggregate_cells(rows)
+        try:
+            append_snapshot(self.path, self.source, rows, cells, source)
+        except (ImportError, OSError):
+            # The in-memory store still catches up; the next cold start re-ingests
+            pass
+        df = freeze_frame(append_rows(self.df, rows.copy()))
+        dims = dimensions(df)
+        stats = dataset_stats(rows, base=self.stats, customers=self.df['customer_id'].cat.categories)
+        self._install(df, dims, FilterIndex(df, base=self.index), SalesCube(cells, dims, base=self.cube), stats,
+                      CustomerSketch(rows, base=self.customers), AmountSketch(rows, base=self.amounts), source)
+        return previous_key, rows
+
+    def _reload(self):
+        df = freeze_frame(load_sales_data(self.path))
+        dims = dimensions(df)
+        cells = load_cells(self.path)
+        self._install(df, dims, FilterIndex(df), SalesCube(df if cells is None else cells, dims),
+                      dataset_stats(df), CustomerSketch(df), AmountSketch(df), _snapshot_source(self.path, df))
+
+    @classmethod
+    def load(cls, path=DATA_FILE):
+        """Build the store from the snapshot (or CSV) behind path"""
+        df = load_sales_data(path)
+        return cls(df, path, load_cells(path), _snapshot_source(path, df))
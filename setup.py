@@ -5,8 +5,18 @@ This script helps download the dataset and prepare the environment
 import kagglehub
 import pandas as pd
 import os
+import shutil
 import sys
 
+from sales_data import CHUNK_ROWS, DATA_FILE, ingest_csv
+
+
+def describe_csv(path):
+    """Row count and column names, read in chunks so the file never has to fit in memory"""
+    columns = list(pd.read_csv(path, nrows=0).columns)
+    records = sum(len(chunk) for chunk in pd.read_csv(path, usecols=[0], chunksize=CHUNK_ROWS))
+    return records, columns
+
 def main():
     print("=" * 60)
     print("  Retail Sales Dashboard - Setup")
@@ -16,9 +26,9 @@ def main():
     # Check if data already exists
     if os.path.exists('customer_shopping_data.csv'):
         print("✓ Dataset already exists locally: customer_shopping_data.csv")
-        df = pd.read_csv('customer_shopping_data.csv')
-        print(f"  Records: {len(df):,}")
-        print(f"  Columns: {len(df.columns)}")
+        records, columns = describe_csv(DATA_FILE)
+        print(f"  Records: {records:,}")
+        print(f"  Columns: {len(columns)}")
         print()
         response = input("Do you want to re-download the dataset? (y/n): ")
         if response.lower() != 'y':
@@ -39,19 +49,21 @@ def main():
             print("✗ Error: No CSV file found in downloaded dataset")
             sys.exit(1)
         
-        # Load and save locally
+        # Copy locally and build the columnar snapshot in bounded chunks
         csv_path = os.path.join(path, csv_files[0])
-        df = pd.read_csv(csv_path)
-        df.to_csv('customer_shopping_data.csv', index=False)
+        shutil.copyfile(csv_path, DATA_FILE)
+        records, columns = describe_csv(DATA_FILE)
+        print("Building columnar snapshot...")
+        ingest_csv(DATA_FILE)
         
         print(f"\n✓ Dataset prepared successfully!")
         print(f"  File: customer_shopping_data.csv")
-        print(f"  Records: {len(df):,}")
-        print(f"  Columns: {len(df.columns)}")
+        print(f"  Records: {records:,}")
+        print(f"  Columns: {len(columns)}")
         
         # Show column info
         print(f"\nColumns:")
-        for col in df.columns:
+        for col in columns:
             print(f"  - {col}")
         
         print("\n" + "=" * 60)
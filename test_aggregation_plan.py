@@ -0,0 +1,36 @@
+import numpy as np
+
+from aggregation_plan import AggregationPlan
+from conftest import make_rows, write_rows
+from filter_index import FilterIndex
+from sales_cube import SalesCube
+from sales_data import parse_sales_csv
+
+
+def plan_results(df, **filters):
+    index, cube = FilterIndex(df), SalesCube(df)
+    plan = AggregationPlan().totals().unique_customers().histogram('age', bins=30)
+    return plan.execute(cube.slice(**filters), df, index.select(**filters))
+
+
+def test_row_measures_match_pandas(sales_csv):
+    df = parse_sales_csv(sales_csv)
+    results = plan_results(df, malls=['Kanyon'])
+    kanyon = df[df['shopping_mall'] == 'Kanyon']
+    assert results['unique_customers'] == kanyon['customer_id'].nunique()
+    assert results['age']['transactions'].sum() == len(kanyon)
+    assert results['age']['age'].iloc[0] == kanyon['age'].min()
+
+
+def test_missing_ages_are_left_out_of_the_histogram(tmp_path):
+    # One missing age makes the column float, which np.bincount cannot count
+    path = tmp_path / 'sales.csv'
+    rows = make_rows(500)
+    rows['age'] = rows['age'].astype(float)
+    rows.loc[[3, 250], 'age'] = np.nan
+    write_rows(path, rows)
+    df = parse_sales_csv(path)
+    assert df['age'].dtype.kind == 'f'
+    results = plan_results(df)
+    assert results['age']['transactions'].sum() == 498
+    assert results['unique_customers'] == df['customer_id'].nunique()
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from amount_sketch import PERCENTILES, RELATIVE_ACCURACY, AmountSketch
+from conftest import make_rows
+from sales_data import compact, enrich, sort_by_date
+
+
+@pytest.fixture(scope='module')
+def records():
+    rows = make_rows(6000, start='2021-01-01', end='2022-06-30', seed=5)
+    # Fixed prices per category, as in the real export, so few distinct amounts per cell
+    rows['price'] = rows['category'].map({'Books': 15.15, 'Clothing': 300.08, 'Shoes': 600.17, 'Toys': 35.84})
+    return compact(sort_by_date(enrich(rows)))
+
+
+def exact(records, q, date_range=None, malls=None):
+    rows = records
+    if date_range is not None:
+        start, end = (pd.Timestamp(value) for value in date_range)
+        rows = rows[rows['invoice_date'].between(start, end)]
+    if malls is not None:
+        rows = rows[rows['shopping_mall'].isin(malls)]
+    amounts = np.sort(rows['total_amount'].to_numpy())
+    return amounts[int(q * (len(amounts) - 1))]
+
+
+@pytest.mark.parametrize('date_range', [
+    None,
+    ('2021-01-01', '2022-06-30'),   # whole months only
+    ('2021-02-14', '2021-11-03'),   # partial months at both ends
+    ('2021-03-31', '2021-05-01'),   # one whole month between one-day edges
+    ('2021-07-05', '2021-07-20'),   # inside one month
+    ('2021-07-20', '2021-08-10'),   # two partial months, no whole one
+])
+def test_quantiles_are_within_the_relative_accuracy(records, date_range):
+    sketch = AmountSketch(records)
+    for malls in (None, ['Kanyon', 'Metropol AVM']):
+        found = sketch.quantiles(PERCENTILES, date_range=date_range, malls=malls)
+        for q in PERCENTILES:
+            assert found[q] == pytest.approx(exact(records, q, date_range, malls), rel=RELATIVE_ACCURACY)
+
+
+def test_month_cells_scale_with_cells_not_rows(records):
+    sketch = AmountSketch(records)
+    assert sketch.entries['count'].sum() == sketch.months['count'].sum() == len(records)
+    assert len(sketch.months['count']) < len(sketch.entries['count'])
+    # Three times the rows in the same cells: three times the counts, no new entries
+    tripled = AmountSketch(sort_by_date(pd.concat([records] * 3, ignore_index=True)))
+    assert len(tripled.months['count']) == len(sketch.months['count'])
+    assert np.array_equal(tripled.months['count'], 3 * sketch.months['count'])
+
+
+def test_appended_rows_only_add_counts(records):
+    split = int(np.searchsorted(records['invoice_date'], pd.Timestamp('2022-03-15')))
+    base = AmountSketch(records.iloc[:split])
+    extended = AmountSketch(records.iloc[split:], base=base)
+    whole = AmountSketch(records)
+    for level in ('entries', 'months'):
+        for name, values in getattr(whole, level).items():
+            assert np.array_equal(getattr(extended, level)[name], values), (level, name)
+
+
+def test_empty_selection_is_nan(records):
+    found = AmountSketch(records).quantiles(PERCENTILES, date_range=('2030-01-01', '2030-12-31'))
+    assert all(np.isnan(value) for value in found.values())
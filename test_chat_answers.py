@@ -0,0 +1,102 @@
+import pytest
+
+import chat_answers
+from chat_answers import AnswerCache, answer_key
+from chat_client import GPTBusyError
+
+KEY = answer_key((('sales.csv', 1), None), 'tools', {'model': 'test'}, 'Best mall?')
+
+
+class Call:
+    """An answer stream that records whether it was read to the end or closed"""
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.closed = False
+
+    def __iter__(self):
+        try:
+            yield from self.parts
+        finally:
+            self.closed = True
+
+
+def make_cache():
+    return AnswerCache('test answers', 10_000, ttl=60)
+
+
+def test_identical_questions_share_one_call():
+    cache, calls = make_cache(), []
+    answer = lambda: calls.append(1) or Call(['Kanyon', ' leads.'])
+    leader = cache.stream(KEY, answer)
+    assert next(leader) == 'Kanyon'
+    follower = cache.stream(KEY, answer)
+    assert next(follower) == 'Kanyon'
+    assert list(leader) == [' leads.']
+    assert list(follower) == [' leads.']
+    assert list(cache.stream(KEY, answer)) == ['Kanyon leads.']
+    assert len(calls) == 1 and cache.savings()['shared'] == 1
+
+
+def test_follower_takes_over_when_the_leader_stops():
+    cache, call = make_cache(), Call(['a', 'b', 'c'])
+    leader = cache.stream(KEY, lambda: call)
+    next(leader)
+    follower = cache.stream(KEY, lambda: pytest.fail('the call is shared'))
+    assert next(follower) == 'a'
+    leader.close()
+    assert not call.closed
+    assert list(follower) == ['b', 'c']
+    assert cache.get(KEY)[0] == 'abc' and KEY not in cache.flights
+
+
+def test_handed_over_call_is_closed_when_its_follower_stops_first():
+    cache, call = make_cache(), Call(['a', 'b', 'c'])
+    leader = cache.stream(KEY, lambda: call)
+    next(leader)
+    follower = cache.stream(KEY, lambda: pytest.fail('the call is shared'))
+    next(follower)
+    leader.close()
+    follower.close()
+    assert call.closed
+    assert KEY not in cache.flights
+    # The next identical question makes the call again
+    assert list(cache.stream(KEY, lambda: Call(['x']))) == ['x']
+
+
+def test_abandoned_call_is_closed_and_made_again():
+    cache, call = make_cache(), Call(['a', 'b'])
+    leader = cache.stream(KEY, lambda: call)
+    next(leader)
+    leader.close()
+    assert call.closed and KEY not in cache.flights
+    assert cache.get(KEY) is None
+
+
+def test_followers_give_up_at_the_deadline(monkeypatch):
+    monkeypatch.setattr(chat_answers, 'DEADLINE_S', 0.05)
+    cache = make_cache()
+    leader = cache.stream(KEY, lambda: Call(['a', 'b']))
+    next(leader)
+    follower = cache.stream(KEY, lambda: pytest.fail('the call is shared'))
+    assert next(follower) == 'a'
+    with pytest.raises(GPTBusyError):
+        next(follower)
+    assert cache.flights[KEY].followers == 0
+
+
+def test_errors_reach_followers():
+    def failing():
+        yield 'a'
+        raise ValueError('boom')
+
+    cache = make_cache()
+    leader = cache.stream(KEY, failing)
+    next(leader)
+    follower = cache.stream(KEY, lambda: pytest.fail('the call is shared'))
+    next(follower)
+    with pytest.raises(ValueError):
+        next(leader)
+    with pytest.raises(RuntimeError, match='boom'):
+        next(follower)
+    assert KEY not in cache.flights
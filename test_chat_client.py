@@ -0,0 +1,108 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import chat_client
+from chat_client import GPTBusyError, GPTClient, TokenBucket
+from chat_stream import TimedStream
+from chat_tools import stream_with_tools
+
+
+def chunk(content=None, tool_calls=None):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content, tool_calls=tool_calls))])
+
+
+def tool_call(name):
+    return SimpleNamespace(index=0, id=f'call-{name}', function=SimpleNamespace(name=name, arguments='{}'))
+
+
+class Completions:
+    """chat.completions of an OpenAI client, answering each request with the next chunk list"""
+
+    def __init__(self, responses, clock=None, seconds=10):
+        self.responses = list(responses)
+        self.requests = []
+        self.clock = clock
+        self.seconds = seconds
+
+    def create(self, **request):
+        self.requests.append(request)
+        chunks = self.responses.pop(0)
+        clock, seconds = self.clock, self.seconds
+
+        class Stream:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def __iter__(self):
+                for item in chunks:
+                    # Time the chunk takes to arrive
+                    if clock is not None:
+                        clock[0] += seconds
+                    yield item
+
+        return Stream()
+
+
+def make_client(completions):
+    openai = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return GPTClient(openai, threading.BoundedSemaphore(2), TokenBucket(10_000), TokenBucket(10_000_000))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(chat_client.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_a_slow_answer_stops_at_the_deadline(clock, monkeypatch):
+    monkeypatch.setattr(chat_client, 'DEADLINE_S', 25)
+    client = make_client(Completions([[chunk(str(i)) for i in range(10)]], clock))
+    parts = []
+    with pytest.raises(GPTBusyError):
+        for item in client.stream_chat([{'role': 'user', 'content': 'hi'}]):
+            parts.append(item.choices[0].delta.content)
+    assert parts == ['0', '1', '2']
+    # The concurrency slot is given back
+    assert client.slots.acquire(blocking=False) and client.slots.acquire(blocking=False)
+
+
+def test_tool_rounds_share_the_question_deadline(clock, monkeypatch):
+    monkeypatch.setattr(chat_client, 'DEADLINE_S', 45)
+    rounds = [[chunk(tool_calls=[tool_call('sales_totals')])] for _ in range(3)] + [[chunk('done')]]
+    # Each round takes 20 seconds, well within a deadline per request
+    completions = Completions(rounds, clock, seconds=20)
+    queries = SimpleNamespace(tools=[], call=lambda name, arguments: '{}')
+    with pytest.raises(GPTBusyError):
+        list(stream_with_tools(make_client(completions), queries, [{'role': 'user', 'content': 'hi'}]))
+    assert len(completions.requests) == 3
+
+
+def test_timed_stream_ends_past_its_deadline(clock):
+    closed = []
+
+    def pieces():
+        try:
+            for word in ['a', 'b', 'c']:
+                clock[0] += 10
+                yield word
+        finally:
+            closed.append(True)
+
+    stream = TimedStream(pieces(), deadline=clock[0] + 15)
+    text = list(stream)
+    assert text[:2] == ['a', 'b'] and 'in time' in text[2] and len(text) == 3
+    assert closed and stream.total is not None
+
+
+def test_timed_stream_adds_no_second_notice(clock):
+    def pieces():
+        clock[0] += 10
+        yield '⏳ The AI assistant is busy with other questions; please try again shortly.'
+
+    assert len(list(TimedStream(pieces(), deadline=clock[0] + 5))) == 1
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from conftest import make_rows
+from customer_sketch import PRECISION, CustomerSketch
+from sales_data import compact, enrich, sort_by_date
+
+# Four standard errors: a false failure is very unlikely
+TOLERANCE = 4 * 1.04 / np.sqrt(2 ** PRECISION)
+
+
+@pytest.fixture(scope='module')
+def records():
+    rows = make_rows(20000, seed=5)
+    return compact(sort_by_date(enrich(rows)))
+
+
+def exact(records, start=None, end=None, malls=None):
+    mask = np.ones(len(records), dtype=bool)
+    if start is not None:
+        mask &= (records['invoice_date'] >= start) & (records['invoice_date'] < end)
+    if malls is not None:
+        mask &= records['shopping_mall'].isin(malls)
+    return records.loc[mask, 'customer_id'].nunique()
+
+
+@pytest.mark.parametrize('date_range', [None, ('2021-01-01', '2021-12-31'), ('2022-03-10', '2022-03-20')])
+@pytest.mark.parametrize('malls', [None, ['Kanyon']])
+def test_counts_are_within_the_error_bound(records, date_range, malls):
+    sketch = CustomerSketch(records)
+    bounds = (None, None) if date_range is None else (date_range[0], np.datetime64(date_range[1]) + 1)
+    expected = exact(records, *bounds, malls=malls)
+    assert abs(sketch.count(date_range, malls=malls) - expected) <= TOLERANCE * expected + 2
+
+
+def test_entries_never_exceed_rows(records):
+    assert len(CustomerSketch(records).entries['date']) <= len(records)
+
+
+def test_appending_equals_sketching_everything(records):
+    split = len(records) * 3 // 4
+    whole = CustomerSketch(records)
+    appended = CustomerSketch(records.iloc[split:], base=CustomerSketch(records.iloc[:split]))
+    for name, values in whole.entries.items():
+        assert np.array_equal(values, appended.entries[name]), name
+    assert appended.count(malls=['Kanyon']) == whole.count(malls=['Kanyon'])
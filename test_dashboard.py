@@ -0,0 +1,46 @@
+import os
+
+import pandas as pd
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+from conftest import make_rows, write_rows
+
+DASHBOARD = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dashboard.py')
+
+
+@pytest.fixture
+def dashboard(tmp_path, monkeypatch):
+    """The dashboard running on a synthetic export"""
+    write_rows(tmp_path / 'customer_shopping_data.csv', make_rows(2000))
+    monkeypatch.chdir(tmp_path)
+    # The store is cached per process by its relative path
+    st.cache_resource.clear()
+    app = AppTest.from_file(DASHBOARD, default_timeout=60)
+    app.run()
+    assert not app.exception
+    return app
+
+
+@pytest.fixture
+def iloc_calls(monkeypatch):
+    """Lengths of the frames indexed with .iloc, recorded while the fixture is active"""
+    calls = []
+    iloc = pd.DataFrame.iloc
+    monkeypatch.setattr(pd.DataFrame, 'iloc', property(lambda df: calls.append(len(df)) or iloc.fget(df)))
+    return calls
+
+
+def test_chatbot_gathers_rows_only_for_a_question(dashboard, iloc_calls):
+    dashboard.run()
+    hidden = len(iloc_calls)
+    iloc_calls.clear()
+    dashboard.checkbox[0].check().run()
+    assert not dashboard.exception
+    assert len(iloc_calls) == hidden
+    iloc_calls.clear()
+    dashboard.chat_input[0].set_value('What is my total revenue?').run()
+    assert not dashboard.exception
+    assert iloc_calls
+    assert 'Total Revenue' in dashboard.chat_message[-1].markdown[0].value
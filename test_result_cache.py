@@ -0,0 +1,64 @@
+import pandas as pd
+
+import result_cache
+from result_cache import LRUCache, TTLCache, carry_over, filter_key
+
+DIMS = {'category': ['Books', 'Toys'], 'shopping_mall': ['Kanyon', 'Metropol AVM'], 'gender': ['Female', 'Male']}
+
+
+def test_lru_evicts_least_recently_used_over_budget():
+    cache = LRUCache('test lru', 100)
+    cache.put('a', 'A', nbytes=40)
+    cache.put('b', 'B', nbytes=40)
+    assert cache.get('a') == 'A'
+    cache.put('c', 'C', nbytes=40)
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A' and cache.get('c') == 'C'
+    stats = cache.stats()
+    assert (stats['entries'], stats['evictions'], stats['hits'], stats['misses']) == (2, 1, 3, 1)
+
+
+def test_lru_serves_but_never_stores_values_over_budget():
+    cache = LRUCache('test oversized', 100)
+    assert cache.put('big', 'X', nbytes=101) == 'X'
+    assert cache.get('big') is None
+    assert cache.bytes == 0
+
+
+def test_ttl_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, 'monotonic', lambda: now[0])
+    cache = TTLCache('test ttl', 1000, ttl=60)
+    cache.put('a', 'A', nbytes=10)
+    now[0] += 59
+    assert cache.get('a') == 'A'
+    now[0] += 2
+    assert cache.get('a') is None
+    assert cache.bytes == 0 and cache.stats()['evictions'] == 1
+
+
+def test_filter_key_is_canonical():
+    everything = filter_key(DIMS, None, ['Toys', 'Books'], DIMS['shopping_mall'], ['Male', 'Female'])
+    assert everything == (None, None, None, None)
+    assert filter_key(DIMS, None, ['Toys'], ['Metropol AVM', 'Kanyon'], ['Male']) == \
+        filter_key(DIMS, None, ['Toys'], ['Kanyon', 'Metropol AVM'], ['Male'])
+    dated = filter_key(DIMS, (pd.Timestamp('2022-01-01 10:00'), '2022-01-31'))
+    assert dated[0] == ('2022-01-01', '2022-01-31')
+
+
+def test_carry_over_keeps_only_entries_the_appended_rows_miss():
+    cache = LRUCache('test carry over', 10_000)
+    january = filter_key(DIMS, ('2022-01-01', '2022-01-31'))
+    february = filter_key(DIMS, ('2022-02-01', '2022-02-28'))
+    kanyon = filter_key(DIMS, malls=['Kanyon'])
+    for state in (january, february, kanyon):
+        cache.put((('sales.csv', 1), state, 'extra'), state, nbytes=10)
+    cache.put((('other.csv', 1), january), 'other store', nbytes=10)
+    rows = pd.DataFrame({'invoice_date': pd.to_datetime(['2022-02-10']), 'category': ['Toys'],
+                         'shopping_mall': ['Metropol AVM'], 'gender': ['Male']})
+    carry_over(('sales.csv', 1), ('sales.csv', 2), rows, caches=[cache])
+    assert cache.get((('sales.csv', 2), january, 'extra')) == january
+    assert cache.get((('sales.csv', 2), kanyon, 'extra')) == kanyon
+    assert cache.get((('sales.csv', 2), february, 'extra')) is None
+    assert cache.get((('other.csv', 1), january)) == 'other store'
+    assert cache.bytes == 30
@@ -0,0 +1,112 @@
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+import sales_data
+from conftest import make_rows, write_rows
+from sales_data import (filter_rows, load_cells, load_sales_data, parse_sales_csv, partition_files, snapshot_meta,
+                        snapshot_paths)
+
+
+def test_snapshot_reads_back_the_parsed_csv(sales_csv):
+    expected = parse_sales_csv(sales_csv)
+    pd.testing.assert_frame_equal(load_sales_data(sales_csv), expected)
+    assert snapshot_meta(sales_csv)['rows'] == len(expected)
+    # The second load comes from the snapshot, not the CSV
+    parsed = []
+    original = sales_data.parse_sales_csv
+    sales_data.parse_sales_csv = lambda path: parsed.append(path) or original(path)
+    try:
+        pd.testing.assert_frame_equal(load_sales_data(sales_csv), expected)
+    finally:
+        sales_data.parse_sales_csv = original
+    assert parsed == []
+
+
+def test_snapshot_is_sorted_by_date(sales_csv):
+    df = load_sales_data(sales_csv)
+    assert df['invoice_date'].is_monotonic_increasing
+
+
+def test_cells_match_the_rows(sales_csv):
+    df = load_sales_data(sales_csv)
+    cells = load_cells(sales_csv)
+    assert cells['transactions'].sum() == len(df)
+    assert abs(cells['total_amount'].sum() - df['total_amount'].sum()) < 1e-6
+
+
+def test_small_chunks_ingest_the_same_rows(sales_csv):
+    expected = parse_sales_csv(sales_csv)
+    sales_data.ingest_csv(sales_csv, chunk_rows=97)
+    pd.testing.assert_frame_equal(sales_data.read_snapshot(sales_csv), expected)
+
+
+def test_rows_without_a_date_are_kept_last(tmp_path):
+    path = str(tmp_path / 'sales.csv')
+    rows = make_rows(300)
+    rows.loc[[5, 150], 'invoice_date'] = ['31/2/2022', '']
+    write_rows(path, rows)
+    df = load_sales_data(path)
+    assert len(df) == 300
+    assert df['invoice_date'].iloc[-2:].isna().all()
+    assert df['invoice_date'].iloc[:-2].notna().all()
+
+
+def test_undated_rows_are_ingested_into_the_snapshot(tmp_path):
+    path = str(tmp_path / 'sales.csv')
+    rows = make_rows(300)
+    rows.loc[[5, 150], 'invoice_date'] = ['31/2/2022', '']
+    write_rows(path, rows)
+    meta = sales_data.ingest_csv(path)
+    assert meta['nat'] and meta['rows'] == 300
+    df = sales_data.read_snapshot(path)
+    # A missing date has no month, on every pandas version
+    assert df['month_year'].iloc[-2:].isna().all()
+    assert 'NaT' not in df['month_year'].cat.categories
+
+
+@pytest.mark.parametrize('filters', [
+    {'date_range': ('2021-03-01', '2021-03-31'), 'malls': ['Kanyon']},
+    {'date_range': ('2021-12-15', '2022-02-10')},
+    {'malls': ['Cevahir AVM', 'Metropol AVM'], 'genders': ['Male']},
+    {'categories': ['Toys'], 'date_range': ('2022-06-01', '2022-06-07')},
+])
+def test_filtered_loads_match_the_filtered_table(sales_csv, filters):
+    expected = filter_rows(parse_sales_csv(sales_csv), **filters)
+    df = load_sales_data(sales_csv, **filters)
+    assert len(df) == len(expected) > 0
+    for col in df.columns:
+        assert df[col].astype(object).equals(expected[col].astype(object)), col
+
+
+def test_row_groups_hold_whole_malls(sales_csv):
+    sales_data.ingest_csv(sales_csv, group_rows=1)
+    files = partition_files(snapshot_paths(sales_csv)[0])
+    for file_path in files:
+        metadata = pq.ParquetFile(file_path).metadata
+        column = metadata.schema.to_arrow_schema().get_field_index('shopping_mall')
+        stats = [metadata.row_group(group).column(column).statistics for group in range(metadata.num_row_groups)]
+        assert all(stat.min == stat.max for stat in stats)
+    df = sales_data.read_snapshot(sales_csv, malls=['Kanyon'])
+    assert set(df['shopping_mall']) == {'Kanyon'}
+    pd.testing.assert_frame_equal(sales_data.read_snapshot(sales_csv), parse_sales_csv(sales_csv))
+
+
+def test_appended_lines_become_snapshot_parts(sales_csv):
+    load_sales_data(sales_csv)
+    write_rows(sales_csv, make_rows(50, start='2023-01-01', end='2023-01-31', seed=1, first_invoice=5000), append=True)
+    df = load_sales_data(sales_csv)
+    assert snapshot_meta(sales_csv)['parts'] == 1
+    assert len(df) == 2050
+    pd.testing.assert_frame_equal(df, parse_sales_csv(sales_csv))
+
+
+def test_rewritten_csv_is_reingested(sales_csv):
+    load_sales_data(sales_csv)
+    write_rows(sales_csv, make_rows(500, seed=2))
+    os.utime(sales_csv, ns=(0, 10**18))
+    df = load_sales_data(sales_csv)
+    assert len(df) == 500
+    assert snapshot_meta(sales_csv)['parts'] == 0
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+from conftest import make_rows, write_rows
+from result_cache import LRUCache, carry_over, filter_key
+from sales_store import SalesStore
+
+
+def assert_same_contents(store, fresh):
+    """Store contents equal to those of a store loaded from scratch"""
+    _, df, dims, index, cube, stats, _, _ = store.snapshot()
+    _, fresh_df, fresh_dims, fresh_index, fresh_cube, fresh_stats, _, _ = fresh.snapshot()
+    assert dims == fresh_dims
+    # Appended customers keep their codes after the existing ones, so compare values
+    for col in df.columns:
+        assert df[col].astype(object).equals(fresh_df[col].astype(object)), col
+    assert stats.keys() == fresh_stats.keys()
+    for name, value in stats.items():
+        assert value == fresh_stats[name] or np.isclose(value, fresh_stats[name]), name
+    for name, values in cube.measures.items():
+        assert np.allclose(values, fresh_cube.measures[name])
+    filters = {'date_range': ('2021-03-01', '2023-01-15'), 'malls': ['Kanyon'], 'genders': ['Female']}
+    assert np.array_equal(index.select(**filters), fresh_index.select(**filters))
+
+
+def test_appended_invoices_extend_the_store(sales_csv):
+    store = SalesStore.load(sales_csv)
+    first_key = store.key
+    appended = make_rows(40, start='2023-01-01', end='2023-01-20', seed=1, first_invoice=5000)
+    write_rows(sales_csv, appended, append=True)
+    previous_key, rows = store.refresh()
+    assert previous_key == first_key and store.key != first_key
+    assert len(rows) == 40 and len(store.df) == 2040
+    assert_same_contents(store, SalesStore.load(sales_csv))
+    # Nothing new: no version change
+    assert store.refresh() is None
+
+
+def test_out_of_order_appends_reload(sales_csv):
+    store = SalesStore.load(sales_csv)
+    first_key = store.key
+    write_rows(sales_csv, make_rows(10, start='2021-06-01', end='2021-06-30', seed=3, first_invoice=5000),
+               append=True)
+    assert store.refresh() is None
+    assert store.key != first_key and len(store.df) == 2010
+    assert store.df['invoice_date'].is_monotonic_increasing
+    assert_same_contents(store, SalesStore.load(sales_csv))
+
+
+def test_carry_over_after_an_append_keeps_untouched_results(sales_csv):
+    store = SalesStore.load(sales_csv)
+    cache = LRUCache('test store results', 10_000)
+    untouched = filter_key(store.dims, ('2021-01-01', '2021-12-31'))
+    touched = filter_key(store.dims)
+    cache.put((store.key, untouched), 'untouched', nbytes=10)
+    cache.put((store.key, touched), 'touched', nbytes=10)
+    write_rows(sales_csv, make_rows(5, start='2023-02-01', end='2023-02-05', seed=4, first_invoice=5000),
+               append=True)
+    previous_key, rows = store.refresh()
+    carry_over(previous_key, store.key, rows, caches=[cache])
+    assert cache.get((store.key, untouched)) == 'untouched'
+    assert cache.get((store.key, touched)) is None
+    assert isinstance(rows['invoice_date'].iloc[0], pd.Timestamp)
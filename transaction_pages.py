@@ -0,0 +1,113 @@
+"""
+Paged transaction browser
+The table under the charts shows one page of the filtered transactions in any
+column order without sorting, or even gathering, the whole selection. Rows are
+stored sorted by invoice_date, so date order is a walk over the selected row
+positions; any other column is ranked by partial selection (argpartition),
+which costs one linear pass plus a sort of the rows up to the requested page.
+"""
+import numpy as np
+import pandas as pd
+
+PAGE_ROWS = 100
+TABLE_COLUMNS = ['invoice_date', 'shopping_mall', 'category', 'quantity', 'price', 'total_amount',
+                 'payment_method', 'gender', 'age']
+
+
+def row_count(rows):
+    """Number of rows in a FilterIndex.select() result"""
+    if isinstance(rows, slice):
+        return rows.stop - rows.start
+    return len(rows)
+
+
+def page_count(rows, page_rows=PAGE_ROWS):
+    return max(1, -(-row_count(rows) // page_rows))
+
+
+def _positions(rows, start, stop):
+    """Row positions of selected rows start..stop, without expanding a slice selection"""
+    if isinstance(rows, slice):
+        return np.arange(rows.start + start, rows.start + stop)
+    return np.asarray(rows[start:stop])
+
+
+def _sort_keys(column, positions):
+    """Float keys ordering column at positions; NaN where the value is missing"""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        categories = column.cat.categories
+        codes = column.cat.codes.to_numpy()[positions]
+        if categories.is_monotonic_increasing:
+            rank = np.arange(len(categories), dtype=np.float64)
+        else:
+            # Categories appended after ingestion are not in sorted order
+            rank = np.empty(len(categories), dtype=np.float64)
+            rank[categories.argsort()] = np.arange(len(categories))
+        return np.where(codes >= 0, rank[codes], np.nan)
+    if isinstance(column.dtype, np.dtype) and column.dtype.kind in 'iufb':
+        return column.to_numpy()[positions].astype(np.float64)
+    if isinstance(column.dtype, np.dtype) and column.dtype.kind == 'M':
+        values = column.to_numpy()[positions]
+        keys = values.view('int64').astype(np.float64)
+        keys[np.isnat(values)] = np.nan
+        return keys
+    codes, _ = pd.factorize(column.iloc[positions], sort=True)
+    return np.where(codes >= 0, codes, np.nan)
+
+
+def _first_rows(keys, count):
+    """Indices of the count smallest keys, ordered by key then index"""
+    if count < len(keys):
+        # Partial selection: everything below the count-th smallest key, plus the
+        # lowest-indexed rows tied with it, so pages never overlap or skip ties
+        threshold = np.partition(keys, count - 1)[count - 1]
+        below = np.flatnonzero(keys < threshold)
+        ties = np.flatnonzero(keys == threshold)[:count - len(below)]
+        candidates = np.concatenate([below, ties])
+    else:
+        candidates = np.arange(len(keys))
+    return candidates[np.lexsort((candidates, keys[candidates]))]
+
+
+def page_rows(df, rows, sort_by='invoice_date', descending=True, page=0, page_rows=PAGE_ROWS):
+    """Row positions in df of one page of df.iloc[rows] sorted by sort_by
+
+    rows is a FilterIndex.select() result. Missing values come last in either
+    direction. Ties are in table order, except in descending date order, which
+    walks the table backwards and so reverses them. Either way the order is
+    fixed, so consecutive pages tile the selection.
+    """
+    total = row_count(rows)
+    start, stop = page * page_rows, min((page + 1) * page_rows, total)
+    if start >= stop:
+        return np.empty(0, dtype=np.int64)
+
+    if sort_by == 'invoice_date':
+        if not descending:
+            return _positions(rows, start, stop)
+        # Undated rows sit at the end of the table and stay last
+        dates = df['invoice_date'].to_numpy()
+        first_undated = int(np.searchsorted(dates, np.datetime64('NaT'), side='left'))
+        if isinstance(rows, slice):
+            dated = max(0, min(rows.stop, first_undated) - rows.start)
+        else:
+            dated = int(np.searchsorted(rows, first_undated, side='left'))
+        order = np.concatenate([np.arange(dated - 1 - start, max(dated - 1 - stop, -1), -1),
+                                np.arange(max(start, dated), stop)])
+        return rows.start + order if isinstance(rows, slice) else np.asarray(rows)[order]
+
+    positions = _positions(rows, 0, total)
+    keys = _sort_keys(df[sort_by], positions)
+    missing = np.isnan(keys)
+    present = np.flatnonzero(~missing)
+    keys = -keys[present] if descending else keys[present]
+    order = present[_first_rows(keys, min(stop, len(present)))]
+    order = np.concatenate([order, np.flatnonzero(missing)[:max(0, stop - len(present))]])
+    return positions[order[start:stop]]
+
+
+def format_page(df, positions):
+    """Display frame of the table columns at the given row positions"""
+    page = df.iloc[positions][TABLE_COLUMNS]
+    page['invoice_date'] = page['invoice_date'].dt.strftime('%Y-%m-%d')
+    return page